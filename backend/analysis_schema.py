@@ -0,0 +1,251 @@
+"""
+Response schema for Gemini structured output and a compiled validator for analyses
+The validator coerces types, repairs small deviations and reports the paths it could
+not repair so that only those fields need to be requested again
+"""
+
+import json
+import re
+
+PLAN_WEEKS = ('week_1', 'week_2', 'week_3', 'week_4')
+
+_STRING = {'type': 'string'}
+_STRING_LIST = {'type': 'array', 'items': _STRING}
+
+WEEK_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'focus': _STRING,
+        'tasks': _STRING_LIST
+    },
+    'required': ['focus', 'tasks']
+}
+
+PLAN_SCHEMA = {
+    'type': 'object',
+    'properties': {week: WEEK_SCHEMA for week in PLAN_WEEKS},
+    'required': list(PLAN_WEEKS)
+}
+
+# Narrative fields requested from Gemini; readiness_score/level are computed locally
+ANALYSIS_RESPONSE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'summary': _STRING,
+        'strengths': _STRING_LIST,
+        'weak_areas': _STRING_LIST,
+        'risk_factors': _STRING_LIST,
+        'recommendations': _STRING_LIST,
+        '30_day_plan': PLAN_SCHEMA
+    },
+    'required': ['summary', 'strengths', 'weak_areas', 'risk_factors', 'recommendations', '30_day_plan']
+}
+
+# Full stored analysis shape: narrative fields plus the (locally computed) score
+ANALYSIS_SCHEMA = {
+    'type': 'object',
+    'properties': dict(
+        ANALYSIS_RESPONSE_SCHEMA['properties'],
+        readiness_score={'type': 'integer', 'minimum': 0, 'maximum': 100},
+        readiness_level={'type': 'string', 'enum': ['Low', 'Medium', 'High']}
+    ),
+    'required': ['readiness_score', 'readiness_level'] + ANALYSIS_RESPONSE_SCHEMA['required']
+}
+
+_LIST_ITEM_SPLIT = re.compile(r'\n+|;\s*')
+_BULLET_PREFIX = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s*')
+_MISSING = object()
+
+
+def generation_config(schema=ANALYSIS_RESPONSE_SCHEMA):
+    """Gemini generation_config requesting JSON output that follows `schema`"""
+    return {'response_mime_type': 'application/json', 'response_schema': schema}
+
+
+def _compile_string():
+    def validate(value, path, missing):
+        if value is None:
+            missing.append(path)
+            return _MISSING
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, list):
+            return ' '.join(str(item).strip() for item in value)
+        return str(value)
+    return validate
+
+
+def _compile_integer(schema):
+    minimum = schema.get('minimum')
+    maximum = schema.get('maximum')
+
+    def validate(value, path, missing):
+        try:
+            number = int(round(float(value)))
+        except (TypeError, ValueError):
+            missing.append(path)
+            return _MISSING
+        if minimum is not None:
+            number = max(number, minimum)
+        if maximum is not None:
+            number = min(number, maximum)
+        return number
+    return validate
+
+
+def _compile_enum(schema):
+    by_lower = {option.lower(): option for option in schema['enum']}
+
+    def validate(value, path, missing):
+        option = by_lower.get(str(value).strip().lower()) if value is not None else None
+        if option is None:
+            missing.append(path)
+            return _MISSING
+        return option
+    return validate
+
+
+def _compile_array(schema):
+    validate_item = _compile(schema['items'])
+
+    def validate(value, path, missing):
+        if value is None:
+            missing.append(path)
+            return _MISSING
+        if isinstance(value, str):
+            # A bulleted/newline separated string instead of a list
+            value = [_BULLET_PREFIX.sub('', item) for item in _LIST_ITEM_SPLIT.split(value)]
+            value = [item for item in value if item.strip()]
+        elif not isinstance(value, list):
+            value = [value]
+        items = []
+        for index, item in enumerate(value):
+            item = validate_item(item, f"{path}[{index}]", [])
+            if item is not _MISSING:
+                items.append(item)
+        return items
+    return validate
+
+
+def _compile_object(schema):
+    properties = [(name, _compile(subschema)) for name, subschema in schema.get('properties', {}).items()]
+    required = set(schema.get('required', ()))
+    is_plan = set(schema.get('properties', {})) == set(PLAN_WEEKS)
+
+    def validate(value, path, missing):
+        if is_plan and isinstance(value, list):
+            # A list of weeks instead of week_1..week_4 keys
+            value = {f"week_{index + 1}": week for index, week in enumerate(value)}
+        if not isinstance(value, dict):
+            missing.append(path)
+            return _MISSING
+        result = dict(value)
+        for name, validate_property in properties:
+            property_path = f"{path}.{name}" if path else name
+            if name not in value:
+                if name in required:
+                    missing.append(property_path)
+                continue
+            coerced = validate_property(value[name], property_path, missing)
+            if coerced is _MISSING:
+                result.pop(name, None)
+            else:
+                result[name] = coerced
+        return result
+    return validate
+
+
+def _compile(schema):
+    if 'enum' in schema:
+        return _compile_enum(schema)
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        return _compile_object(schema)
+    if schema_type == 'array':
+        return _compile_array(schema)
+    if schema_type == 'integer':
+        return _compile_integer(schema)
+    return _compile_string()
+
+
+_validate_response = _compile(ANALYSIS_RESPONSE_SCHEMA)
+_validate_analysis = _compile(ANALYSIS_SCHEMA)
+
+
+def _repair_plan(analysis):
+    """Fill a week's missing focus from its first task (tasks are what the plan is built from)"""
+    plan = analysis.get('30_day_plan')
+    if not isinstance(plan, dict):
+        return
+    for week in PLAN_WEEKS:
+        week_value = plan.get(week)
+        if isinstance(week_value, dict) and not week_value.get('focus') and week_value.get('tasks'):
+            tasks = week_value['tasks']
+            if isinstance(tasks, list) and tasks:
+                week_value['focus'] = str(tasks[0])
+
+
+def validate_analysis(analysis, include_score=False):
+    """
+    Coerce and repair a parsed analysis
+    Returns (analysis, missing) where `missing` lists dotted paths (e.g. "30_day_plan.week_3")
+    that were absent or unrepairable
+    """
+    if isinstance(analysis, dict):
+        _repair_plan(analysis)
+    missing = []
+    validator = _validate_analysis if include_score else _validate_response
+    result = validator(analysis, '', missing)
+    if result is _MISSING:
+        return {}, ['']
+    return result, missing
+
+
+def extract_json(response_text):
+    """
+    Parse a JSON object from model output
+    Structured output is plain JSON; otherwise slice from the first '{' to the last '}'
+    (which also strips markdown fences) without splitting the text
+    """
+    try:
+        return json.loads(response_text)
+    except ValueError:
+        start = response_text.find('{')
+        end = response_text.rfind('}')
+        if start == -1 or end < start:
+            raise
+        return json.loads(response_text[start:end + 1])
+
+
+def schema_for_paths(paths):
+    """
+    Sub-schema of ANALYSIS_RESPONSE_SCHEMA covering only the given dotted paths,
+    used to re-ask the model for missing fields
+    """
+    properties = {}
+    for path in paths:
+        name, _, child = path.partition('.')
+        week = child.split('.', 1)[0]
+        if name == '30_day_plan' and week in PLAN_WEEKS:
+            plan = properties.setdefault(name, {'type': 'object', 'properties': {}, 'required': []})
+            if plan is not PLAN_SCHEMA and week not in plan['properties']:
+                plan['properties'][week] = WEEK_SCHEMA
+                plan['required'].append(week)
+        elif name in ANALYSIS_RESPONSE_SCHEMA['properties'] or not name:
+            if not name:
+                return ANALYSIS_RESPONSE_SCHEMA
+            properties[name] = ANALYSIS_RESPONSE_SCHEMA['properties'][name]
+    return {'type': 'object', 'properties': properties, 'required': list(properties)}
+
+
+def merge_analysis(base, patch):
+    """Merge a partial analysis (e.g. re-asked fields) into `base`, one level into 30_day_plan"""
+    for key, value in patch.items():
+        if key == '30_day_plan' and isinstance(value, dict) and isinstance(base.get(key), dict):
+            plan = dict(base[key], **value)
+            # Keep weeks in calendar order after filling gaps
+            base[key] = {week: plan.pop(week) for week in PLAN_WEEKS if week in plan}
+            base[key].update(plan)
+        else:
+            base[key] = value
+    return base
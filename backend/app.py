@@ -3,16 +3,38 @@ AI Placement Readiness & Skill Gap Analyzer - Flask Backend
 Main API server for handling analysis requests
 """
 
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-import google.generativeai as genai
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
 from dotenv import load_dotenv
 import json
 from datetime import datetime
+import time
 import uuid
+import copy
+import atexit
+import hmac
+from response_cache import create_response_cache, profile_cache_key
+from scoring import score_profile
+from streaming import AnalysisSectionParser, analysis_sections, format_sse
+from batch_jobs import create_batch_runner, parse_csv_profiles, parse_jsonl_profiles
+from rate_limit import RateLimitTimeout, create_rate_limiter, estimate_tokens
+from history_cache import create_history_cache
+from prompting import TokenUsageStats, render_profile_prompt, usage_from_response
+from analysis_schema import extract_json, generation_config, merge_analysis, schema_for_paths, validate_analysis
+from clients import LazySingleton, create_firestore_client, create_gemini_model
+from model_router import create_model_router
+from export_io import iter_ndjson_lines
+from cohorts import COHORT_DIMENSIONS, CohortRollups, rollup_deltas
+from incremental import affected_sections, changed_fields, describe_changes, render_delta_context
+from persistence import create_write_queue
+from storage import FIRESTORE_BATCH_LIMIT, InvalidCursor, create_store
+from similarity import adapt_analysis, create_similarity_index
+from plan_library import create_plan_library
+from job_queue import PRIORITIES, QueueFull, create_job_queue
+from response_encoding import OrjsonProvider, compact_history, create_response_compressor, install_json_provider
+from metrics import MetricsRegistry, StageTimer, server_timing_header
+from profiling import FORMATS as PROFILE_FORMATS, MODES as PROFILE_MODES, create_profiler
 
 # Load environment variables
 # Try to load from current directory first, then try absolute path for local development
@@ -28,62 +50,10 @@ else:
         # In production, environment variables are usually set directly
         load_dotenv(override=True)
 
-app = Flask(__name__)
-
-# Configure CORS for production
-# Allow requests from Firebase Hosting domains and localhost for development
-allowed_origins = [
-    "http://localhost:*",
-    "http://127.0.0.1:*",
-]
-
-# Add Firebase Hosting domains if provided via environment variable
-firebase_domain = os.getenv('FIREBASE_HOSTING_DOMAIN', '')
-if firebase_domain:
-    allowed_origins.extend([
-        f"https://{firebase_domain}",
-        f"https://{firebase_domain.replace('.web.app', '.firebaseapp.com')}",
-    ])
-
-# For production, allow all origins (you can restrict this later)
-# In production, you should set specific domains
-CORS(app, resources={
-    r"/*": {
-        "origins": "*",  # In production, replace with specific domains
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
-
-# Initialize Gemini AI
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-print("ENV GEMINI_API_KEY:", os.getenv("GEMINI_API_KEY"))
-
-
-
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-else:
-    model = None
-    print("Warning: GEMINI_API_KEY not set")
-
-# Initialize Firebase
-try:
-    cred_path = os.getenv('FIREBASE_CREDENTIALS_PATH')
-    if cred_path and os.path.exists(cred_path):
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        print("Firebase initialized successfully")
-    else:
-        db = None
-        print("Warning: Firebase credentials not found. Data storage disabled.")
-except Exception as e:
-    db = None
-    print(f"Warning: Firebase initialization failed: {e}")
+# API routes; registered on the Flask app by create_app()
+api = Blueprint('api', __name__)
 
-# Gemini System Prompt
+# Gemini System Prompt (sent once per model as its system instruction)
 SYSTEM_PROMPT = """You are an ethical AI Placement Readiness Analyzer designed to help students evaluate their preparation and identify skill gaps.
 
 CRITICAL ETHICAL GUIDELINES:
@@ -151,165 +121,851 @@ You MUST respond with valid JSON only, no additional text. Use this exact struct
 
 Remember: Be encouraging, constructive, and focus on growth opportunities."""
 
-def analyze_student_profile(student_data):
+# Gemini models and Firestore client are created on first use (see clients.py)
+# GEMINI_MODELS lists several models for tiered routing (see model_router.py)
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+gemini_model = LazySingleton(
+    lambda: create_model_router(
+        GEMINI_MODEL_NAME,
+        lambda model_name: create_gemini_model(model_name, SYSTEM_PROMPT, generation_config()),
+        on_decision=lambda decision, model_name: model_router_decisions.inc(decision=decision, model=model_name),
+        # Hedge and failover calls are extra Gemini requests and must fit in GEMINI_RPM/GEMINI_TPM too
+        reserve=lambda prompt: gemini_limiter.try_acquire(prompt)
+    ),
+    'Gemini'
+)
+firestore_db = LazySingleton(create_firestore_client, 'Firebase')
+# Where analyses are stored: Firestore or a local SQLite database (STORAGE_BACKEND, see storage.py)
+storage = LazySingleton(lambda: create_store(get_db), 'Storage')
+# Durable queue of /analyze?async=1 jobs, drained by worker.py processes
+job_queue = LazySingleton(create_job_queue, 'Job queue')
+
+def get_model():
+    """Gemini model router, initialized on first use (None if not configured)"""
+    return gemini_model.get()
+
+def get_db():
+    """Firestore client, initialized on first use (None if not configured)"""
+    return firestore_db.get()
+
+def get_store():
+    """Storage backend, initialized on first use (None if not configured)"""
+    return storage.get()
+
+def get_job_queue():
+    """Analysis job queue, opened on first use (None if it could not be opened)"""
+    return job_queue.get()
+
+def reset_clients():
     """
-    Analyze student profile using Gemini AI
-    Returns structured analysis results
+    Drop SDK clients so they are re-created in the current process
+    Called after fork; gRPC channels must not be shared between processes
     """
-    if not model:
-        raise Exception("Gemini API not configured")
-    
-    # Format student data for prompt
-    prompt = f"""Analyze the following student profile:
+    gemini_model.reset()
+    firestore_db.reset()
+    storage.reset()
+    job_queue.reset()
+
+# Cache of analysis results keyed on the normalized student profile
+analysis_cache = create_response_cache()
+
+# Per-user history cache, updated in place when analyses are saved
+history_cache = create_history_cache()
 
-Personal Information:
-- Name: {student_data.get('name', 'N/A')}
-- Location: {student_data.get('location', 'N/A')}
-- College: {student_data.get('college', 'N/A')}
-- College Tier: {student_data.get('college_tier', 'N/A')}
-- Qualification: {student_data.get('qualification', 'N/A')}
-- Department: {student_data.get('department', 'N/A')}
+# Past analyses of near-identical profiles, reused instead of a full Gemini call (SIMILARITY_MODE)
+similarity_index = create_similarity_index()
 
-Academic Performance:
-- CGPA: {student_data.get('cgpa', 0)}/10
-- Attendance: {student_data.get('attendance', 0)}%
+# Recommendation/plan fragments served when Gemini cannot answer (DEGRADED_MODE, see plan_library.py)
+plan_library = create_plan_library()
 
-Achievements:
-- Hackathons: {student_data.get('hackathons', 'None')}
-- Mastered Languages/Technologies: {student_data.get('technologies', 'None')}
-- Certifications: {student_data.get('certifications', 'None')}
-- Projects: {student_data.get('projects', 'None')}
+# Client-side RPM/TPM limits, retries and request coalescing for Gemini calls
+gemini_limiter = create_rate_limiter()
+# The system instruction counts against TPM on every call even though it is not in the prompt
+gemini_limiter.static_prompt_tokens = estimate_tokens(SYSTEM_PROMPT)
 
-Skills & Experience:
-- DSA Practice Frequency: {student_data.get('dsa_practice_frequency', 'N/A')}
-- Internships: {len(student_data.get('internships', []))} internship(s)
-{chr(10).join([f"  - {internship.get('company', 'N/A')} ({internship.get('duration', 'N/A')})" for internship in student_data.get('internships', [])]) if student_data.get('internships') else "  - None"}
-- Mock Interview Score: {student_data.get('mock_interview_score', 0)}/10
-- Resume Completeness: {student_data.get('resume_score', 0)}/100
+# Token usage and time-to-first-token of Gemini calls
+token_usage_stats = TokenUsageStats()
 
-Provide your analysis following the JSON format specified in the system prompt."""
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry()
+request_latency = metrics.histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                                    ('method', 'endpoint', 'status'))
+stage_timer = StageTimer(metrics.histogram('analysis_stage_duration_seconds', 'Latency of request handling stages',
+                                           ('stage',)))
+gemini_tokens = metrics.counter('gemini_tokens_total', 'Gemini tokens by kind (prompt, cached, output)', ('kind',))
+gemini_errors = metrics.counter('gemini_errors_total', 'Gemini errors by class', ('kind',))
+model_router_decisions = metrics.counter('model_router_decisions_total', 'Model router hedges and failovers',
+                                         ('decision', 'model'))
+similarity_lookups = metrics.counter('similarity_lookups_total', 'Near-duplicate lookups by mode and result',
+                                     ('mode', 'result'))
+degraded_analyses = metrics.counter('degraded_analyses_total', 'Analyses assembled from the plan library, by reason',
+                                    ('reason',))
+profile_captures = metrics.counter('profile_captures_total', 'Profiled requests by profiler mode', ('mode',))
+response_size = metrics.histogram('http_response_size_bytes', 'Response body size as sent, by endpoint and encoding',
+                                  ('endpoint', 'encoding'),
+                                  buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
 
-    # Check if model is available
-    if model is None:
-        raise Exception("Gemini API is not configured. Please check your API key.")
+# Negotiated gzip/br compression of buffered responses (RESPONSE_COMPRESSION, see response_encoding.py)
+response_compressor = create_response_compressor()
+
+# Request header that asks for the stage timings back in a Server-Timing header
+TRACE_HEADER = 'X-Trace'
+
+# Admin requests with this header are profiled: "sampling", "cprofile" or "1" (the configured mode)
+PROFILE_HEADER = 'X-Profile'
+
+# Sampled request profiling (PROFILE_* settings, changed at runtime through /admin/profiling)
+profiler = create_profiler()
+
+# Profile fields required by /analyze (also the fields the analysis cache keys on)
+REQUIRED_PROFILE_FIELDS = ['name', 'location', 'college', 'college_tier', 'qualification', 'department', 'cgpa',
+                           'attendance', 'hackathons', 'technologies', 'certifications', 'projects',
+                           'dsa_practice_frequency', 'internships',
+                           'mock_interview_score', 'resume_score']
+
+def record_token_usage(response_usage, first_token_seconds, total_seconds):
+    """Record a Gemini call's token usage in the usage stats and metrics"""
+    token_usage_stats.record(response_usage, first_token_seconds, total_seconds)
+    if response_usage:
+        for kind in ('prompt', 'cached', 'output'):
+            gemini_tokens.inc(response_usage[f'{kind}_tokens'], kind=kind)
+
+def parse_analysis_response(response_text):
+    """
+    Parse, coerce and repair the analysis JSON from a Gemini response
+    Returns (analysis_result, missing) where missing lists the fields that could not be repaired
+    """
+    try:
+        analysis_result = extract_json(response_text)
+    except ValueError:
+        # Unparseable output: everything has to be requested again
+        return {}, ['']
+    
+    return validate_analysis(analysis_result)
+
+def call_gemini(model, fn, prompt):
+    """
+    Run a Gemini call under the rate limiter
+    A multi-model router already retries by failing over, so the limiter does not retry it again
+    """
+    retries_failures = getattr(model, 'retries_failures', False)
+    return gemini_limiter.call(fn, prompt, max_retries=0 if retries_failures else None)
+
+def request_missing_fields(student_data, local_score, analysis_result, missing, context=''):
+    """
+    Re-ask Gemini only for the given fields (dotted paths) of the analysis and merge them in
+    `context` is extra prompt text, e.g. what changed since a previous analysis
+    """
+    prompt = render_profile_prompt(student_data, local_score)
+    if context:
+        prompt += f"\n{context}"
+    if missing != ['']:
+        prompt += f"\nReturn only these fields of the analysis: {', '.join(missing)}."
+    config = generation_config(schema_for_paths(missing))
+    model = get_model()
+    
+    print(f"Re-requesting analysis fields: {', '.join(missing) or 'all'}")
+    with stage_timer.stage('gemini_reask'):
+        started_at = time.perf_counter()
+        response = call_gemini(model, lambda: model.generate_content(prompt, generation_config=config), prompt)
+        elapsed = time.perf_counter() - started_at
+    if not response or not hasattr(response, 'text') or not response.text:
+        raise Exception("Empty response from Gemini API")
+    record_token_usage(usage_from_response(response), elapsed, elapsed)
+    
+    patch = extract_json(response.text)
+    analysis_result, missing = validate_analysis(merge_analysis(analysis_result, patch))
+    
+    # Validate required fields
+    if missing:
+        raise ValueError(f"Missing required field: {missing[0] or 'analysis'}")
+    
+    return analysis_result
+
+def complete_analysis(student_data, local_score, response_text):
+    """
+    Turn raw model output into a validated analysis, re-asking for unrepairable fields
+    The deterministic local score is authoritative
+    """
+    with stage_timer.stage('parse'):
+        analysis_result, missing = parse_analysis_response(response_text)
+    if missing:
+        analysis_result = request_missing_fields(student_data, local_score, analysis_result, missing)
+    
+    analysis_result.update(local_score)
+    return analysis_result
+
+def gemini_error(e):
+    """
+    Translate a Gemini SDK/parse error into a user-facing exception
+    """
+    if isinstance(e, json.JSONDecodeError):
+        gemini_errors.inc(kind='parse')
+        return Exception(f"Failed to parse Gemini response as JSON: {e}")
+    if isinstance(e, RateLimitTimeout):
+        gemini_errors.inc(kind='rate_limit')
+        return Exception("API rate limit exceeded. Please wait a moment and try again.")
+    
+    error_str = str(e)
+    # Handle quota exceeded errors specifically
+    if "429" in error_str or "quota" in error_str.lower() or "exceeded" in error_str.lower():
+        gemini_errors.inc(kind='quota')
+        # Extract retry time if available
+        if "retry" in error_str.lower() or "seconds" in error_str.lower():
+            return Exception("API quota exceeded. You've reached the daily limit. Please try again tomorrow or upgrade your API plan.")
+        else:
+            return Exception("API quota exceeded. You've reached the daily limit (20 requests/day on free tier). Please try again tomorrow or upgrade your API plan.")
+    # Handle rate limit errors
+    elif "rate limit" in error_str.lower():
+        gemini_errors.inc(kind='rate_limit')
+        return Exception("API rate limit exceeded. Please wait a moment and try again.")
+    # Handle API key errors
+    elif "api key" in error_str.lower() or "401" in error_str or "403" in error_str:
+        gemini_errors.inc(kind='auth')
+        return Exception("Invalid or missing Gemini API key. Please check your API configuration.")
+    # Generic error
+    else:
+        gemini_errors.inc(kind='other')
+        return Exception(f"Gemini API error: {error_str}")
+
+def analyze_student_profile(student_data, local_score=None):
+    """
+    Analyze student profile using Gemini AI
+    Returns structured analysis results
+    The readiness score is computed locally; Gemini only writes the narrative fields
+    """
+    model = get_model()
+    if not model:
+        raise Exception("Gemini API not configured")
+    
+    if local_score is None:
+        local_score = score_profile(student_data)
+    
+    # Compact per-profile prompt; SYSTEM_PROMPT is the model's system instruction
+    with stage_timer.stage('prompt'):
+        prompt = render_profile_prompt(student_data, local_score)
     
     try:
-        # Combine system prompt with user prompt
-        full_prompt = f"{SYSTEM_PROMPT}\n\n{prompt}"
-        
-        response = model.generate_content(full_prompt)
+        started_at = time.perf_counter()
+        with stage_timer.stage('gemini_call'):
+            response = call_gemini(model, lambda: model.generate_content(prompt), prompt)
+        elapsed = time.perf_counter() - started_at
         
         # Check if response is valid
         if not response or not hasattr(response, 'text') or not response.text:
             raise Exception("Empty response from Gemini API")
         
-        # Extract JSON from response
-        response_text = response.text.strip()
-        
-        # Try to extract JSON if wrapped in markdown code blocks
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
+        record_token_usage(usage_from_response(response), elapsed, elapsed)
         
-        # Parse JSON
-        analysis_result = json.loads(response_text)
-        
-        # Validate required fields
-        required_fields = ['readiness_score', 'readiness_level', 'summary', 'strengths', 
-                          'weak_areas', 'risk_factors', 'recommendations', '30_day_plan']
-        for field in required_fields:
-            if field not in analysis_result:
-                raise ValueError(f"Missing required field: {field}")
-        
-        return analysis_result
+        return complete_analysis(student_data, local_score, response.text)
     
-    except json.JSONDecodeError as e:
-        raise Exception(f"Failed to parse Gemini response as JSON: {e}")
     except Exception as e:
-        error_str = str(e)
-        # Handle quota exceeded errors specifically
-        if "429" in error_str or "quota" in error_str.lower() or "exceeded" in error_str.lower():
-            # Extract retry time if available
-            if "retry" in error_str.lower() or "seconds" in error_str.lower():
-                raise Exception("API quota exceeded. You've reached the daily limit. Please try again tomorrow or upgrade your API plan.")
-            else:
-                raise Exception("API quota exceeded. You've reached the daily limit (20 requests/day on free tier). Please try again tomorrow or upgrade your API plan.")
-        # Handle rate limit errors
-        elif "rate limit" in error_str.lower():
-            raise Exception("API rate limit exceeded. Please wait a moment and try again.")
-        # Handle API key errors
-        elif "api key" in error_str.lower() or "401" in error_str or "403" in error_str:
-            raise Exception("Invalid or missing Gemini API key. Please check your API configuration.")
-        # Generic error
-        else:
-            raise Exception(f"Gemini API error: {error_str}")
+        raise gemini_error(e)
 
-def save_to_firebase(student_data, analysis_result):
+def stream_student_analysis(student_data, local_score):
     """
-    Save student profile and analysis to Firebase Firestore
+    Analyze student profile using Gemini streaming generation
+    Yields (event, data) pairs as sections of the analysis complete,
+    ending with ('analysis', <full validated analysis>)
     """
-    if not db:
-        return None
+    model = get_model()
+    if not model:
+        raise Exception("Gemini API not configured")
+    
+    prompt = render_profile_prompt(student_data, local_score)
+    parser = AnalysisSectionParser()
+    chunks = []
     
     try:
-        # Create document with unique ID
-        doc_id = str(uuid.uuid4())
+        # Streams are not retried mid-way, but still wait for rate-limit capacity
+        gemini_limiter.acquire(prompt, time.monotonic() + gemini_limiter.queue_timeout)
         
-        # Get user_id from request data
-        user_id = student_data.get('user_id', '')
+        started_at = time.perf_counter()
+        first_token_seconds = None
+        usage = None
+        for chunk in model.generate_content(prompt, stream=True):
+            usage = usage_from_response(chunk) or usage
+            text = getattr(chunk, 'text', '')
+            if not text:
+                continue
+            if first_token_seconds is None:
+                first_token_seconds = time.perf_counter() - started_at
+            chunks.append(text)
+            for event, data in parser.feed(text):
+                yield event, data
         
-        # Prepare document data
-        document_data = {
-            'user_id': user_id,  # Link to user account
-            'student_profile': {
-                'name': student_data.get('name', ''),
-                'location': student_data.get('location', ''),
-                'college': student_data.get('college', ''),
-                'college_tier': student_data.get('college_tier', ''),
-                'qualification': student_data.get('qualification', ''),
-                'department': student_data.get('department', ''),
-                'cgpa': student_data.get('cgpa', 0),
-                'attendance': student_data.get('attendance', 0),
-                'hackathons': student_data.get('hackathons', ''),
-                'technologies': student_data.get('technologies', ''),
-                'certifications': student_data.get('certifications', ''),
-                'projects': student_data.get('projects', ''),
-                'dsa_practice_frequency': student_data.get('dsa_practice_frequency', 'N/A'),
-                'internships': student_data.get('internships', []),
-                'mock_interview_score': student_data.get('mock_interview_score', 0),
-                'resume_score': student_data.get('resume_score', 0)
-            },
-            'analysis': analysis_result,
-            'timestamp': datetime.now().isoformat(),
-            'readiness_score': analysis_result['readiness_score'],
-            'readiness_level': analysis_result['readiness_level']
-        }
+        if not chunks:
+            raise Exception("Empty response from Gemini API")
         
-        # Save to Firestore
-        doc_ref = db.collection('student_analyses').document(doc_id)
-        doc_ref.set(document_data)
+        record_token_usage(usage, first_token_seconds, time.perf_counter() - started_at)
         
-        return doc_id
+        yield 'analysis', complete_analysis(student_data, local_score, ''.join(chunks))
     
     except Exception as e:
-        print(f"Firebase save error: {e}")
+        raise gemini_error(e)
+
+def build_analysis_document(student_data, analysis_result, extra_fields=None):
+    """
+    Build the Firestore document for a student profile and its analysis
+    extra_fields (e.g. version lineage) are added to the top level
+    """
+    # Get user_id from request data
+    user_id = student_data.get('user_id', '')
+    
+    document_data = {
+        'user_id': user_id,  # Link to user account
+        'student_profile': {
+            'name': student_data.get('name', ''),
+            'location': student_data.get('location', ''),
+            'college': student_data.get('college', ''),
+            'college_tier': student_data.get('college_tier', ''),
+            'qualification': student_data.get('qualification', ''),
+            'department': student_data.get('department', ''),
+            'cgpa': student_data.get('cgpa', 0),
+            'attendance': student_data.get('attendance', 0),
+            'hackathons': student_data.get('hackathons', ''),
+            'technologies': student_data.get('technologies', ''),
+            'certifications': student_data.get('certifications', ''),
+            'projects': student_data.get('projects', ''),
+            'dsa_practice_frequency': student_data.get('dsa_practice_frequency', 'N/A'),
+            'internships': student_data.get('internships', []),
+            'mock_interview_score': student_data.get('mock_interview_score', 0),
+            'resume_score': student_data.get('resume_score', 0)
+        },
+        'analysis': analysis_result,
+        'timestamp': datetime.now().isoformat(),
+        'readiness_score': analysis_result['readiness_score'],
+        'readiness_level': analysis_result['readiness_level']
+    }
+    if extra_fields:
+        document_data.update(extra_fields)
+    return document_data
+
+# Each document can also touch one cohort rollup per dimension plus the overall one
+DOCUMENTS_PER_BATCH = FIRESTORE_BATCH_LIMIT // (len(COHORT_DIMENSIONS) + 2)
+
+# In-memory view of the cohort rollups, kept current as documents are committed
+cohort_rollups = CohortRollups(refresh_seconds=float(os.getenv('COHORT_REFRESH_SECONDS', 60)))
+
+def commit_documents(entries):
+    """
+    Write (doc_id, document_data) pairs in batched writes to the storage backend
+    The cohort rollups are incremented in the same batch, only for documents not stored yet,
+    so a retried or replayed write is not counted twice
+    Runs on the write-behind worker; committed chunks are removed from `entries` before
+    raising, so the worker retries or journals only what was not written
+    """
+    store = get_store()
+    if not store:
+        raise Exception("Storage not configured")
+    
+    while entries:
+        chunk = entries[:DOCUMENTS_PER_BATCH]
+        with stage_timer.stage(f'{store.name}_query'):
+            existing = store.existing([doc_id for doc_id, _ in chunk])
+        new_documents = {doc_id: document_data for doc_id, document_data in chunk if doc_id not in existing}
+        deltas = rollup_deltas(new_documents.values())
+        with stage_timer.stage(f'{store.name}_commit'):
+            store.commit(chunk, deltas)
+        cohort_rollups.apply(deltas)
+        del entries[:len(chunk)]
+
+# Documents are written by a background worker; requests only enqueue them
+write_queue = create_write_queue(commit_documents)
+atexit.register(write_queue.shutdown)
+metrics.gauge('write_queue_depth', 'Documents waiting to be written', lambda: write_queue.stats()['depth'])
+metrics.gauge('write_queue_lag_seconds', 'Age of the oldest queued write', lambda: write_queue.stats()['lag_seconds'])
+metrics.gauge('analysis_jobs_queued', 'Async analysis jobs waiting for a worker',
+              lambda: job_queue.get().stats()['queued'] if job_queue.initialized and job_queue.get() else 0)
+
+def save_to_firebase(student_data, analysis_result, extra_fields=None):
+    """
+    Queue a student profile and analysis for saving to the storage backend
+    Returns the document ID immediately; the write happens on the write-behind worker
+    """
+    with stage_timer.stage('save'):
+        return save_many_to_firebase([(student_data, analysis_result, extra_fields)])[0]
+
+def save_many_to_firebase(entries):
+    """
+    Queue many (student_data, analysis_result[, extra_fields]) entries for saving
+    The worker groups queued documents into batched writes
+    Returns one document ID per entry (None where storage is disabled)
+    """
+    if not get_store():
+        return [None] * len(entries)
+    
+    doc_ids = []
+    for entry in entries:
+        try:
+            doc_id = str(uuid.uuid4())
+            document_data = build_analysis_document(*entry)
+            write_queue.enqueue(doc_id, document_data)
+            
+            # Keep the user's cached history current (also covers the write's lag)
+            history_cache.record(document_data['user_id'], format_history_entry(doc_id, document_data))
+            doc_ids.append(doc_id)
+        except Exception as e:
+            print(f"Firebase save error: {e}")
+            doc_ids.append(None)
+    
+    return doc_ids
+
+# Prompt text for a summary rewritten on top of a reused analysis
+TEMPLATE_CONTEXT = ("The rest of the analysis was written for a closely matching profile. "
+                    "Write the summary for this student's own profile.")
+
+def reuse_similar_analysis(student_data, local_score):
+    """
+    Adapt the past analysis of a near-identical profile, per SIMILARITY_MODE
+    Returns (analysis_result, reuse) or (None, None) when no close enough profile is indexed
+    """
+    if not similarity_index.enabled:
+        return None, None
+    with stage_timer.stage('similarity'):
+        match = similarity_index.nearest(student_data, local_score['readiness_level'])
+    if match is None:
+        similarity_lookups.inc(mode=similarity_index.mode, result='miss')
+        return None, None
+    
+    source_profile, analysis, distance = match
+    analysis_result = adapt_analysis(analysis, source_profile, student_data)
+    if analysis_result is None:
+        # The past analysis still names its own student
+        similarity_lookups.inc(mode=similarity_index.mode, result='identity')
+        return None, None
+    if similarity_index.mode == 'template':
+        try:
+            analysis_result = request_missing_fields(student_data, local_score, analysis_result, ['summary'],
+                                                     TEMPLATE_CONTEXT)
+        except Exception as e:
+            # Fall back to a full analysis
+            print(f"Template summary failed, running a full analysis: {e}")
+            similarity_lookups.inc(mode=similarity_index.mode, result='error')
+            return None, None
+    
+    similarity_lookups.inc(mode=similarity_index.mode, result='hit')
+    analysis_result.update(local_score)
+    return analysis_result, {'mode': similarity_index.mode, 'distance': round(distance, 4)}
+
+def analyze_with_cache(student_data, local_score=None):
+    """
+    Run analyze_student_profile(), reusing a cached result for an identical profile or,
+    when SIMILARITY_MODE is set, the past analysis of a near-identical one
+    Returns (analysis_result, cached, reuse) where reuse describes a near-duplicate reuse (else None)
+    """
+    cache_key = profile_cache_key(student_data, REQUIRED_PROFILE_FIELDS)
+    analysis_result = analysis_cache.get(cache_key)
+    if analysis_result is not None:
+        return analysis_result, True, None
+    if local_score is None:
+        local_score = score_profile(student_data)
+    
+    # Concurrent submits of the same profile share one upstream call
+    def run_analysis():
+        analysis_result, reuse = reuse_similar_analysis(student_data, local_score)
+        if analysis_result is None:
+            analysis_result = analyze_student_profile(student_data, local_score)
+            similarity_index.add(student_data, analysis_result)
+        analysis_cache.set(cache_key, analysis_result)
+        return analysis_result, reuse
+    
+    analysis_result, reuse = gemini_limiter.flights.do(cache_key, run_analysis)
+    return analysis_result, False, reuse
+
+def load_analysis_document(doc_id):
+    """Stored analysis document by ID (including writes still queued), or None"""
+    store = get_store()
+    if not store:
         return None
+    document_data = store.get(doc_id)
+    if document_data is not None:
+        return document_data
+    # Just saved and still waiting in the write-behind queue
+    return write_queue.pending(doc_id)
 
-@app.route('/health', methods=['GET'])
+def analyze_incremental(student_data, local_score, previous):
+    """
+    Update a previous analysis document for a resubmitted profile
+    Only the sections affected by the changed fields are regenerated; an unchanged
+    profile reuses the previous analysis with no Gemini call
+    Returns (analysis_result, delta) where delta lists the changed fields and regenerated
+    sections (delta is None when a full analysis was run instead)
+    """
+    previous_profile = previous.get('student_profile') or {}
+    previous_analysis, unrepairable = validate_analysis(copy.deepcopy(previous.get('analysis') or {}))
+    changed = changed_fields(previous_profile, student_data, REQUIRED_PROFILE_FIELDS)
+    sections = affected_sections(changed, previous_analysis, previous.get('readiness_level'),
+                                 local_score['readiness_level'])
+    
+    # Too many changes or a damaged previous analysis: regenerate everything
+    if sections is None or unrepairable:
+        analysis_result, _, _ = analyze_with_cache(student_data, local_score)
+        return analysis_result, None
+    
+    analysis_result = previous_analysis
+    if sections:
+        context = render_delta_context(describe_changes(previous_profile, student_data, changed),
+                                       previous_analysis, sections)
+        try:
+            analysis_result = request_missing_fields(student_data, local_score, analysis_result, sections, context)
+        except Exception as e:
+            raise gemini_error(e)
+    
+    analysis_result.update(local_score)
+    return analysis_result, {'changed_fields': changed, 'regenerated_sections': sections}
+
+def validate_student_profile(data):
+    """
+    Validate a student profile submitted for analysis
+    Returns an error message, or None if the profile is valid
+    """
+    if not isinstance(data, dict):
+        return 'Student profile must be a JSON object'
+    
+    # Validate required fields
+    missing_fields = [field for field in REQUIRED_PROFILE_FIELDS if field not in data]
+    if missing_fields:
+        return f'Missing required fields: {", ".join(missing_fields)}'
+    
+    # Validate data ranges
+    if data.get('attendance', 0) < 0 or data.get('attendance', 0) > 100:
+        return 'Attendance must be between 0 and 100'
+    if data.get('cgpa', 0) < 0 or data.get('cgpa', 0) > 10:
+        return 'CGPA must be between 0 and 10'
+    # Validate DSA frequency
+    valid_dsa_frequencies = ['Daily', 'Weekly', 'Monthly']
+    if 'dsa_practice_frequency' in data and data.get('dsa_practice_frequency') not in valid_dsa_frequencies:
+        return 'DSA practice frequency must be Daily, Weekly, or Monthly'
+    
+    # Validate internships
+    if 'internships' in data:
+        internships = data.get('internships', [])
+        if not isinstance(internships, list):
+            return 'Internships must be a list'
+        valid_durations = ['1 month', '3 months', '6 months', '1 year']
+        for internship in internships:
+            if not isinstance(internship, dict):
+                return 'Each internship must be an object with company and duration'
+            if 'duration' in internship and internship.get('duration') not in valid_durations:
+                return 'Internship duration must be 1 month, 3 months, 6 months, or 1 year'
+    if data.get('mock_interview_score', 0) < 0 or data.get('mock_interview_score', 0) > 10:
+        return 'Mock interview score must be between 0 and 10'
+    if data.get('resume_score', 0) < 0 or data.get('resume_score', 0) > 100:
+        return 'Resume score must be between 0 and 100'
+    
+    return None
+
+def error_status_code(error_message):
+    """
+    Determine the HTTP status code for an analysis error message
+    """
+    status_code = 500
+    if "quota" in error_message.lower() or "exceeded" in error_message.lower():
+        status_code = 429  # Too Many Requests
+    elif "not configured" in error_message.lower() or "api key" in error_message.lower():
+        status_code = 503  # Service Unavailable
+    elif "Missing required" in error_message or "must be between" in error_message:
+        status_code = 400  # Bad Request
+    return status_code
+
+def require_admin():
+    """
+    Error response for requests without the admin token, else None
+    Admin endpoints are disabled unless ADMIN_TOKEN is set
+    """
+    if not os.getenv('ADMIN_TOKEN', ''):
+        return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)', 'success': False}), 403
+    if not is_admin_request():
+        return jsonify({'error': 'Invalid admin token', 'success': False}), 401
+    return None
+
+def is_admin_request():
+    """Whether the request carries the admin token (always False while ADMIN_TOKEN is unset)"""
+    admin_token = os.getenv('ADMIN_TOKEN', '')
+    supplied = request.headers.get('Authorization', '')
+    return bool(admin_token) and hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {admin_token}".encode('utf-8'))
+
+# Background runner for /analyze/batch jobs
+batch_runner = create_batch_runner(
+    lambda student_data: analyze_with_cache(student_data)[0],
+    save_many_to_firebase,
+    validate_student_profile,
+    # Job state lives in the job queue database, shared by every worker process
+    get_job_queue
+)
+
+# Upper bound on profiles accepted in a single batch
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+
+@api.before_app_request
+def start_write_queue():
+    """Start this worker's write-behind thread, replaying any journal left by a previous run"""
+    if get_store():
+        write_queue.ensure_started()
+
+# Stored document fields the similarity index is loaded from
+SIMILARITY_LOAD_FIELDS = ['student_profile', 'analysis', 'reuse', 'delta', 'degraded']
+
+@api.before_app_request
+def load_similarity_index():
+    """Index stored analyses on this worker's first request when near-duplicate reuse is on"""
+    store = get_store() if similarity_index.enabled else None
+    if store:
+        similarity_index.ensure_loaded(lambda: store.iter_recent_documents(fields=SIMILARITY_LOAD_FIELDS))
+
+@api.before_app_request
+def start_request_timing():
+    g.request_started_at = time.perf_counter()
+    stage_timer.start()
+
+@api.before_app_request
+def start_profiling():
+    """Profile the request when an admin sends the X-Profile header, or when it is picked at the sampled rate"""
+    requested = request.headers.get(PROFILE_HEADER)
+    if requested and not is_admin_request():
+        requested = None
+    mode = profiler.choose_mode(requested)
+    session = profiler.begin(mode, stage_timer.active_stages()) if mode else None
+    if session is not None:
+        g.profile_session = session
+
+@api.after_app_request
+def record_request_timing(response):
+    """Record request latency; echo stage timings when the trace header is set"""
+    timings = stage_timer.finish()
+    started_at = g.get('request_started_at')
+    if started_at is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe(time.perf_counter() - started_at,
+                                method=request.method, endpoint=endpoint, status=response.status_code)
+    if request.headers.get(TRACE_HEADER) and timings:
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+@api.after_app_request
+def compress_response(response):
+    """Compress the body in the client's preferred encoding and record its size (runs before request timing)"""
+    with stage_timer.stage('compress'):
+        encoding = response_compressor.compress(response, request.accept_encodings)
+    if not response.is_streamed:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        response_size.observe(response.content_length or 0, endpoint=endpoint, encoding=encoding or 'identity')
+    return response
+
+@api.after_app_request
+def finish_profiling(response):
+    """
+    Stop the request's profiler once the response has been sent and write the capture
+    Runs before the request timing hook, which clears the stage timings it records
+    """
+    session = g.pop('profile_session', None)
+    if session is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    capture_id = profiler.new_capture_id(endpoint)
+    response.headers['X-Profile-Capture'] = capture_id
+    stage_timings = stage_timer.timings()
+    started_at = g.get('request_started_at', time.perf_counter())
+    request_meta = {'method': request.method, 'path': request.path, 'endpoint': endpoint,
+                    'status': response.status_code}
+    
+    def write_capture():
+        request_meta['duration_seconds'] = round(time.perf_counter() - started_at, 6)
+        result = profiler.end(session)
+        try:
+            profiler.write_capture(capture_id, session, result, request_meta, stage_timings)
+            profile_captures.inc(mode=session.mode)
+        except Exception as e:
+            print(f"Warning: Could not write profile capture {capture_id}: {e}")
+    
+    response.call_on_close(write_capture)
+    return response
+
+@api.teardown_app_request
+def abandon_profiling(error):
+    """Stop a profiler left running by a request that failed before its response was built"""
+    session = g.pop('profile_session', None)
+    if session is not None:
+        profiler.end(session)
+
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    model = get_model()
+    store = get_store()
     return jsonify({
         'status': 'healthy',
         'gemini_configured': model is not None,
-        'firebase_configured': db is not None
+        'model_router': model.stats() if hasattr(model, 'stats') else None,
+        'firebase_configured': store is not None and store.name == 'firestore',
+        'storage': store.stats() if store is not None else None,
+        'analysis_cache': analysis_cache.stats(),
+        'gemini_rate_limit': gemini_limiter.stats(),
+        'history_cache': history_cache.stats(),
+        'write_queue': write_queue.stats(),
+        'similarity': similarity_index.stats(),
+        'plan_library': plan_library.stats(),
+        'profiling': profiler.stats(),
+        'response_encoding': {
+            'json': 'orjson' if isinstance(current_app.json, OrjsonProvider) else 'stdlib',
+            'compression': list(response_compressor.encodings) if response_compressor.enabled else []
+        },
+        'job_queue': job_queue.get().stats() if job_queue.initialized and job_queue.get() else None,
+        'token_usage': token_usage_stats.stats()
     })
 
-@app.route('/analyze', methods=['POST'])
+def degraded_reason(error_message):
+    """Why Gemini could not answer (quota, rate_limit, unavailable), or None for errors degraded mode does not cover"""
+    lowered = error_message.lower()
+    if 'quota' in lowered:
+        return 'quota'
+    if 'rate limit' in lowered:
+        return 'rate_limit'
+    if ('not configured' in lowered or 'api key' in lowered or 'gemini api error' in lowered
+            or 'empty response' in lowered):
+        return 'unavailable'
+    return None
+
+def degraded_analysis(student_data, local_score, reason):
+    """Analysis assembled from the plan library (no Gemini call); returns (analysis_result, degraded)"""
+    with stage_timer.stage('plan_library'):
+        analysis_result = plan_library.build_analysis(student_data, local_score)
+    degraded_analyses.inc(reason=reason)
+    return analysis_result, {'reason': reason, 'source': 'plan_library'}
+
+def run_analysis(data, local_score):
+    """
+    Analyze a validated profile and queue it for saving
+    Runs in delta mode when previous_document_id is set; falls back to the plan library
+    when Gemini is unavailable and DEGRADED_MODE allows it
+    Returns (response_body, status_code); shared by /analyze and the async job workers
+    """
+    token_usage_stats.pop_thread_report()
+    previous_id = data.get('previous_document_id')
+    previous = None
+    delta = None
+    reuse = None
+    degraded = None
+    if previous_id:
+        previous = load_analysis_document(previous_id)
+        if previous is None:
+            return {'error': 'Previous analysis not found', 'success': False}, 404
+        if previous.get('user_id', '') != data.get('user_id', ''):
+            return {'error': 'Previous analysis belongs to another user', 'success': False}, 403
+    
+    try:
+        if plan_library.mode == 'always':
+            analysis_result, degraded = degraded_analysis(data, local_score, 'always')
+            cached = False
+        elif previous_id:
+            # Delta mode: update the previous analysis, regenerating only affected sections
+            analysis_result, delta = analyze_incremental(data, local_score, previous)
+            cached = False
+        else:
+            # Perform analysis, reusing a cached result for an identical (or near-identical) profile
+            analysis_result, cached, reuse = analyze_with_cache(data, local_score)
+    except Exception as e:
+        reason = degraded_reason(str(e)) if plan_library.mode == 'fallback' else None
+        if reason is None:
+            raise
+        print(f"Gemini unavailable ({e}), answering from the plan library")
+        analysis_result, degraded = degraded_analysis(data, local_score, reason)
+        cached = False
+        delta = None
+    
+    extra_fields = {}
+    if previous_id:
+        extra_fields.update({'previous_document_id': previous_id, 'version': previous.get('version', 1) + 1})
+    if delta is not None:
+        extra_fields['delta'] = delta
+    if reuse is not None:
+        extra_fields['reuse'] = reuse
+    if degraded is not None:
+        extra_fields['degraded'] = degraded
+    token_usage = token_usage_stats.pop_thread_report()
+    
+    # Save to Firebase
+    doc_id = save_to_firebase(data, analysis_result, extra_fields or None)
+    
+    # Return response
+    response = {
+        'success': True,
+        'analysis': analysis_result,
+        'document_id': doc_id,
+        'cached': cached
+    }
+    if previous_id:
+        response['previous_document_id'] = previous_id
+        response['delta'] = delta
+    if reuse is not None:
+        response['reuse'] = reuse
+    if degraded is not None:
+        response['degraded'] = degraded
+    if token_usage:
+        response['token_usage'] = token_usage
+    return response, 200
+
+def enqueue_analysis(data):
+    """Queue a validated profile for a job worker; 202 with the job's status URL"""
+    priority = request.args.get('priority', 'normal')
+    if priority not in PRIORITIES:
+        return jsonify({'error': f"priority must be one of: {', '.join(PRIORITIES)}", 'success': False}), 400
+    queue = get_job_queue()
+    if queue is None:
+        return jsonify({'error': 'Job queue not configured', 'success': False}), 503
+    
+    try:
+        job_id = queue.enqueue(data, PRIORITIES[priority])
+    except QueueFull as e:
+        response = jsonify({'error': str(e), 'success': False})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    status_url = f"/jobs/{job_id}"
+    response = jsonify({'success': True, 'job_id': job_id, 'status': 'queued', 'priority': priority,
+                        'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+def process_analysis_job(job_id, data, worker_id):
+    """
+    Run one queued /analyze job (on a worker.py process) and record the outcome
+    Unexpected errors and rate limiting are retried; quota, configuration and request errors are final
+    The lease is renewed while the analysis runs, so a slow Gemini call is not handed to another worker
+    """
+    queue = get_job_queue()
+    try:
+        with queue.heartbeat(job_id, worker_id):
+            with stage_timer.stage('score'):
+                local_score = score_profile(data)
+            response, status_code = run_analysis(data, local_score)
+    except Exception as e:
+        error_message = str(e)
+        status_code = error_status_code(error_message)
+        print(f"Error in analysis job {job_id}: {error_message}")
+        recorded = queue.fail(job_id, worker_id, error_message, status_code,
+                              retry=status_code == 500 or 'rate limit' in error_message.lower())
+    else:
+        if status_code == 200:
+            recorded = queue.complete(job_id, worker_id, response)
+        else:
+            recorded = queue.fail(job_id, worker_id, response['error'], status_code)
+    if not recorded:
+        print(f"Analysis job {job_id}: lease lost before it finished, outcome discarded")
+
+@api.route('/analyze', methods=['POST'])
 def analyze():
     """
     Main analysis endpoint
     Accepts student profile data and returns AI analysis
+    With ?async=1 (and optionally &priority=low|normal|high) the profile is validated and
+    queued instead; the 202 response points to /jobs/<job_id>
     """
     try:
         # Validate request
@@ -318,68 +974,33 @@ def analyze():
         
         data = request.get_json()
         
-        # Validate required fields
-        required_fields = ['name', 'location', 'college', 'college_tier', 'qualification', 'department', 'cgpa', 
-                          'attendance', 'hackathons', 'technologies', 'certifications', 'projects',
-                          'dsa_practice_frequency', 'internships', 
-                          'mock_interview_score', 'resume_score']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            return jsonify({
-                'error': f'Missing required fields: {", ".join(missing_fields)}'
-            }), 400
-        
-        # Validate data ranges
-        if data.get('attendance', 0) < 0 or data.get('attendance', 0) > 100:
-            return jsonify({'error': 'Attendance must be between 0 and 100'}), 400
-        if data.get('cgpa', 0) < 0 or data.get('cgpa', 0) > 10:
-            return jsonify({'error': 'CGPA must be between 0 and 10'}), 400
-        # Validate DSA frequency
-        valid_dsa_frequencies = ['Daily', 'Weekly', 'Monthly']
-        if 'dsa_practice_frequency' in data and data.get('dsa_practice_frequency') not in valid_dsa_frequencies:
-            return jsonify({'error': 'DSA practice frequency must be Daily, Weekly, or Monthly'}), 400
+        # Validate profile fields and ranges
+        with stage_timer.stage('validate'):
+            validation_error = validate_student_profile(data)
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
         
-        # Validate internships
-        if 'internships' in data:
-            internships = data.get('internships', [])
-            if not isinstance(internships, list):
-                return jsonify({'error': 'Internships must be a list'}), 400
-            valid_durations = ['1 month', '3 months', '6 months', '1 year']
-            for internship in internships:
-                if not isinstance(internship, dict):
-                    return jsonify({'error': 'Each internship must be an object with company and duration'}), 400
-                if 'duration' in internship and internship.get('duration') not in valid_durations:
-                    return jsonify({'error': 'Internship duration must be 1 month, 3 months, 6 months, or 1 year'}), 400
-        if data.get('mock_interview_score', 0) < 0 or data.get('mock_interview_score', 0) > 10:
-            return jsonify({'error': 'Mock interview score must be between 0 and 10'}), 400
-        if data.get('resume_score', 0) < 0 or data.get('resume_score', 0) > 100:
-            return jsonify({'error': 'Resume score must be between 0 and 100'}), 400
-        
-        # Perform analysis
-        analysis_result = analyze_student_profile(data)
-        
-        # Save to Firebase
-        doc_id = save_to_firebase(data, analysis_result)
+        # Score locally; score_only mode skips Gemini entirely
+        with stage_timer.stage('score'):
+            local_score = score_profile(data)
+        if request.args.get('mode') == 'score_only':
+            return jsonify({
+                'success': True,
+                'mode': 'score_only',
+                'analysis': local_score
+            }), 200
         
-        # Return response
-        response = {
-            'success': True,
-            'analysis': analysis_result,
-            'document_id': doc_id
-        }
+        if request.args.get('async') == '1':
+            return enqueue_analysis(data)
         
-        return jsonify(response), 200
+        response, status_code = run_analysis(data, local_score)
+        with stage_timer.stage('serialize'):
+            return jsonify(response), status_code
     
     except Exception as e:
         error_message = str(e)
         # Determine appropriate HTTP status code
-        status_code = 500
-        if "quota" in error_message.lower() or "exceeded" in error_message.lower():
-            status_code = 429  # Too Many Requests
-        elif "not configured" in error_message.lower() or "api key" in error_message.lower():
-            status_code = 503  # Service Unavailable
-        elif "Missing required" in error_message or "must be between" in error_message:
-            status_code = 400  # Bad Request
+        status_code = error_status_code(error_message)
         
         print(f"Error in /analyze endpoint: {error_message}")
         return jsonify({
@@ -387,75 +1008,285 @@ def analyze():
             'success': False
         }), status_code
 
-@app.route('/user/<user_id>/analyses', methods=['GET'])
-def get_user_analyses(user_id):
+@api.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
     """
-    Retrieve analysis history for a specific user
+    Streaming analysis endpoint
+    Pushes server-sent events as each section of the analysis becomes available:
+    score, summary, strengths, weak_areas, risk_factors, recommendations,
+    one plan_week per week, then complete (or error)
     """
-    if not db:
-        return jsonify({'error': 'Firebase not configured'}), 503
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 400
     
-    try:
-        # Query Firestore for user's analyses
-        analyses_ref = db.collection('student_analyses')
+    data = request.get_json()
+    
+    # Validate profile fields and ranges
+    validation_error = validate_student_profile(data)
+    if validation_error:
+        return jsonify({'error': validation_error}), 400
+    
+    local_score = score_profile(data)
+    cache_key = profile_cache_key(data, REQUIRED_PROFILE_FIELDS)
+    
+    def generate():
+        # The locally computed score is available immediately
+        yield format_sse('score', local_score)
         
-        # Try with order_by, fallback to without if index is missing
         try:
-            docs = analyses_ref.where('user_id', '==', user_id)\
-                              .order_by('timestamp', direction=firestore.Query.DESCENDING)\
-                              .limit(50)\
-                              .stream()
-        except Exception as order_error:
-            print(f"Warning: Could not order by timestamp, fetching without order: {order_error}")
-            # Fallback: fetch without ordering
-            docs = analyses_ref.where('user_id', '==', user_id)\
-                              .limit(50)\
-                              .stream()
+            analysis_result = analysis_cache.get(cache_key)
+            cached = analysis_result is not None
+            if cached:
+                for event, section in analysis_sections(analysis_result):
+                    yield format_sse(event, section)
+            else:
+                for event, section in stream_student_analysis(data, local_score):
+                    if event == 'analysis':
+                        analysis_result = section
+                    else:
+                        yield format_sse(event, section)
+                analysis_cache.set(cache_key, analysis_result)
+            
+            # Save to Firebase
+            doc_id = save_to_firebase(data, analysis_result)
+            
+            yield format_sse('complete', {
+                'success': True,
+                'analysis': analysis_result,
+                'document_id': doc_id,
+                'cached': cached
+            })
+        
+        except Exception as e:
+            error_message = str(e)
+            print(f"Error in /analyze/stream endpoint: {error_message}")
+            yield format_sse('error', {
+                'error': error_message,
+                'status': error_status_code(error_message),
+                'success': False
+            })
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def read_batch_profiles():
+    """
+    Read batch profiles from a JSON body (array, or object with "profiles"),
+    a JSONL/CSV request body, or a JSONL/CSV file upload
+    Returns (profiles, user_id)
+    """
+    if 'file' in request.files:
+        upload = request.files['file']
+        text = upload.read().decode('utf-8-sig')
+        filename = (upload.filename or '').lower()
+        is_csv = filename.endswith('.csv') or upload.mimetype == 'text/csv'
+        profiles = parse_csv_profiles(text) if is_csv else parse_jsonl_profiles(text)
+        return profiles, request.form.get('user_id', '')
+    
+    if request.is_json:
+        payload = request.get_json()
+        if isinstance(payload, dict):
+            return payload.get('profiles'), payload.get('user_id', '')
+        return payload, ''
+    
+    text = request.get_data(as_text=True)
+    if request.mimetype == 'text/csv':
+        return parse_csv_profiles(text), request.args.get('user_id', '')
+    return parse_jsonl_profiles(text), request.args.get('user_id', '')
+
+# Upper bound on /jobs/<job_id>?wait=
+JOB_MAX_WAIT = float(os.getenv('JOB_MAX_WAIT', 30))
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Status of an /analyze?async=1 job: queued (with its queue position), running, done or error
+    ?wait=<seconds> long-polls until the job finishes; once done, `result` is the /analyze response body
+    """
+    queue = get_job_queue()
+    if queue is None:
+        return jsonify({'error': 'Job queue not configured', 'success': False}), 503
+    
+    wait = min(max(request.args.get('wait', 0, type=float), 0.0), JOB_MAX_WAIT)
+    job = queue.wait(job_id, wait) if wait else queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found', 'success': False}), 404
+    job['success'] = True
+    return jsonify(job), 200
+
+@api.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Batch analysis endpoint
+    Accepts many student profiles, validates each one and analyzes them in the background
+    with bounded concurrency; returns a job ID to poll for per-item status
+    """
+    try:
+        profiles, user_id = read_batch_profiles()
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': f'Could not parse batch: {e}', 'success': False}), 400
+    
+    if not isinstance(profiles, list) or not profiles:
+        return jsonify({'error': 'Batch must contain a non-empty list of profiles', 'success': False}), 400
+    if len(profiles) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Batch is limited to {BATCH_MAX_ITEMS} profiles', 'success': False}), 400
+    
+    # Apply the batch-level user_id to profiles that don't carry their own
+    if user_id:
+        for profile in profiles:
+            if isinstance(profile, dict):
+                profile.setdefault('user_id', user_id)
+    
+    concurrency = request.args.get('concurrency', type=int)
+    job = batch_runner.submit(profiles, concurrency=concurrency)
+    
+    response = job.to_dict()
+    response['success'] = True
+    response['status_url'] = f"/analyze/batch/{job.id}"
+    return jsonify(response), 202
+
+@api.route('/analyze/batch/<job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    """
+    Per-item status of a batch analysis job
+    Pass ?include_analysis=1 to include each completed analysis
+    """
+    response = batch_runner.get(job_id, include_analysis=request.args.get('include_analysis') == '1')
+    if response is None:
+        return jsonify({'error': 'Batch job not found', 'success': False}), 404
+    
+    response['success'] = True
+    return jsonify(response), 200
+
+# History pagination defaults
+HISTORY_DEFAULT_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Fields loaded for ?fields=summary (everything the history list renders)
+HISTORY_SUMMARY_FIELDS = ['timestamp', 'readiness_score', 'readiness_level']
+
+def format_history_entry(doc_id, doc_data, include_details=True):
+    """
+    Convert a stored analysis document into a history entry
+    """
+    # Handle timestamp conversion
+    timestamp = doc_data.get('timestamp')
+    if timestamp is None:
+        timestamp_str = datetime.now().isoformat()
+    elif isinstance(timestamp, str):
+        timestamp_str = timestamp
+    elif hasattr(timestamp, 'isoformat'):
+        timestamp_str = timestamp.isoformat()
+    else:
+        timestamp_str = str(timestamp)
+    
+    # Ensure readiness_score is a number (convert to int if float)
+    readiness_score = doc_data.get('readiness_score', 0)
+    if isinstance(readiness_score, float):
+        readiness_score = int(readiness_score)
+    
+    entry = {
+        'id': doc_id,
+        'timestamp': timestamp_str,
+        'readiness_score': readiness_score,
+        'readiness_level': doc_data.get('readiness_level', 'Low')
+    }
+    if include_details:
+        entry['analysis'] = doc_data.get('analysis')  # Include full analysis
+        entry['student_profile'] = doc_data.get('student_profile', {})
+    return entry
+
+def conditional_json(payload):
+    """
+    JSON response with an ETag; returns 304 Not Modified when If-None-Match matches
+    """
+    response = jsonify(payload)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+def history_page(analyses, next_cursor, compact=False):
+    """Response body of one history page, optionally in the compact (deduplicated) form"""
+    if not compact:
+        return {'success': True, 'analyses': analyses, 'next_cursor': next_cursor}
+    analyses, profiles, plans = compact_history(analyses)
+    return {
+        'success': True,
+        'compact': True,
+        'analyses': analyses,
+        'profiles': profiles,
+        'plans': plans,
+        'next_cursor': next_cursor
+    }
+
+@api.route('/user/<user_id>/analyses', methods=['GET'])
+def get_user_analyses(user_id):
+    """
+    Retrieve analysis history for a specific user, newest first
+    Query parameters:
+    - page_size: entries per page (default 50, max 100)
+    - cursor: the next_cursor value returned by the previous page
+    - fields: "full" (default) or "summary" (id, timestamp, score and level only)
+    - compact: 1 to send each distinct student_profile and 30_day_plan once, in top-level
+      `profiles` / `plans` maps that entries reference by `profile_ref` / `plan_ref`
+    The first page is served from the history cache when possible; responses carry an
+    ETag so unchanged histories return 304
+    """
+    store = get_store()
+    if not store:
+        return jsonify({'error': 'Storage not configured'}), 503
+    
+    page_size = request.args.get('page_size', HISTORY_DEFAULT_PAGE_SIZE, type=int)
+    if page_size < 1 or page_size > HISTORY_MAX_PAGE_SIZE:
+        return jsonify({'error': f'page_size must be between 1 and {HISTORY_MAX_PAGE_SIZE}', 'success': False}), 400
+    fields = request.args.get('fields', 'full')
+    if fields not in ('full', 'summary'):
+        return jsonify({'error': 'fields must be "full" or "summary"', 'success': False}), 400
+    cursor = request.args.get('cursor', '')
+    include_details = fields == 'full'
+    compact = request.args.get('compact') == '1'
+    
+    # First pages are served from the per-user history cache
+    if not cursor:
+        with stage_timer.stage('history_cache'):
+            cached_page = history_cache.get_page(user_id, fields, page_size)
+        if cached_page is not None:
+            analyses, has_more = cached_page
+            with stage_timer.stage('serialize'):
+                return conditional_json(history_page(analyses, analyses[-1]['id'] if has_more and analyses else None,
+                                                     compact))
+    
+    try:
+        # Query the store for the user's analyses (one extra to know whether another page exists)
+        with stage_timer.stage(f'{store.name}_query'):
+            try:
+                documents, has_more, ordered = store.user_history(
+                    user_id, page_size, cursor, None if include_details else HISTORY_SUMMARY_FIELDS
+                )
+            except InvalidCursor:
+                return jsonify({'error': 'Invalid cursor', 'success': False}), 400
         
         analyses = []
-        for doc in docs:
+        for doc_id, doc_data in documents:
             try:
-                doc_data = doc.to_dict()
-                
-                # Handle timestamp conversion
-                timestamp = doc_data.get('timestamp')
-                if timestamp is None:
-                    timestamp_str = datetime.now().isoformat()
-                elif isinstance(timestamp, str):
-                    timestamp_str = timestamp
-                elif hasattr(timestamp, 'isoformat'):
-                    timestamp_str = timestamp.isoformat()
-                else:
-                    timestamp_str = str(timestamp)
-                
-                # Ensure readiness_score is a number (convert to int if float)
-                readiness_score = doc_data.get('readiness_score', 0)
-                if isinstance(readiness_score, float):
-                    readiness_score = int(readiness_score)
-                
-                analyses.append({
-                    'id': doc.id,
-                    'timestamp': timestamp_str,
-                    'readiness_score': readiness_score,
-                    'readiness_level': doc_data.get('readiness_level', 'Low'),
-                    'analysis': doc_data.get('analysis'),  # Include full analysis
-                    'student_profile': doc_data.get('student_profile', {})
-                })
+                analyses.append(format_history_entry(doc_id, doc_data, include_details))
             except Exception as doc_error:
-                print(f"Error processing document {doc.id}: {doc_error}")
+                print(f"Error processing document {doc_id}: {doc_error}")
                 continue
         
         # Sort in Python if order_by failed
-        if len(analyses) > 1:
-            try:
-                analyses.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            except:
-                pass
+        if not ordered and len(analyses) > 1:
+            analyses.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
         
-        return jsonify({
-            'success': True,
-            'analyses': analyses
-        }), 200
+        # Only a correctly ordered first page is a valid cache prefix
+        if ordered and not cursor:
+            history_cache.fill(user_id, fields, analyses, has_more)
+        
+        with stage_timer.stage('serialize'):
+            return conditional_json(history_page(analyses, documents[-1][0] if has_more and documents else None,
+                                                 compact))
     
     except Exception as e:
         print(f"Error fetching user analyses: {e}")
@@ -466,6 +1297,204 @@ def get_user_analyses(user_id):
             'success': False
         }), 500
 
+@api.route('/cohorts', methods=['GET'])
+def get_cohorts():
+    """
+    Cohort overview: the values of each dimension with their counts, plus overall statistics
+    Served from precomputed rollups (see cohorts.py)
+    """
+    store = get_store()
+    if not store:
+        return jsonify({'error': 'Storage not configured'}), 503
+    
+    try:
+        cohort_rollups.ensure_fresh(store)
+        return jsonify({
+            'success': True,
+            'overall': cohort_rollups.get('all', 'all'),
+            'dimensions': cohort_rollups.dimensions()
+        }), 200
+    except Exception as e:
+        print(f"Error fetching cohorts: {e}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@api.route('/cohorts/<dimension>', methods=['GET'])
+def get_cohort_dimension(dimension):
+    """Statistics for every cohort of one dimension (college_tier, department, dsa_practice_frequency)"""
+    if dimension not in COHORT_DIMENSIONS:
+        return jsonify({'error': f"dimension must be one of: {', '.join(COHORT_DIMENSIONS)}", 'success': False}), 400
+    store = get_store()
+    if not store:
+        return jsonify({'error': 'Storage not configured'}), 503
+    
+    try:
+        cohort_rollups.ensure_fresh(store)
+        return jsonify({'success': True, 'dimension': dimension, 'cohorts': cohort_rollups.list(dimension)}), 200
+    except Exception as e:
+        print(f"Error fetching cohorts for {dimension}: {e}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@api.route('/cohorts/<dimension>/<path:value>', methods=['GET'])
+def get_cohort(dimension, value):
+    """
+    Statistics for one cohort: count, average and spread of readiness_score, score histogram,
+    level counts and the most frequent weak areas
+    """
+    if dimension not in COHORT_DIMENSIONS:
+        return jsonify({'error': f"dimension must be one of: {', '.join(COHORT_DIMENSIONS)}", 'success': False}), 400
+    store = get_store()
+    if not store:
+        return jsonify({'error': 'Storage not configured'}), 503
+    
+    try:
+        cohort_rollups.ensure_fresh(store)
+        cohort = cohort_rollups.get(dimension, value)
+        if cohort is None:
+            return jsonify({'error': 'Cohort not found', 'success': False}), 404
+        return jsonify({'success': True, 'cohort': cohort}), 200
+    except Exception as e:
+        print(f"Error fetching cohort {dimension}/{value}: {e}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@api.route('/export', methods=['GET'])
+def export_analyses():
+    """
+    Stream all stored analyses (or one user's, with ?user_id=) as columnar NDJSON
+    Same format as `python export_io.py export`; admin only
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    store = get_store()
+    if not store:
+        return jsonify({'error': 'Storage not configured'}), 503
+    
+    chunk_size = min(max(request.args.get('chunk_size', 500, type=int), 1), 5000)
+    documents = store.iter_documents(chunk_size, request.args.get('user_id'))
+    return Response(stream_with_context(iter_ndjson_lines(documents, chunk_size)),
+                    mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=analyses.ndjson'})
+
+@api.route('/admin/profiling', methods=['GET'])
+def get_profiling():
+    """
+    Profiling settings and the newest captures (?limit=, default 50), with their stage timings
+    and wait/own-time split; admin only
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    return jsonify({'success': True, 'settings': profiler.stats(), 'captures': profiler.list_captures(limit)}), 200
+
+@api.route('/admin/profiling', methods=['POST'])
+def update_profiling():
+    """
+    Profile a fraction of live traffic on every worker (picked up within a second, no restart)
+    Body: {"sample_rate": 0.01, "mode": "sampling" or "cprofile", "format": "speedscope" or "collapsed",
+    "duration_seconds": 600}; sample_rate 0 turns it off, and the settings lapse after duration_seconds
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    current = profiler.settings.get()
+    mode = data.get('mode', current['mode'])
+    output_format = data.get('format', current['format'])
+    if mode not in PROFILE_MODES:
+        return jsonify({'error': f"mode must be one of: {', '.join(PROFILE_MODES)}", 'success': False}), 400
+    if output_format not in PROFILE_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(PROFILE_FORMATS)}", 'success': False}), 400
+    try:
+        sample_rate = float(data.get('sample_rate', current['sample_rate']))
+        duration = float(data.get('duration_seconds', 600))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'sample_rate and duration_seconds must be numbers', 'success': False}), 400
+    if not 0 <= sample_rate <= 1 or duration <= 0:
+        return jsonify({'error': 'sample_rate must be between 0 and 1 and duration_seconds positive',
+                        'success': False}), 400
+    
+    profiler.settings.update({'mode': mode, 'format': output_format, 'sample_rate': sample_rate,
+                              'until': time.time() + duration})
+    return jsonify({'success': True, 'settings': profiler.stats()}), 200
+
+@api.route('/admin/profiling/captures/<path:filename>', methods=['GET'])
+def get_profile_capture(filename):
+    """Download a capture file (speedscope JSON, collapsed stacks, .prof or metadata); admin only"""
+    denied = require_admin()
+    if denied:
+        return denied
+    return send_from_directory(profiler.directory, filename, as_attachment=True)
+
+@api.route('/analyses/<analysis_id>', methods=['GET'])
+def get_analysis(analysis_id):
+    """
+    Retrieve one full analysis document
+    """
+    store = get_store()
+    if not store:
+        return jsonify({'error': 'Storage not configured'}), 503
+    
+    try:
+        doc_data = load_analysis_document(analysis_id)
+        if doc_data is None:
+            return jsonify({'error': 'Analysis not found', 'success': False}), 404
+        
+        entry = format_history_entry(analysis_id, doc_data)
+        entry['user_id'] = doc_data.get('user_id', '')
+        
+        return jsonify({
+            'success': True,
+            'analysis': entry
+        }), 200
+    
+    except Exception as e:
+        print(f"Error fetching analysis {analysis_id}: {e}")
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 500
+
+def create_app():
+    """
+    Application factory
+    Cheap to call: SDK clients are created lazily on first use, which keeps worker boot
+    fast and makes `gunicorn --preload` safe
+    """
+    app = Flask(__name__)
+    install_json_provider(app)
+    
+    # Configure CORS for production
+    # Allow requests from Firebase Hosting domains and localhost for development
+    allowed_origins = [
+        "http://localhost:*",
+        "http://127.0.0.1:*",
+    ]
+
+    # Add Firebase Hosting domains if provided via environment variable
+    firebase_domain = os.getenv('FIREBASE_HOSTING_DOMAIN', '')
+    if firebase_domain:
+        allowed_origins.extend([
+            f"https://{firebase_domain}",
+            f"https://{firebase_domain.replace('.web.app', '.firebaseapp.com')}",
+        ])
+
+    # For production, allow all origins (you can restrict this later)
+    # In production, you should set specific domains
+    CORS(app, resources={
+        r"/*": {
+            "origins": "*",  # In production, replace with specific domains
+            "methods": ["GET", "POST", "OPTIONS"],
+            "allow_headers": ["Content-Type", "Authorization"]
+        }
+    })
+    
+    app.register_blueprint(api)
+    return app
+
+# Module-level app for `gunicorn app:app` and `python app.py`
+app = create_app()
+
 if __name__ == '__main__':
     # For local development
     port = int(os.getenv('FLASK_PORT', 5000))
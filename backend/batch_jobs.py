@@ -0,0 +1,249 @@
+"""
+Batch analysis jobs for /analyze/batch
+Fans analyze calls out over a bounded thread pool and persists results with
+batched writes, tracking per-item status under a job ID. Job state is written through
+to the job queue database when there is one, so a poll can land on any worker process.
+"""
+
+import csv
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Profile fields parsed as numbers when profiles arrive as CSV
+CSV_NUMERIC_FIELDS = ('cgpa', 'attendance', 'mock_interview_score', 'resume_score')
+
+
+def _parse_csv_internships(value):
+    """
+    Accept internships as a JSON list or as "Company (3 months); Other (1 month)"
+    """
+    value = (value or '').strip()
+    if not value:
+        return []
+    if value.startswith('['):
+        return json.loads(value)
+    internships = []
+    for entry in value.split(';'):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if entry.endswith(')') and '(' in entry:
+            company, duration = entry[:-1].rsplit('(', 1)
+            internships.append({'company': company.strip(), 'duration': duration.strip()})
+        else:
+            internships.append({'company': entry, 'duration': ''})
+    return internships
+
+
+def _parse_csv_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def parse_csv_profiles(text):
+    """Parse a CSV upload (one profile per row, header row of field names)"""
+    profiles = []
+    for row in csv.DictReader(io.StringIO(text)):
+        profile = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+        for field in CSV_NUMERIC_FIELDS:
+            if field in profile:
+                profile[field] = _parse_csv_number(profile[field])
+        if 'internships' in profile:
+            profile['internships'] = _parse_csv_internships(profile['internships'])
+        profiles.append(profile)
+    return profiles
+
+
+def parse_jsonl_profiles(text):
+    """Parse a JSONL upload (one profile object per line)"""
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class BatchJob:
+    """
+    State of one batch: per-item status, analyses and document IDs
+    With a `state_store` (a JobQueue) every change is also written there
+    """
+
+    def __init__(self, profiles, state_store=None):
+        self.id = str(uuid.uuid4())
+        self.created_at = time.time()
+        self.finished_at = None
+        self.profiles = profiles
+        self.items = [{'index': index, 'status': 'pending'} for index in range(len(profiles))]
+        self.analyses = [None] * len(profiles)
+        self.state_store = state_store
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    def update_item(self, index, analysis=None, **fields):
+        with self._lock:
+            self.items[index].update(fields)
+            if analysis is not None:
+                self.analyses[index] = analysis
+            item = dict(self.items[index])
+        if self.state_store is not None:
+            try:
+                self.state_store.update_batch_item(self.id, item, analysis)
+            except Exception as e:
+                print(f"Could not store state of batch {self.id} item {index}: {e}")
+
+    def register(self):
+        """Write the job's initial state to the state store"""
+        if self.state_store is not None:
+            with self._lock:
+                items = [dict(item) for item in self.items]
+            self.state_store.create_batch(self.id, self.created_at, items)
+
+    def finish(self):
+        self.finished_at = time.time()
+        if self.state_store is not None:
+            try:
+                self.state_store.finish_batch(self.id, self.finished_at)
+            except Exception as e:
+                print(f"Could not store completion of batch {self.id}: {e}")
+
+    def to_dict(self, include_analysis=False):
+        with self._lock:
+            counts = {}
+            items = []
+            for item in self.items:
+                counts[item['status']] = counts.get(item['status'], 0) + 1
+                item = dict(item)
+                if include_analysis and self.analyses[item['index']] is not None:
+                    item['analysis'] = self.analyses[item['index']]
+                items.append(item)
+            return {
+                'job_id': self.id,
+                'status': 'completed' if self.done else 'running',
+                'total': len(self.items),
+                'counts': counts,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'items': items
+            }
+
+
+class BatchRunner:
+    """
+    Runs batch jobs in the background
+    analyze_fn(profile) -> analysis performs one (possibly cached) analysis;
+    save_many_fn([(profile, analysis), ...]) -> [document_id, ...] persists a chunk of results;
+    get_state_store() returns the shared JobQueue, or None to keep job state in this process only
+    """
+
+    def __init__(self, analyze_fn, save_many_fn, validate_fn, get_state_store=None, max_concurrency=4,
+                 write_chunk_size=50, max_jobs=100):
+        self.analyze_fn = analyze_fn
+        self.save_many_fn = save_many_fn
+        self.validate_fn = validate_fn
+        self.get_state_store = get_state_store
+        self.max_concurrency = max_concurrency
+        self.write_chunk_size = write_chunk_size
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, profiles, concurrency=None):
+        """Validate profiles, register a job and start processing it in a background thread"""
+        state_store = self.get_state_store() if self.get_state_store is not None else None
+        job = BatchJob(profiles)
+        for index, profile in enumerate(profiles):
+            try:
+                error = self.validate_fn(profile)
+            except (TypeError, ValueError) as e:
+                error = f'Invalid profile: {e}'
+            if error:
+                job.update_item(index, status='invalid', error=error)
+        if state_store is not None:
+            job.state_store = state_store
+            job.register()
+
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict_finished_jobs()
+
+        concurrency = min(concurrency or self.max_concurrency, self.max_concurrency)
+        thread = threading.Thread(target=self._run, args=(job, max(concurrency, 1)), daemon=True)
+        thread.start()
+        return job
+
+    def get(self, job_id, include_analysis=False):
+        """Job state as a dict (see BatchJob.to_dict), or None"""
+        state_store = self.get_state_store() if self.get_state_store is not None else None
+        if state_store is not None:
+            return state_store.get_batch(job_id, include_analysis)
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.to_dict(include_analysis) if job is not None else None
+
+    def _evict_finished_jobs(self):
+        # Forget the oldest finished jobs once the registry is full
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+
+    def _run(self, job, concurrency):
+        pending_indexes = [item['index'] for item in job.items if item['status'] == 'pending']
+        completed = []
+        try:
+            def analyze(index):
+                job.update_item(index, status='running')
+                return self.analyze_fn(job.profiles[index])
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                # Items stay pending until a pool thread picks them up
+                futures = {executor.submit(analyze, index): index for index in pending_indexes}
+
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        analysis_result = future.result()
+                    except Exception as e:
+                        job.update_item(index, status='error', error=str(e))
+                        continue
+                    job.update_item(index, analysis=analysis_result,
+                                    readiness_score=analysis_result.get('readiness_score'),
+                                    readiness_level=analysis_result.get('readiness_level'))
+                    completed.append(index)
+                    if len(completed) >= self.write_chunk_size:
+                        self._write(job, completed)
+                        completed = []
+            if completed:
+                self._write(job, completed)
+        finally:
+            job.finish()
+
+    def _write(self, job, indexes):
+        entries = [(job.profiles[index], job.analyses[index]) for index in indexes]
+        try:
+            doc_ids = self.save_many_fn(entries)
+        except Exception as e:
+            print(f"Batch save error for job {job.id}: {e}")
+            doc_ids = [None] * len(indexes)
+        for index, doc_id in zip(indexes, doc_ids):
+            job.update_item(index, status='done', document_id=doc_id)
+
+
+def create_batch_runner(analyze_fn, save_many_fn, validate_fn, get_state_store=None):
+    """Build the batch runner from environment variables"""
+    return BatchRunner(
+        analyze_fn, save_many_fn, validate_fn, get_state_store,
+        max_concurrency=int(os.getenv('BATCH_CONCURRENCY', 4)),
+        write_chunk_size=int(os.getenv('BATCH_WRITE_CHUNK_SIZE', 50)),
+        max_jobs=int(os.getenv('BATCH_MAX_JOBS', 100))
+    )
@@ -0,0 +1,254 @@
+"""
+In-process stand-ins for the Gemini model and the Firestore client
+Used by the load benchmark so it runs fully offline; latency and errors are injectable
+"""
+
+import copy
+import hashlib
+import json
+import random
+import threading
+import time
+
+from analysis_schema import PLAN_WEEKS
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = 0
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeGenerativeModel:
+    """
+    Stand-in for genai.GenerativeModel
+    Sleeps `latency` (+/- `jitter`) seconds per call and fails a fraction `error_rate`
+    of calls with `error_message`; the analysis text depends on the prompt
+    """
+
+    def __init__(self, latency=0.8, jitter=0.2, error_rate=0.0,
+                 error_message='429 Resource has been exhausted (e.g. check quota).', stream_chunks=8):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_message = error_message
+        self.stream_chunks = stream_chunks
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _analysis_text(self, prompt):
+        seed = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+        return json.dumps({
+            'summary': f"Profile {seed} shows steady progress with room to grow in interview preparation.",
+            'strengths': ['Consistent academics', 'Hands-on projects'],
+            'weak_areas': ['Irregular DSA practice', 'Few mock interviews'],
+            'risk_factors': ['Limited industry exposure'],
+            'recommendations': ['Solve two DSA problems daily', 'Schedule weekly mock interviews'],
+            '30_day_plan': {
+                week: {'focus': f"Focus area {index + 1}", 'tasks': [f"Task {index + 1}.{task}" for task in range(1, 4)]}
+                for index, week in enumerate(PLAN_WEEKS)
+            }
+        })
+
+    def _wait_or_fail(self):
+        with self._lock:
+            self.calls += 1
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            raise Exception(self.error_message)
+
+    def generate_content(self, prompt, stream=False, generation_config=None, **kwargs):
+        text = self._analysis_text(prompt)
+        usage = FakeUsage(len(prompt) // 4, len(text) // 4)
+        if stream:
+            return self._stream(text, usage)
+        self._wait_or_fail()
+        return FakeResponse(text, usage)
+
+    def _stream(self, text, usage):
+        self._wait_or_fail()
+        size = max(1, len(text) // self.stream_chunks)
+        for start in range(0, len(text), size):
+            last = start + size >= len(text)
+            yield FakeResponse(text[start:start + size], usage if last else None)
+
+
+def _merge(stored, update):
+    """set(..., merge=True): nested maps are merged and increment transforms are applied"""
+    merged = dict(stored or {})
+    for key, value in update.items():
+        if isinstance(value, dict):
+            merged[key] = _merge(merged.get(key) if isinstance(merged.get(key), dict) else {}, value)
+        elif type(value).__name__ == 'Increment':
+            merged[key] = (merged.get(key) or 0) + value.value
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        self._collection._delay()
+        self._collection._write(self.id, data, merge)
+
+    def delete(self):
+        self._collection._delay()
+        self._collection._delete(self.id)
+
+    def get(self):
+        self._collection._delay()
+        return FakeSnapshot(self.id, self._collection._read(self.id))
+
+
+class FakeQuery:
+    """Supports the query shapes the backend uses: where ==, order_by, select, start_after, limit"""
+
+    def __init__(self, collection, filters=(), order=None, fields=None, after=None, limit_count=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._order = order
+        self._fields = fields
+        self._after = after
+        self._limit = limit_count
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order, fields=self._fields,
+                     after=self._after, limit_count=self._limit)
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field, op, value):
+        if op != '==':
+            raise NotImplementedError(f"FakeQuery supports only '==' filters, not {op!r}")
+        return self._copy(filters=self._filters + ((field, value),))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(order=(field, direction))
+
+    def select(self, fields):
+        return self._copy(fields=tuple(fields))
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot.id)
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def stream(self):
+        self._collection._delay()
+        with self._collection._lock:
+            items = [(doc_id, data) for doc_id, data in self._collection._docs.items()
+                     if all(data.get(field) == value for field, value in self._filters)]
+        if self._order:
+            field, direction = self._order
+            items.sort(key=lambda item: item[1].get(field, ''), reverse=direction == 'DESCENDING')
+        if self._after is not None:
+            ids = [doc_id for doc_id, _ in items]
+            items = items[ids.index(self._after) + 1:] if self._after in ids else []
+        if self._limit is not None:
+            items = items[:self._limit]
+        for doc_id, data in items:
+            if self._fields:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield FakeSnapshot(doc_id, copy.deepcopy(data))
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, latency):
+        self.latency = latency
+        self._docs = {}
+        self._lock = threading.Lock()
+        super().__init__(self)
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _write(self, doc_id, data, merge=False):
+        with self._lock:
+            self._docs[doc_id] = _merge(self._docs.get(doc_id), data) if merge else copy.deepcopy(data)
+
+    def _delete(self, doc_id):
+        with self._lock:
+            self._docs.pop(doc_id, None)
+
+    def _read(self, doc_id):
+        with self._lock:
+            return copy.deepcopy(self._docs.get(doc_id))
+
+    def document(self, doc_id):
+        return FakeDocumentReference(self, doc_id)
+
+    def __len__(self):
+        return len(self._docs)
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference, data, merge))
+
+    def delete(self, reference):
+        self._writes.append((reference, None, False))
+
+    def commit(self):
+        self._db._delay()
+        for reference, data, merge in self._writes:
+            if data is None:
+                reference._collection._delete(reference.id)
+            else:
+                reference._collection._write(reference.id, data, merge)
+
+
+class FakeFirestore:
+    """Stand-in for a firestore.client() with a fixed per-round-trip latency"""
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(self.latency)
+            return self._collections[name]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def get_all(self, references, field_paths=None):
+        """One round trip for many documents (field masks are ignored)"""
+        self._delay()
+        for reference in references:
+            yield FakeSnapshot(reference.id, reference._collection._read(reference.id))
@@ -0,0 +1,304 @@
+"""
+Offline load benchmark
+Drives /analyze and /user/<id>/analyses in-process at a fixed concurrency against the
+fake Gemini model and Firestore client in bench_fakes.py, and reports latency
+percentiles, throughput, response sizes (as sent, after compression), JSON encode and
+compression time, and memory. Nothing leaves the machine.
+
+    python bench_load.py                                  # mixed workload, defaults
+    python bench_load.py --scenario analyze --gemini-latency 1.5 --concurrency 32
+    python bench_load.py --scenario history --compact --accept-encoding gzip --json-encoder stdlib
+    python bench_load.py --json > baseline.json           # save a baseline
+    python bench_load.py --compare baseline.json          # exit 1 on a regression
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+SCENARIOS = ('analyze', 'history', 'mixed')
+
+BASE_PROFILE = {
+    'name': 'Bench Student',
+    'location': 'Pune',
+    'college': 'Example Institute of Technology',
+    'college_tier': 'Tier 2',
+    'qualification': 'B.Tech',
+    'department': 'Computer Science',
+    'cgpa': 7.8,
+    'attendance': 82,
+    'hackathons': '2',
+    'technologies': 'Python, Java, React, SQL',
+    'certifications': 'AWS Cloud Practitioner',
+    'projects': 'Placement portal, Chat app, Expense tracker',
+    'dsa_practice_frequency': 'Weekly',
+    'internships': [{'company': 'Acme', 'duration': '3 months'}],
+    'mock_interview_score': 6,
+    'resume_score': 75
+}
+
+
+def make_profile(index, users):
+    """A distinct (uncached) profile for request `index`, owned by one of `users` users"""
+    profile = dict(BASE_PROFILE)
+    profile['name'] = f"Bench Student {index}"
+    profile['cgpa'] = round(6 + (index % 40) / 10, 1)
+    profile['user_id'] = f"bench-user-{index % users}"
+    return profile
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def rss_mb():
+    """Current resident set size (falls back to the peak where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def load_backend(args):
+    """Import the app with flow control opened up and the fakes installed"""
+    os.environ.setdefault('GEMINI_RPM', '1000000')
+    os.environ.setdefault('GEMINI_TPM', '1000000000')
+    os.environ.setdefault('WRITE_JOURNAL_PATH', os.path.join(tempfile.mkdtemp(), 'write_journal.jsonl'))
+    if args.no_history_cache:
+        os.environ['HISTORY_CACHE_MAX_BYTES'] = '0'
+    os.environ['SIMILARITY_MODE'] = args.similarity
+    os.environ['JSON_ENCODER'] = args.json_encoder
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import app as backend
+    from bench_fakes import FakeFirestore, FakeGenerativeModel
+    from storage import FirestoreStore, SQLiteStore
+
+    model = FakeGenerativeModel(latency=args.gemini_latency, jitter=args.gemini_jitter, error_rate=args.gemini_error_rate)
+    backend.gemini_model.set(model)
+    if args.storage == 'sqlite':
+        # A real SQLite store in a scratch directory
+        store = SQLiteStore(os.path.join(tempfile.mkdtemp(), 'analyses.db'))
+    else:
+        db = FakeFirestore(latency=args.firestore_latency)
+        backend.firestore_db.set(db)
+        store = FirestoreStore(db)
+    backend.storage.set(store)
+    return backend, model, store
+
+
+def seed_history(backend, users, per_user):
+    """Store `per_user` analyses for each user so history reads have something to page through"""
+    entries = []
+    for index in range(users * per_user):
+        profile = make_profile(index, users)
+        analysis = backend.score_profile(profile)
+        analysis.update({'summary': 'Seeded analysis', 'strengths': [], 'weak_areas': [], 'risk_factors': [],
+                         'recommendations': [], '30_day_plan': {}})
+        entries.append((profile, analysis))
+    backend.save_many_to_firebase(entries)
+    backend.write_queue.flush(timeout=60)
+
+
+def stage_milliseconds(server_timing, stage):
+    """Duration of `stage` in a Server-Timing header value (0.0 when absent)"""
+    for part in (server_timing or '').split(','):
+        name, _, duration = part.strip().partition(';dur=')
+        if name == stage:
+            return float(duration)
+    return 0.0
+
+
+def run_load(backend, args):
+    client = backend.app.test_client()
+    # Stage timings come back in Server-Timing; the body is measured as sent
+    headers = {backend.TRACE_HEADER: '1'}
+    if args.accept_encoding:
+        headers['Accept-Encoding'] = args.accept_encoding
+    history_query = f"page_size={args.page_size}" + ('&compact=1' if args.compact else '')
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def next_index():
+        with counter_lock:
+            index = next(counter)
+        return index if args.requests is None or index < args.requests else None
+
+    def choose_request(index):
+        scenario = args.scenario
+        if scenario == 'mixed':
+            scenario = 'analyze' if random.random() < args.analyze_ratio else 'history'
+        if scenario == 'analyze':
+            return 'analyze', lambda: client.post('/analyze', json=make_profile(args.seed_offset + index, args.users),
+                                                  headers=headers)
+        user_id = f"bench-user-{random.randrange(args.users)}"
+        return 'history', lambda: client.get(f'/user/{user_id}/analyses?{history_query}', headers=headers)
+
+    def worker():
+        while True:
+            index = next_index()
+            if index is None or (args.requests is None and time.perf_counter() >= deadline):
+                return
+            kind, send = choose_request(index)
+            started_at = time.perf_counter()
+            response = send()
+            elapsed = time.perf_counter() - started_at
+            server_timing = response.headers.get('Server-Timing')
+            result = (kind, elapsed, response.status_code, len(response.get_data()),
+                      stage_milliseconds(server_timing, 'serialize'), stage_milliseconds(server_timing, 'compress'))
+            with results_lock:
+                results.append(result)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(args.concurrency)]:
+            future.result()
+    wall_seconds = time.perf_counter() - started_at
+    return results, wall_seconds
+
+
+def summarize(results, wall_seconds):
+    report = {'wall_seconds': round(wall_seconds, 3)}
+    for kind in ('all',) + SCENARIOS[:2]:
+        selected = [result[1:] for result in results if kind in ('all', result[0])]
+        if not selected:
+            continue
+        latencies = sorted(elapsed * 1000 for elapsed, *_ in selected)
+        statuses = {}
+        for _, status, *_ in selected:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        report[kind] = {
+            'requests': len(selected),
+            'rps': round(len(selected) / wall_seconds, 2) if wall_seconds else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(statistics.fmean(latencies), 2),
+            'mean_bytes': round(statistics.fmean(size for _, _, size, _, _ in selected)),
+            'serialize_ms': round(statistics.fmean(serialize for *_, serialize, _ in selected), 3),
+            'compress_ms': round(statistics.fmean(compress for *_, compress in selected), 3),
+            'statuses': statuses
+        }
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Return the regressions of `report` against `baseline` beyond `tolerance` (a fraction)"""
+    regressions = []
+    for kind in ('all',) + SCENARIOS[:2]:
+        current, previous = report.get(kind), baseline.get(kind)
+        if not current or not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{kind} {metric}: {previous[metric]} -> {current[metric]}")
+        if previous['rps'] and current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append(f"{kind} rps: {previous['rps']} -> {current['rps']}")
+        if previous.get('mean_bytes') and current['mean_bytes'] > previous['mean_bytes'] * (1 + tolerance):
+            regressions.append(f"{kind} mean_bytes: {previous['mean_bytes']} -> {current['mean_bytes']}")
+    return regressions
+
+
+def print_report(report):
+    print(f"Load benchmark: {report['config']['scenario']} at concurrency {report['config']['concurrency']}, "
+          f"{report['wall_seconds']}s wall")
+    print(f"  {'':<8} {'requests':>9} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'bytes':>9} "
+          f"{'encode ms':>10} {'gzip/br ms':>10}  statuses")
+    for kind in ('all',) + SCENARIOS[:2]:
+        row = report.get(kind)
+        if row:
+            print(f"  {kind:<8} {row['requests']:>9} {row['rps']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+                  f"{row['p99_ms']:>9} {row['mean_bytes']:>9} {row['serialize_ms']:>10} {row['compress_ms']:>10}  "
+                  f"{row['statuses']}")
+    memory = report['memory']
+    print(f"  memory   rss {memory['rss_mb']} MB (start {memory['rss_start_mb']} MB, peak {memory['peak_rss_mb']} MB)")
+    print(f"  fakes    gemini calls {report['gemini_calls']}, stored documents {report['stored_documents']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=SCENARIOS, default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients (default: 16)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run (default: 10)')
+    parser.add_argument('--requests', type=int, help='stop after this many requests instead of --duration')
+    parser.add_argument('--analyze-ratio', type=float, default=0.2, help='share of /analyze in the mixed scenario')
+    parser.add_argument('--users', type=int, default=50, help='distinct users (default: 50)')
+    parser.add_argument('--history-per-user', type=int, default=20, help='seeded analyses per user (default: 20)')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--no-history-cache', action='store_true', help='measure history reads without the cache')
+    parser.add_argument('--similarity', choices=('off', 'template', 'fast'), default='off',
+                        help='near-duplicate reuse mode (default: off)')
+    parser.add_argument('--compact', action='store_true', help='request the compact history representation')
+    parser.add_argument('--accept-encoding', default='gzip, br',
+                        help="Accept-Encoding sent with every request; '' for uncompressed (default: 'gzip, br')")
+    parser.add_argument('--json-encoder', choices=('auto', 'orjson', 'stdlib'), default='auto',
+                        help='JSON serializer of the app (default: auto)')
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help='fake Gemini latency in seconds')
+    parser.add_argument('--gemini-jitter', type=float, default=0.2)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0, help='fraction of Gemini calls that fail')
+    parser.add_argument('--storage', choices=('firestore', 'sqlite'), default='firestore',
+                        help='fake Firestore or a real SQLite store (default: firestore)')
+    parser.add_argument('--firestore-latency', type=float, default=0.01, help='fake Firestore round-trip in seconds')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the backend's own log output")
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON report to compare against; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed regression fraction (default: 0.10)')
+    args = parser.parse_args()
+    # Analyzed profiles must not collide with the seeded ones (they would be cache hits)
+    args.seed_offset = args.users * args.history_per_user
+
+    rss_start = rss_mb()
+    # The backend logs every call with print(); keep it out of the report unless asked for
+    with open(os.devnull, 'w') as devnull, redirect_stdout(sys.stderr if args.verbose else devnull):
+        backend, model, store = load_backend(args)
+        seed_history(backend, args.users, args.history_per_user)
+        seeded_calls = model.calls
+
+        results, wall_seconds = run_load(backend, args)
+        backend.write_queue.flush(timeout=60)
+
+    report = summarize(results, wall_seconds)
+    report['config'] = {key: value for key, value in vars(args).items() if key not in ('json', 'compare', 'verbose')}
+    report['memory'] = {'rss_start_mb': round(rss_start, 1), 'rss_mb': round(rss_mb(), 1),
+                        'peak_rss_mb': round(peak_rss_mb(), 1)}
+    report['gemini_calls'] = model.calls - seeded_calls
+    report['stored_documents'] = sum(1 for _ in store.iter_documents(fields=['user_id']))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Startup benchmark
+Measures, in fresh interpreter processes, how long importing the backend takes and
+how long the first request takes afterwards. Run it on two checkouts to compare:
+
+    python bench_startup.py                     # this checkout
+    python bench_startup.py --app-dir ../old    # another checkout of backend/
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Executed in a fresh interpreter for every run
+PROBE = r'''
+import json, sys, time, warnings
+warnings.filterwarnings('ignore')
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+import app as backend
+imported = time.perf_counter()
+client = backend.app.test_client()
+response = client.get('/health')
+first_request = time.perf_counter()
+response = client.get('/health')
+second_request = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'warm_request_ms': (second_request - first_request) * 1000,
+    'status': response.status_code
+}))
+'''
+
+
+def run_probe(app_dir):
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, app_dir],
+        cwd=app_dir, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app-dir', default=os.path.dirname(os.path.abspath(__file__)),
+                        help='directory containing app.py (default: this backend)')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes to measure (default: 5)')
+    args = parser.parse_args()
+
+    app_dir = os.path.abspath(args.app_dir)
+    samples = [run_probe(app_dir) for _ in range(args.runs)]
+
+    print(f"Startup benchmark for {app_dir} ({args.runs} runs, median / max)")
+    for metric in ('import_ms', 'first_request_ms', 'warm_request_ms'):
+        values = [sample[metric] for sample in samples]
+        print(f"  {metric:<18} {statistics.median(values):9.1f} ms  {max(values):9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
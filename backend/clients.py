@@ -0,0 +1,104 @@
+"""
+Lazily initialized SDK clients
+The Gemini and Firebase SDKs are imported and configured on first use instead of at
+module import, so workers boot quickly and nothing holding sockets or gRPC channels
+is created in a `gunicorn --preload` master before it forks
+"""
+
+import os
+import threading
+
+
+class LazySingleton:
+    """
+    Thread-safe, lazily created value
+    factory() runs at most once (until reset()); if it fails the value is None, matching
+    how an unconfigured Gemini/Firebase client is represented
+    """
+
+    def __init__(self, factory, name):
+        self.factory = factory
+        self.name = name
+        self._value = None
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._initialized:
+            return self._value
+        with self._lock:
+            if not self._initialized:
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    print(f"Warning: {self.name} initialization failed: {e}")
+                    self._value = None
+                self._initialized = True
+        return self._value
+
+    def set(self, value):
+        """Install a ready-made value (tests, benchmarks, stand-ins)"""
+        with self._lock:
+            self._value = value
+            self._initialized = True
+
+    def reset(self):
+        """Forget the value so the next get() creates it again (e.g. after fork)"""
+        with self._lock:
+            self._value = None
+            self._initialized = False
+
+    @property
+    def initialized(self):
+        return self._initialized
+
+
+def create_gemini_model(model_name, system_instruction, generation_config):
+    """Configure the Gemini SDK and build the model, or return None without an API key"""
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        print("Warning: GEMINI_API_KEY not set")
+        return None
+
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction,
+                                 generation_config=generation_config)
+
+
+def create_firestore_client():
+    """Initialize Firebase Admin and return a Firestore client, or None without credentials"""
+    if os.getenv('FIRESTORE_EMULATOR_HOST'):
+        # Local emulator: no credentials needed
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import firestore
+
+        print(f"Using Firestore emulator at {os.getenv('FIRESTORE_EMULATOR_HOST')}")
+        return firestore.Client(project=os.getenv('GOOGLE_CLOUD_PROJECT', 'demo-placement-analyzer'),
+                                credentials=AnonymousCredentials())
+
+    cred_path = os.getenv('FIREBASE_CREDENTIALS_PATH')
+    if not cred_path or not os.path.exists(cred_path):
+        print("Warning: Firebase credentials not found. Data storage disabled.")
+        return None
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(credentials.Certificate(cred_path))
+    client = firestore.client()
+    print("Firebase initialized successfully")
+    return client
+
+
+def warm_imports():
+    """
+    Import (without initializing) the heavy SDK modules
+    Called in a preloading gunicorn master so forked workers share the imported code
+    """
+    import google.generativeai  # noqa: F401
+    import firebase_admin.firestore  # noqa: F401
@@ -0,0 +1,332 @@
+"""
+Cohort analytics from precomputed rollups
+Every saved analysis increments one rollup per cohort dimension (plus an overall one):
+count, score sum/sum of squares, a 10-point score histogram, level counts and weak-area
+counts. Weak areas are counted by the score factor they are about (or 'other'), so a rollup
+document has a fixed set of fields however many analyses it covers. Rollups live in the `cohort_rollups` collection, are updated in the same batched
+write as the analysis documents and are read from memory, so cohort queries never scan
+`student_analyses`. rebuild_rollups() recomputes all of them in one vectorized pass.
+
+    python cohorts.py rebuild                       # from the configured store
+    python cohorts.py rebuild --from analyses.ndjson.gz   # from an export written by export_io.py
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from collections import Counter
+
+from incremental import FACTOR_KEYWORDS
+from scoring import FACTORS
+
+ROLLUP_COLLECTION = 'cohort_rollups'
+
+# Profile fields cohorts are grouped by
+COHORT_DIMENSIONS = ('college_tier', 'department', 'dsa_practice_frequency')
+OVERALL = ('all', 'all')
+
+HISTOGRAM_BUCKETS = 10
+LEVELS = ('Low', 'Medium', 'High')
+
+# Weak areas counted per analysis
+WEAK_AREAS_PER_ANALYSIS = 5
+
+# The bounded vocabulary weak areas are counted under
+OTHER_WEAK_AREA = 'other'
+WEAK_AREA_CATEGORIES = FACTORS + (OTHER_WEAK_AREA,)
+
+_SLUG_INVALID = re.compile(r'[^a-z0-9]+')
+
+
+def slug(text, limit=48):
+    """Lowercase a_b_c form usable as a document ID and a map key"""
+    return _SLUG_INVALID.sub('_', str(text).lower()).strip('_')[:limit] or 'unknown'
+
+
+def rollup_id(dimension, value):
+    return f"{dimension}__{slug(value)}"
+
+
+def score_bucket(score):
+    return min(max(int(score), 0) // 10, HISTOGRAM_BUCKETS - 1)
+
+
+def document_cohorts(document):
+    """(dimension, value) pairs a stored analysis document contributes to"""
+    profile = document.get('student_profile') or {}
+    cohorts = [OVERALL]
+    for dimension in COHORT_DIMENSIONS:
+        value = ' '.join(str(profile.get(dimension) or 'Unknown').split())
+        cohorts.append((dimension, value))
+    return cohorts
+
+
+def weak_area_category(text):
+    """The score factor a weak area is about (by keyword), else 'other'"""
+    lowered = str(text).lower()
+    for factor in FACTORS:
+        if any(keyword in lowered for keyword in FACTOR_KEYWORDS.get(factor, ())):
+            return factor
+    return OTHER_WEAK_AREA
+
+
+def document_weak_areas(document):
+    """Distinct weak-area categories of a stored analysis (each counted once per analysis)"""
+    weak_areas = (document.get('analysis') or {}).get('weak_areas') or []
+    if not isinstance(weak_areas, list):
+        return []
+    categories = []
+    for area in weak_areas[:WEAK_AREAS_PER_ANALYSIS]:
+        if str(area).strip():
+            category = weak_area_category(area)
+            if category not in categories:
+                categories.append(category)
+    return categories
+
+
+class Rollup:
+    """Aggregates of one cohort"""
+
+    def __init__(self, dimension, value):
+        self.dimension = dimension
+        self.value = value
+        self.count = 0
+        self.score_sum = 0
+        self.score_sq_sum = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.levels = dict.fromkeys(LEVELS, 0)
+        self.weak_areas = Counter()
+
+    def add(self, score, level, weak_areas):
+        self.count += 1
+        self.score_sum += score
+        self.score_sq_sum += score * score
+        self.histogram[score_bucket(score)] += 1
+        self.levels[level] = self.levels.get(level, 0) + 1
+        self.weak_areas.update(weak_areas)
+
+    def merge(self, other):
+        self.count += other.count
+        self.score_sum += other.score_sum
+        self.score_sq_sum += other.score_sq_sum
+        self.histogram = [mine + theirs for mine, theirs in zip(self.histogram, other.histogram)]
+        for level, count in other.levels.items():
+            self.levels[level] = self.levels.get(level, 0) + count
+        self.weak_areas.update(other.weak_areas)
+
+    def to_document(self):
+        """Stored form (also the shape written by a rebuild)"""
+        return {
+            'dimension': self.dimension,
+            'value': self.value,
+            'count': self.count,
+            'score_sum': self.score_sum,
+            'score_sq_sum': self.score_sq_sum,
+            'histogram': {str(bucket): count for bucket, count in enumerate(self.histogram)},
+            'levels': dict(self.levels),
+            'weak_areas': dict(self.weak_areas)
+        }
+
+    def to_increments(self, increment):
+        """
+        The rollup as Firestore increment transforms, for set(..., merge=True)
+        Increments are not idempotent: callers must not apply a document's delta twice
+        """
+        document = self.to_document()
+        for field in ('count', 'score_sum', 'score_sq_sum'):
+            document[field] = increment(document[field])
+        for field in ('histogram', 'levels', 'weak_areas'):
+            document[field] = {key: increment(count) for key, count in document[field].items() if count}
+        return document
+
+    @classmethod
+    def from_document(cls, document):
+        rollup = cls(document.get('dimension', ''), document.get('value', ''))
+        rollup.count = int(document.get('count', 0))
+        rollup.score_sum = int(document.get('score_sum', 0))
+        rollup.score_sq_sum = int(document.get('score_sq_sum', 0))
+        histogram = document.get('histogram') or {}
+        rollup.histogram = [int(histogram.get(str(bucket), 0)) for bucket in range(HISTOGRAM_BUCKETS)]
+        rollup.levels.update({level: int(count) for level, count in (document.get('levels') or {}).items()})
+        # Rollups written before weak areas were categorized can hold free-form keys; a rebuild removes them
+        rollup.weak_areas = Counter({area: int(count) for area, count in (document.get('weak_areas') or {}).items()
+                                     if area in WEAK_AREA_CATEGORIES})
+        return rollup
+
+    def summary(self, top_weak_areas=10):
+        mean = self.score_sum / self.count if self.count else 0.0
+        variance = self.score_sq_sum / self.count - mean * mean if self.count else 0.0
+        return {
+            'dimension': self.dimension,
+            'value': self.value,
+            'count': self.count,
+            'average_score': round(mean, 2),
+            'score_stddev': round(max(variance, 0.0) ** 0.5, 2),
+            'score_histogram': [
+                {'range': f"{bucket * 10}-{bucket * 10 + 9 if bucket < HISTOGRAM_BUCKETS - 1 else 100}", 'count': count}
+                for bucket, count in enumerate(self.histogram)
+            ],
+            'levels': dict(self.levels),
+            'top_weak_areas': [
+                {'weak_area': area.replace('_', ' '), 'count': count}
+                for area, count in self.weak_areas.most_common(top_weak_areas)
+            ]
+        }
+
+
+def rollup_deltas(documents):
+    """Per-cohort rollups of a group of analysis documents, keyed by rollup ID"""
+    deltas = {}
+    for document in documents:
+        score = int(document.get('readiness_score', 0) or 0)
+        level = document.get('readiness_level', 'Low')
+        weak_areas = document_weak_areas(document)
+        for dimension, value in document_cohorts(document):
+            key = rollup_id(dimension, value)
+            if key not in deltas:
+                deltas[key] = Rollup(dimension, value)
+            deltas[key].add(score, level, weak_areas)
+    return deltas
+
+
+class CohortRollups:
+    """
+    In-memory view of the rollup collection
+    Applied to directly after each commit and reloaded from the database every
+    `refresh_seconds` (so other workers' writes show up); queries are dictionary lookups
+    """
+
+    def __init__(self, refresh_seconds=60.0):
+        self.refresh_seconds = refresh_seconds
+        self._rollups = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def apply(self, deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                if key in self._rollups:
+                    self._rollups[key].merge(delta)
+                else:
+                    rollup = Rollup(delta.dimension, delta.value)
+                    rollup.merge(delta)
+                    self._rollups[key] = rollup
+
+    def load(self, store):
+        rollups = {key: Rollup.from_document(document) for key, document in store.load_rollups().items()}
+        with self._lock:
+            self._rollups = rollups
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self, store):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.load(store)
+
+    def dimensions(self):
+        with self._lock:
+            values = {dimension: [] for dimension in COHORT_DIMENSIONS}
+            for rollup in self._rollups.values():
+                if rollup.dimension in values:
+                    values[rollup.dimension].append({'value': rollup.value, 'count': rollup.count})
+        for entries in values.values():
+            entries.sort(key=lambda entry: -entry['count'])
+        return values
+
+    def get(self, dimension, value):
+        with self._lock:
+            rollup = self._rollups.get(rollup_id(dimension, value))
+            return rollup.summary() if rollup is not None else None
+
+    def list(self, dimension):
+        with self._lock:
+            rollups = [rollup for rollup in self._rollups.values() if rollup.dimension == dimension]
+            return sorted((rollup.summary(top_weak_areas=3) for rollup in rollups), key=lambda summary: -summary['count'])
+
+
+def rebuild_rollups(documents):
+    """
+    Recompute every rollup from scratch in one pass over `documents`
+    Scores are bucketed and summed per cohort with NumPy; weak areas are counted per cohort
+    """
+    import numpy as np
+
+    documents = list(documents)
+    scores = np.array([int(document.get('readiness_score', 0) or 0) for document in documents], dtype=np.int64)
+    levels = np.array([LEVELS.index(document.get('readiness_level')) if document.get('readiness_level') in LEVELS else 0
+                       for document in documents], dtype=np.int64)
+    buckets = np.clip(scores // 10, 0, HISTOGRAM_BUCKETS - 1)
+    cohorts = [document_cohorts(document) for document in documents]
+    weak_areas = [document_weak_areas(document) for document in documents]
+
+    rollups = {}
+    for column, dimension in enumerate(('all',) + COHORT_DIMENSIONS):
+        values = [document_cohort[column][1] for document_cohort in cohorts]
+        if not values:
+            continue
+        # Grouped by rollup ID, as the incremental path merges them: "Tier 1" and "tier-1" are one cohort
+        keys = np.array([rollup_id(dimension, value) for value in values], dtype=object)
+        groups, first_index, group_index = np.unique(keys.astype(str), return_index=True, return_inverse=True)
+        group_count = len(groups)
+        counts = np.bincount(group_index, minlength=group_count)
+        score_sums = np.bincount(group_index, weights=scores, minlength=group_count)
+        score_sq_sums = np.bincount(group_index, weights=scores * scores, minlength=group_count)
+        histograms = np.bincount(group_index * HISTOGRAM_BUCKETS + buckets,
+                                 minlength=group_count * HISTOGRAM_BUCKETS).reshape(group_count, HISTOGRAM_BUCKETS)
+        level_counts = np.bincount(group_index * len(LEVELS) + levels,
+                                   minlength=group_count * len(LEVELS)).reshape(group_count, len(LEVELS))
+        group_weak_areas = [Counter() for _ in range(group_count)]
+        for group, areas in zip(group_index, weak_areas):
+            group_weak_areas[group].update(areas)
+
+        for group, key in enumerate(groups):
+            # Named after the first document of the cohort
+            rollup = Rollup(dimension, values[first_index[group]])
+            rollup.count = int(counts[group])
+            rollup.score_sum = int(score_sums[group])
+            rollup.score_sq_sum = int(score_sq_sums[group])
+            rollup.histogram = [int(count) for count in histograms[group]]
+            rollup.levels = {level: int(count) for level, count in zip(LEVELS, level_counts[group])}
+            rollup.weak_areas = group_weak_areas[group]
+            rollups[str(key)] = rollup
+    return rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('rebuild',))
+    parser.add_argument('--from', dest='source', help='export_io.py export to rebuild from (default: read the configured store)')
+    parser.add_argument('--dry-run', action='store_true', help='print the rollups instead of writing them')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from clients import create_firestore_client
+    from storage import create_store
+
+    load_dotenv()
+    store = None if args.dry_run and args.source else create_store(create_firestore_client)
+    if store is None and not args.dry_run:
+        raise SystemExit("Storage not configured")
+
+    started_at = time.perf_counter()
+    if args.source:
+        from export_io import read_export_documents
+
+        documents = (document for _, document in read_export_documents(args.source))
+    else:
+        fields = ['readiness_score', 'readiness_level', 'student_profile', 'analysis.weak_areas']
+        documents = (document for _, document in store.iter_documents(fields=fields))
+    rollups = rebuild_rollups(documents)
+    print(f"Rebuilt {len(rollups)} cohort rollups in {time.perf_counter() - started_at:.2f}s")
+
+    if args.dry_run:
+        for rollup in rollups.values():
+            print(json.dumps(rollup.summary(top_weak_areas=3)))
+    else:
+        store.replace_rollups({key: rollup.to_document() for key, rollup in rollups.items()})
+        print(f"Wrote {len(rollups)} rollups to {ROLLUP_COLLECTION}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Columnar bulk export and import of stored analyses
+Documents are paged out of `student_analyses` and flattened into column groups:
+  id.*        document ID, user, timestamp, version lineage
+  score.*     readiness score, level and per-factor breakdown
+  profile.*   numeric profile fields plus counts derived from the free-text ones
+  text.*      the free-text profile fields
+  narrative.* the generated sections (summary, lists, 30-day plan)
+  source.*    where the analysis came from: Gemini, a delta update of the previous version,
+              a reused near-duplicate or the plan library
+Rows are processed in fixed-size chunks from generators, so memory stays bounded by the
+chunk size. Output is Parquet (one row group per chunk, needs pyarrow) or columnar NDJSON
+(a header line, then one line per chunk holding column arrays; gzip with a .gz suffix).
+
+    python export_io.py export analyses.parquet
+    python export_io.py export analyses.ndjson.gz --user-id abc123 --chunk-size 1000
+    python export_io.py import analyses.ndjson.gz            # FIRESTORE_EMULATOR_HOST targets the emulator
+    STORAGE_BACKEND=sqlite python export_io.py import analyses.ndjson.gz   # load a local SQLite store
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+
+from scoring import count_entries, internship_months
+
+FORMAT_NAME = 'analyses-columnar-ndjson'
+FORMAT_VERSION = 2
+
+ID_COLUMNS = ('id.document_id', 'id.user_id', 'id.timestamp', 'id.version', 'id.previous_document_id')
+SCORE_COLUMNS = ('score.readiness_score', 'score.readiness_level', 'score.breakdown')
+PROFILE_NUMERIC_FIELDS = ('cgpa', 'attendance', 'mock_interview_score', 'resume_score')
+PROFILE_COUNT_FIELDS = ('hackathons', 'technologies', 'certifications', 'projects')
+PROFILE_COLUMNS = tuple(f"profile.{field}" for field in PROFILE_NUMERIC_FIELDS) + \
+    tuple(f"profile.{field}_count" for field in PROFILE_COUNT_FIELDS) + ('profile.internship_months',)
+TEXT_FIELDS = ('name', 'location', 'college', 'college_tier', 'qualification', 'department',
+               'dsa_practice_frequency') + PROFILE_COUNT_FIELDS + ('internships',)
+TEXT_COLUMNS = tuple(f"text.{field}" for field in TEXT_FIELDS)
+NARRATIVE_LIST_FIELDS = ('strengths', 'weak_areas', 'risk_factors', 'recommendations')
+NARRATIVE_COLUMNS = ('narrative.summary',) + tuple(f"narrative.{field}" for field in NARRATIVE_LIST_FIELDS) + \
+    ('narrative.30_day_plan',)
+# kind is 'gemini', 'delta' (sections regenerated from previous_document_id), 'reused' (SIMILARITY_MODE)
+# or 'degraded' (assembled by plan_library.py)
+SOURCE_COLUMNS = ('source.kind', 'source.degraded_reason', 'source.reuse_mode', 'source.reuse_distance',
+                  'source.delta_changed_fields', 'source.delta_regenerated_sections')
+SOURCE_LIST_COLUMNS = ('source.delta_changed_fields', 'source.delta_regenerated_sections')
+COLUMNS = ID_COLUMNS + SCORE_COLUMNS + PROFILE_COLUMNS + TEXT_COLUMNS + NARRATIVE_COLUMNS + SOURCE_COLUMNS
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def analysis_source(document):
+    """'degraded', 'reused', 'delta' or 'gemini' for a stored analysis document"""
+    if document.get('degraded'):
+        return 'degraded'
+    if document.get('reuse'):
+        return 'reused'
+    if document.get('delta'):
+        return 'delta'
+    return 'gemini'
+
+
+def flatten_document(doc_id, document):
+    """One export row (column -> value) for a stored analysis document"""
+    profile = document.get('student_profile') or {}
+    analysis = document.get('analysis') or {}
+    degraded = document.get('degraded') or {}
+    reuse = document.get('reuse') or {}
+    delta = document.get('delta') or {}
+    row = {
+        'id.document_id': doc_id,
+        'id.user_id': document.get('user_id', ''),
+        'id.timestamp': _timestamp(document.get('timestamp')),
+        'id.version': int(document.get('version', 1)),
+        'id.previous_document_id': document.get('previous_document_id'),
+        'score.readiness_score': int(document.get('readiness_score', analysis.get('readiness_score', 0)) or 0),
+        'score.readiness_level': document.get('readiness_level', analysis.get('readiness_level', '')),
+        'score.breakdown': json.dumps(analysis['score_breakdown'], separators=(',', ':'))
+        if analysis.get('score_breakdown') else None,
+        'profile.internship_months': float(internship_months(profile.get('internships'))),
+        'text.internships': json.dumps(profile.get('internships') or [], separators=(',', ':')),
+        'narrative.summary': analysis.get('summary', ''),
+        'narrative.30_day_plan': json.dumps(analysis.get('30_day_plan') or {}, separators=(',', ':')),
+        'source.kind': analysis_source(document),
+        'source.degraded_reason': degraded.get('reason'),
+        'source.reuse_mode': reuse.get('mode'),
+        'source.reuse_distance': _number(reuse.get('distance')),
+        'source.delta_changed_fields': [str(field) for field in delta['changed_fields']]
+        if delta.get('changed_fields') is not None else None,
+        'source.delta_regenerated_sections': [str(section) for section in delta['regenerated_sections']]
+        if delta.get('regenerated_sections') is not None else None,
+    }
+    for field in PROFILE_NUMERIC_FIELDS:
+        row[f"profile.{field}"] = _number(profile.get(field))
+    for field in PROFILE_COUNT_FIELDS:
+        row[f"profile.{field}_count"] = count_entries(profile.get(field))
+    for field in TEXT_FIELDS:
+        if field != 'internships':
+            value = profile.get(field, '')
+            row[f"text.{field}"] = '' if value is None else str(value)
+    for field in NARRATIVE_LIST_FIELDS:
+        value = analysis.get(field) or []
+        row[f"narrative.{field}"] = [str(item) for item in value] if isinstance(value, list) else [str(value)]
+    return row
+
+
+def unflatten_row(row):
+    """(doc_id, document) rebuilt from an export row, in the stored document shape"""
+    profile = {field: row.get(f"text.{field}", '') for field in TEXT_FIELDS if field != 'internships'}
+    for field in PROFILE_NUMERIC_FIELDS:
+        profile[field] = row.get(f"profile.{field}")
+    profile['internships'] = json.loads(row.get('text.internships') or '[]')
+    analysis = {
+        'summary': row.get('narrative.summary', ''),
+        '30_day_plan': json.loads(row.get('narrative.30_day_plan') or '{}'),
+        'readiness_score': row.get('score.readiness_score'),
+        'readiness_level': row.get('score.readiness_level'),
+    }
+    for field in NARRATIVE_LIST_FIELDS:
+        analysis[field] = list(row.get(f"narrative.{field}") or [])
+    if row.get('score.breakdown'):
+        analysis['score_breakdown'] = json.loads(row['score.breakdown'])
+    document = {
+        'user_id': row.get('id.user_id', ''),
+        'student_profile': profile,
+        'analysis': analysis,
+        'timestamp': row.get('id.timestamp'),
+        'readiness_score': row.get('score.readiness_score'),
+        'readiness_level': row.get('score.readiness_level'),
+    }
+    if row.get('id.previous_document_id'):
+        document['previous_document_id'] = row['id.previous_document_id']
+        document['version'] = row.get('id.version', 1)
+    # Version 1 exports have no source columns
+    if row.get('source.kind') == 'degraded':
+        document['degraded'] = {'reason': row.get('source.degraded_reason'), 'source': 'plan_library'}
+    elif row.get('source.kind') == 'reused':
+        document['reuse'] = {'mode': row.get('source.reuse_mode'), 'distance': row.get('source.reuse_distance')}
+    elif row.get('source.kind') == 'delta':
+        document['delta'] = {'changed_fields': list(row.get('source.delta_changed_fields') or []),
+                             'regenerated_sections': list(row.get('source.delta_regenerated_sections') or [])}
+    return row['id.document_id'], document
+
+
+def iter_chunks(items, chunk_size):
+    """Group an iterable into lists of at most chunk_size items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def columnar_chunk(rows):
+    """Column-major form of a chunk of rows"""
+    return {column: [row.get(column) for row in rows] for column in COLUMNS}
+
+
+def ndjson_header():
+    groups = {}
+    for column in COLUMNS:
+        groups.setdefault(column.split('.', 1)[0], []).append(column)
+    return {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'columns': list(COLUMNS), 'groups': groups}
+
+
+def ndjson_chunk_line(rows):
+    return json.dumps({'rows': len(rows), 'columns': columnar_chunk(rows)}, separators=(',', ':')) + '\n'
+
+
+def iter_ndjson_lines(documents, chunk_size=500):
+    """Columnar NDJSON lines (header first, then one line per chunk) for (doc_id, document) pairs"""
+    yield json.dumps(ndjson_header(), separators=(',', ':')) + '\n'
+    for chunk in iter_chunks(documents, chunk_size):
+        yield ndjson_chunk_line([flatten_document(doc_id, document) for doc_id, document in chunk])
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Parquet export needs the 'pyarrow' package; use a .ndjson or .ndjson.gz file instead")
+    return pyarrow, pyarrow.parquet
+
+
+def _arrow_schema(pa):
+    fields = []
+    for column in COLUMNS:
+        if column in ('score.readiness_score', 'id.version') or column.endswith('_count'):
+            column_type = pa.int64()
+        elif column.startswith('profile.') or column == 'source.reuse_distance':
+            column_type = pa.float64()
+        elif (column.startswith('narrative.') and column.split('.', 1)[1] in NARRATIVE_LIST_FIELDS
+              or column in SOURCE_LIST_COLUMNS):
+            column_type = pa.list_(pa.string())
+        else:
+            column_type = pa.string()
+        fields.append(pa.field(column, column_type))
+    return pa.schema(fields)
+
+
+def write_export(path, documents, chunk_size=500):
+    """Write (doc_id, document) pairs to `path` (.parquet, .ndjson or .ndjson.gz); returns the row count"""
+    count = 0
+    if path.endswith('.parquet'):
+        pa, pq = _require_pyarrow()
+        schema = _arrow_schema(pa)
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            for chunk in iter_chunks(documents, chunk_size):
+                rows = [flatten_document(doc_id, document) for doc_id, document in chunk]
+                writer.write_table(pa.Table.from_pydict(columnar_chunk(rows), schema=schema))
+                count += len(rows)
+        return count
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8') as output:
+        output.write(json.dumps(ndjson_header(), separators=(',', ':')) + '\n')
+        for chunk in iter_chunks(documents, chunk_size):
+            output.write(ndjson_chunk_line([flatten_document(doc_id, document) for doc_id, document in chunk]))
+            count += len(chunk)
+    return count
+
+
+def iter_export_rows(path):
+    """Yield export rows from a file written by write_export()"""
+    if path.endswith('.parquet'):
+        _, pq = _require_pyarrow()
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches():
+            yield from batch.to_pylist()
+        return
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as source:
+        header = json.loads(source.readline() or '{}')
+        if header.get('format') != FORMAT_NAME:
+            raise Exception(f"{path} is not a {FORMAT_NAME} export")
+        for line in source:
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            columns = chunk['columns']
+            names = list(columns)
+            for values in zip(*(columns[name] for name in names)):
+                yield dict(zip(names, values))
+
+
+def read_export_documents(path):
+    """Yield (doc_id, document) pairs from an export file"""
+    for row in iter_export_rows(path):
+        yield unflatten_row(row)
+
+
+def import_documents(store, documents, batch_size=500):
+    """Write (doc_id, document) pairs to a storage backend in batches; returns the number written"""
+    count = 0
+    for chunk in iter_chunks(documents, batch_size):
+        store.commit(chunk)
+        count += len(chunk)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('path', help='.parquet, .ndjson or .ndjson.gz file')
+    parser.add_argument('--user-id', help='export only this user\'s analyses')
+    parser.add_argument('--chunk-size', type=int, default=500, help='rows per chunk / batched write (max 500 for import)')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from clients import create_firestore_client
+    from storage import create_store
+
+    load_dotenv()
+    store = create_store(create_firestore_client)
+    if store is None:
+        raise SystemExit("Storage not configured")
+
+    started_at = time.perf_counter()
+    if args.command == 'export':
+        count = write_export(args.path, store.iter_documents(args.chunk_size, args.user_id), args.chunk_size)
+        print(f"Exported {count} analyses to {args.path} in {time.perf_counter() - started_at:.1f}s")
+    else:
+        count = import_documents(store, read_export_documents(args.path), min(args.chunk_size, 500))
+        print(f"Imported {count} analyses from {args.path} in {time.perf_counter() - started_at:.1f}s")
+        print("Run `python cohorts.py rebuild` to bring the cohort rollups up to date", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Gunicorn configuration
+gevent workers let one process hold many in-flight analyses (including
+/analyze/stream connections) while they wait on Gemini.
+Set GUNICORN_WORKER_CLASS=sync to fall back to the classic sync workers.
+GUNICORN_PRELOAD=1 loads the app (and imports, but does not initialize, the
+Gemini/Firebase SDKs) once in the master before forking workers.
+JOB_WORKER_PROCESSES=N also starts N worker.py processes for /analyze?async=1 jobs.
+APP_PROCESSES is set to the number of processes that save analyses (see history_cache.py).
+"""
+
+import os
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+job_worker_processes = int(os.getenv('JOB_WORKER_PROCESSES', 0))
+
+# Read by every web worker and worker.py process this master starts
+os.environ.setdefault('APP_PROCESSES', str(workers + job_worker_processes))
+
+job_worker_pool = []
+
+
+def on_starting(server):
+    if preload_app:
+        from clients import warm_imports
+        warm_imports()
+    if job_worker_processes:
+        from worker import start_worker_pool
+        job_worker_pool.extend(start_worker_pool(job_worker_processes, int(os.getenv('JOB_WORKER_THREADS', 4))))
+
+
+def on_exit(server):
+    if job_worker_pool:
+        from worker import stop_worker_pool
+        stop_worker_pool(job_worker_pool)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # grpc (used by the Gemini and Firestore clients) must yield to gevent's event loop
+        import grpc.experimental.gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+
+    # Clients are lazy, but never reuse one a preloading master may have created
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.reset_clients()
@@ -0,0 +1,273 @@
+"""
+Read-through cache for per-user analysis history
+Filled on the first read of a user's history and updated in place when a new
+analysis is saved, so repeat dashboard loads cost no Firestore round-trips
+Backends (MemoryHistoryBackend, RedisHistoryBackend) store JSON strings and expose:
+
+    get(key) / set(key, value) / delete(key)
+    update(key, fn)      apply fn(old_value) -> new_value atomically (fn receives None for a
+                         missing key and may return None to leave the key absent)
+    stats()              backend-specific counters for /health
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Keys kept in the summary projection of a history entry
+SUMMARY_KEYS = ('id', 'timestamp', 'readiness_score', 'readiness_level')
+
+# Projections cached per user (matching the ?fields= values of the history endpoint)
+FIELD_VARIANTS = ('full', 'summary')
+
+
+class MemoryHistoryBackend:
+    """
+    In-process LRU bounded by the total size of the cached JSON
+    Entries expire after ttl_seconds: saves handled by other processes never reach this one
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=30):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # key -> (value, expires_at)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            value = self._live(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _store(self, key, value, expires_at=None):
+        self._remove(key)
+        if value is None or len(value) > self.max_bytes:
+            return
+        if expires_at is None:
+            expires_at = time.monotonic() + self.ttl_seconds
+        self._entries[key] = (value, expires_at)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _remove(self, key):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[0])
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def update(self, key, fn):
+        with self._lock:
+            old = self._live(key)
+            # An in-place update keeps the expiry of the value it was derived from
+            expires_at = self._entries[key][1] if old is not None else None
+            self._store(key, fn(old), expires_at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class RedisHistoryBackend:
+    """
+    Shared backend for multi-worker deployments
+    Works with Redis or any Redis-protocol-compatible server (KeyDB, Dragonfly, ...)
+    """
+
+    name = 'redis'
+
+    def __init__(self, url, ttl_seconds=3600, prefix='history:'):
+        try:
+            import redis
+        except ImportError:
+            raise Exception("HISTORY_CACHE_BACKEND=redis requires the 'redis' package")
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        self._redis.set(self.prefix + key, value, ex=self.ttl_seconds)
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + key)
+
+    def update(self, key, fn):
+        full_key = self.prefix + key
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic transaction: retried if another worker writes the key meanwhile
+                    pipe.watch(full_key)
+                    old = pipe.get(full_key)
+                    new = fn(old.decode('utf-8') if old is not None else None)
+                    pipe.multi()
+                    if new is None:
+                        pipe.delete(full_key)
+                    else:
+                        pipe.set(full_key, new, ex=self.ttl_seconds)
+                    pipe.execute()
+                    return
+                except self._watch_error:
+                    continue
+
+    def stats(self):
+        return {'ttl_seconds': self.ttl_seconds}
+
+
+class HistoryCache:
+    """
+    Caches the newest page of each user's history, per field projection
+    A cached value holds the leading entries of the history plus whether older ones exist
+    """
+
+    def __init__(self, backend=None, max_entries_per_user=100):
+        self.backend = backend if backend is not None else MemoryHistoryBackend()
+        self.max_entries_per_user = max_entries_per_user
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id, fields):
+        return f"{user_id}:{fields}"
+
+    def get_page(self, user_id, fields, page_size):
+        """
+        Return (entries, has_more) for the first page of a user's history, or None on a miss
+        """
+        value = None
+        try:
+            value = self.backend.get(self._key(user_id, fields))
+        except Exception as e:
+            print(f"History cache read error: {e}")
+        if value is not None:
+            cached = json.loads(value)
+            entries = cached['entries']
+            # Serve only if the cached prefix covers the page (or is the whole history)
+            if len(entries) >= page_size or not cached['has_more']:
+                with self._lock:
+                    self.hits += 1
+                return entries[:page_size], len(entries) > page_size or cached['has_more']
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def fill(self, user_id, fields, entries, has_more):
+        """Store the first page of a user's history after a read from the database"""
+        entries = entries[:self.max_entries_per_user]
+        value = json.dumps({'entries': entries, 'has_more': has_more}, separators=(',', ':'))
+        try:
+            self.backend.set(self._key(user_id, fields), value)
+        except Exception as e:
+            print(f"History cache write error: {e}")
+
+    def record(self, user_id, entry):
+        """
+        Prepend a newly saved analysis (a full history entry) to every cached projection
+        Users with nothing cached are left alone; their next read fills the cache
+        """
+        for fields in FIELD_VARIANTS:
+            if fields == 'summary':
+                projected = {key: entry[key] for key in SUMMARY_KEYS if key in entry}
+            else:
+                projected = entry
+
+            def prepend(value, projected=projected):
+                if value is None:
+                    return None
+                cached = json.loads(value)
+                entries = [projected] + cached['entries']
+                has_more = cached['has_more']
+                if len(entries) > self.max_entries_per_user:
+                    entries = entries[:self.max_entries_per_user]
+                    has_more = True
+                return json.dumps({'entries': entries, 'has_more': has_more}, separators=(',', ':'))
+
+            try:
+                self.backend.update(self._key(user_id, fields), prepend)
+            except Exception as e:
+                print(f"History cache update error: {e}")
+
+    def invalidate(self, user_id):
+        for fields in FIELD_VARIANTS:
+            try:
+                self.backend.delete(self._key(user_id, fields))
+            except Exception as e:
+                print(f"History cache delete error: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = {'backend': self.backend.name, 'hits': self.hits, 'misses': self.misses}
+        stats.update(self.backend.stats())
+        return stats
+
+
+def create_history_cache(max_entries_per_user=100):
+    """
+    Build the history cache from environment variables
+    HISTORY_CACHE_BACKEND=redis (with REDIS_URL) shares the cache between workers. The in-process
+    backend only sees saves made by its own process, so when APP_PROCESSES (set by gunicorn.conf.py)
+    reports several processes it is turned off unless HISTORY_CACHE_BACKEND=memory is set explicitly
+    """
+    backend_name = os.getenv('HISTORY_CACHE_BACKEND', 'auto')
+    ttl = os.getenv('HISTORY_CACHE_TTL')
+    backend = None
+    if backend_name == 'redis':
+        try:
+            backend = RedisHistoryBackend(
+                os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                ttl_seconds=int(ttl or 3600)
+            )
+        except Exception as e:
+            print(f"Warning: Could not use Redis history cache, using memory: {e}")
+    if backend is None:
+        max_bytes = int(os.getenv('HISTORY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        processes = int(os.getenv('APP_PROCESSES', 1))
+        if backend_name != 'memory' and processes > 1:
+            print(f"History cache off: {processes} processes save analyses and an in-process cache would serve "
+                  f"stale history (set HISTORY_CACHE_BACKEND=redis to share one)")
+            # Nothing fits in zero bytes, so every read goes to the store
+            max_bytes = 0
+        backend = MemoryHistoryBackend(max_bytes=max_bytes, ttl_seconds=int(ttl or 30))
+    return HistoryCache(backend=backend, max_entries_per_user=max_entries_per_user)
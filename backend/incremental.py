@@ -0,0 +1,116 @@
+"""
+Incremental re-analysis
+When a student resubmits with a few fields changed, only the analysis sections those
+fields affect are regenerated; everything else is carried over from the previous analysis
+"""
+
+from analysis_schema import PLAN_WEEKS
+from response_cache import canonical_profile
+from scoring import FACTORS
+
+# Sections rewritten whenever a scored factor changes (its contribution moved)
+FACTOR_SECTIONS = ('summary', 'strengths', 'weak_areas', 'recommendations')
+
+# Profile fields that do not affect the score but are referred to in the summary
+DESCRIPTIVE_SECTIONS = {
+    'name': ('summary',),
+    'location': ('summary',),
+    'college': ('summary',),
+    'college_tier': ('summary', 'recommendations'),
+    'department': ('summary', 'recommendations'),
+}
+
+# Words identifying the plan week that works on a factor
+FACTOR_KEYWORDS = {
+    'cgpa': ('cgpa', 'academic', 'grade', 'exam', 'coursework'),
+    'attendance': ('attendance', 'lecture', 'class'),
+    'qualification': ('degree', 'qualification'),
+    'dsa_practice_frequency': ('dsa', 'data structure', 'algorithm', 'leetcode', 'coding problem', 'problem solving',
+                               'problem-solving'),
+    'internships': ('internship', 'industry', 'work experience'),
+    'mock_interview_score': ('mock', 'interview'),
+    'resume_score': ('resume', 'cv', 'linkedin'),
+    'hackathons': ('hackathon', 'competition', 'contest'),
+    'technologies': ('technolog', 'language', 'framework', 'stack'),
+    'certifications': ('certif', 'course'),
+    'projects': ('project', 'portfolio', 'github'),
+}
+
+# Beyond this many changed scored factors the whole analysis is regenerated
+MAX_CHANGED_FACTORS = 3
+
+
+def changed_fields(previous_profile, student_data, fields):
+    """Fields whose normalized value differs between the stored and the submitted profile"""
+    before = canonical_profile(previous_profile, fields)
+    after = canonical_profile(student_data, fields)
+    return [field for field in fields if before[field] != after[field]]
+
+
+def _short(value, limit=80):
+    if isinstance(value, list):
+        value = '; '.join(
+            f"{item.get('company', 'N/A')} ({item.get('duration', 'N/A')})" if isinstance(item, dict) else str(item)
+            for item in value
+        ) or 'none'
+    text = ' '.join(str(value).split())
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+def describe_changes(previous_profile, student_data, changed):
+    """One "field: old -> new" line per changed field"""
+    return [f"{field}: {_short(previous_profile.get(field, ''))} -> {_short(student_data.get(field, ''))}"
+            for field in changed]
+
+
+def plan_week_for(factors, plan):
+    """The plan week whose focus/tasks mention one of `factors`, else the last week"""
+    keywords = [keyword for factor in factors for keyword in FACTOR_KEYWORDS.get(factor, ())]
+    if isinstance(plan, dict):
+        for week in PLAN_WEEKS:
+            week_value = plan.get(week)
+            if not isinstance(week_value, dict):
+                continue
+            text = ' '.join([str(week_value.get('focus', ''))] + [str(task) for task in week_value.get('tasks', [])])
+            text = text.lower()
+            if any(keyword in text for keyword in keywords):
+                return week
+    return PLAN_WEEKS[-1]
+
+
+def affected_sections(changed, previous_analysis, previous_level, new_level):
+    """
+    Dotted paths (as used by schema_for_paths) to regenerate for the changed fields
+    Returns None when so much changed that a full analysis is cheaper to reason about
+    """
+    factors = [field for field in changed if field in FACTORS]
+    if len(factors) > MAX_CHANGED_FACTORS:
+        return None
+
+    sections = []
+    for field in changed:
+        for section in DESCRIPTIVE_SECTIONS.get(field, ()):
+            if section not in sections:
+                sections.append(section)
+    if factors:
+        for section in FACTOR_SECTIONS:
+            if section not in sections:
+                sections.append(section)
+        sections.append(f"30_day_plan.{plan_week_for(factors, previous_analysis.get('30_day_plan'))}")
+    if previous_level != new_level:
+        sections.append('risk_factors')
+    return sections
+
+
+def render_delta_context(change_lines, previous_analysis, sections):
+    """Prompt lines describing what changed and the unchanged plan weeks the update must fit with"""
+    lines = ["Changes since the previous analysis:"]
+    lines.extend(f"- {line}" for line in change_lines)
+    plan = previous_analysis.get('30_day_plan')
+    regenerated_weeks = {section.split('.', 1)[1] for section in sections if section.startswith('30_day_plan.')}
+    if isinstance(plan, dict) and regenerated_weeks:
+        kept = [f"{week}: {plan[week].get('focus', '')}" for week in PLAN_WEEKS
+                if week not in regenerated_weeks and isinstance(plan.get(week), dict)]
+        if kept:
+            lines.append(f"Unchanged plan weeks (do not repeat them): {'; '.join(kept)}")
+    return '\n'.join(lines)
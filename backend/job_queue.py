@@ -0,0 +1,363 @@
+"""
+Durable local queue of analysis jobs for /analyze?async=1
+Jobs live in a SQLite database (WAL mode) shared by the web workers, which enqueue them,
+and the worker processes started by worker.py, which claim them in priority order.
+A claim is a lease: a job whose worker died is handed out again once the lease expires,
+until it has used max_attempts. The running worker renews it (heartbeat()) so a slow job
+is not handed out twice. Only the worker holding a job's lease can finish it.
+The same database holds the per-item state of /analyze/batch jobs, so any web worker can
+answer a status poll.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from storage import ConnectionPool
+
+# Named priorities accepted by /analyze?async=1&priority=
+PRIORITIES = {'low': 0, 'normal': 5, 'high': 9}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+FINISHED_STATUSES = (DONE, ERROR)
+
+
+class QueueFull(Exception):
+    """Raised by enqueue() when the queue already holds max_depth unfinished jobs"""
+
+
+class JobQueue:
+    """
+    Priority queue of jobs in a SQLite table
+    Higher priority first, then oldest first; each claim increments `attempts`
+    """
+
+    def __init__(self, path, max_depth=10000, lease_seconds=300.0, max_attempts=3,
+                 retention_seconds=86400.0, pool_size=4):
+        self.path = path
+        self.max_depth = max_depth
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.pool = ConnectionPool(self._connect, size=pool_size)
+        self._last_purge = 0.0
+        with self.pool.connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS analysis_jobs ('
+                ' id TEXT PRIMARY KEY,'
+                ' status TEXT NOT NULL,'
+                ' priority INTEGER NOT NULL,'
+                ' payload TEXT NOT NULL,'
+                ' result TEXT,'
+                ' error TEXT,'
+                ' status_code INTEGER,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' worker TEXT,'
+                ' created_at REAL NOT NULL,'
+                ' started_at REAL,'
+                ' finished_at REAL,'
+                ' lease_expires_at REAL)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_analysis_jobs_claim ON analysis_jobs (status, priority DESC, created_at)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS batch_jobs ('
+                ' id TEXT PRIMARY KEY,'
+                ' total INTEGER NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' finished_at REAL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS batch_items ('
+                ' job_id TEXT NOT NULL,'
+                ' idx INTEGER NOT NULL,'
+                ' status TEXT NOT NULL,'
+                ' fields TEXT NOT NULL,'
+                ' analysis TEXT,'
+                ' PRIMARY KEY (job_id, idx))'
+            )
+
+    def _connect(self):
+        import sqlite3
+
+        conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def enqueue(self, payload, priority=PRIORITIES['normal']):
+        """Add a job; returns its ID"""
+        job_id = str(uuid.uuid4())
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                depth = conn.execute(
+                    'SELECT COUNT(*) FROM analysis_jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+                ).fetchone()[0]
+                if depth >= self.max_depth:
+                    raise QueueFull(f"Analysis queue is full ({depth} jobs waiting)")
+                conn.execute(
+                    'INSERT INTO analysis_jobs (id, status, priority, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (job_id, QUEUED, priority, json.dumps(payload), time.time())
+                )
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        return job_id
+
+    def claim(self, worker_id):
+        """
+        Lease the next job to `worker_id`: returns (job_id, payload, attempts) or None
+        Jobs whose lease expired (their worker died or hung) are claimed again while they have
+        attempts left, and fail once they have none
+        """
+        now = time.time()
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'UPDATE analysis_jobs SET status = ?, error = ?, status_code = ?, finished_at = ?,'
+                    ' lease_expires_at = NULL WHERE status = ? AND lease_expires_at < ? AND attempts >= ?',
+                    (ERROR, f"Job lease expired on each of its {self.max_attempts} attempts", 500, now,
+                     RUNNING, now, self.max_attempts)
+                )
+                row = conn.execute(
+                    'SELECT id, payload, attempts FROM analysis_jobs WHERE status = ?'
+                    ' ORDER BY priority DESC, created_at LIMIT 1', (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    row = conn.execute(
+                        'SELECT id, payload, attempts FROM analysis_jobs WHERE status = ? AND lease_expires_at < ?'
+                        ' AND attempts < ? ORDER BY priority DESC, created_at LIMIT 1',
+                        (RUNNING, now, self.max_attempts)
+                    ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        'UPDATE analysis_jobs SET status = ?, attempts = attempts + 1, worker = ?,'
+                        ' started_at = ?, lease_expires_at = ? WHERE id = ?',
+                        (RUNNING, worker_id, now, now + self.lease_seconds, row[0])
+                    )
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def renew(self, job_id, worker_id):
+        """Extend the lease by lease_seconds; returns False if `worker_id` no longer holds it"""
+        with self.pool.connection() as conn:
+            renewed = conn.execute(
+                'UPDATE analysis_jobs SET lease_expires_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                (time.time() + self.lease_seconds, job_id, worker_id, RUNNING)
+            ).rowcount
+        return renewed > 0
+
+    @contextmanager
+    def heartbeat(self, job_id, worker_id, interval=None):
+        """Renew the lease every `interval` seconds (a third of the lease by default) while the block runs"""
+        interval = interval or self.lease_seconds / 3
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    if not self.renew(job_id, worker_id):
+                        print(f"Analysis job {job_id}: lease lost, heartbeat stopped")
+                        return
+                except Exception as e:
+                    print(f"Analysis job {job_id}: could not renew the lease: {e}")
+
+        thread = threading.Thread(target=beat, name=f'job-heartbeat-{job_id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, job_id, worker_id, result, status_code=200):
+        """Record the result; returns False (and changes nothing) if `worker_id` no longer holds the lease"""
+        return self._finish(job_id, worker_id, DONE, result=json.dumps(result), status_code=status_code)
+
+    def fail(self, job_id, worker_id, error, status_code=500, retry=False):
+        """
+        Record a failed attempt; with retry (and attempts left) the job is queued again
+        Returns False (and changes nothing) if `worker_id` no longer holds the lease
+        """
+        if retry:
+            with self.pool.connection() as conn:
+                requeued = conn.execute(
+                    'UPDATE analysis_jobs SET status = ?, error = ?, worker = NULL, lease_expires_at = NULL'
+                    ' WHERE id = ? AND worker = ? AND status = ? AND attempts < ?',
+                    (QUEUED, error, job_id, worker_id, RUNNING, self.max_attempts)
+                ).rowcount
+            if requeued:
+                return True
+        return self._finish(job_id, worker_id, ERROR, error=error, status_code=status_code)
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None, status_code=None):
+        now = time.time()
+        with self.pool.connection() as conn:
+            finished = conn.execute(
+                'UPDATE analysis_jobs SET status = ?, result = ?, error = ?, status_code = ?, finished_at = ?,'
+                ' lease_expires_at = NULL WHERE id = ? AND worker = ? AND status = ?',
+                (status, result, error, status_code, now, job_id, worker_id, RUNNING)
+            ).rowcount
+            # Forget finished jobs after the retention period (at most once a minute)
+            if now - self._last_purge > 60:
+                self._last_purge = now
+                conn.execute('DELETE FROM analysis_jobs WHERE finished_at < ?', (now - self.retention_seconds,))
+        return finished > 0
+
+    def get(self, job_id):
+        """Job state as a dict (result included once done), or None"""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                'SELECT id, status, priority, result, error, status_code, attempts, created_at, started_at,'
+                ' finished_at FROM analysis_jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = {
+            'job_id': row[0],
+            'status': row[1],
+            'priority': row[2],
+            'attempts': row[6],
+            'created_at': row[7],
+            'started_at': row[8],
+            'finished_at': row[9]
+        }
+        if row[1] == QUEUED:
+            job['position'] = self.position(row[0], row[2], row[7])
+        if row[3] is not None:
+            job['result'] = json.loads(row[3])
+        if row[4] is not None:
+            job['error'] = row[4]
+        if row[5] is not None:
+            job['status_code'] = row[5]
+        return job
+
+    def position(self, job_id, priority, created_at):
+        """Number of queued jobs that will be claimed before this one"""
+        with self.pool.connection() as conn:
+            return conn.execute(
+                'SELECT COUNT(*) FROM analysis_jobs WHERE status = ?'
+                ' AND (priority > ? OR (priority = ? AND created_at < ?))',
+                (QUEUED, priority, priority, created_at)
+            ).fetchone()[0]
+
+    def wait(self, job_id, timeout):
+        """
+        Long-poll: return the job once it is finished or `timeout` seconds have passed
+        The queue is shared between processes, so this polls with a growing interval
+        """
+        deadline = time.monotonic() + timeout
+        interval = 0.05
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED_STATUSES or remaining <= 0:
+                return job
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 1.5, 1.0)
+
+    def create_batch(self, job_id, created_at, items):
+        """Record a new batch job and its items (dicts with index and status)"""
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT INTO batch_jobs (id, total, created_at) VALUES (?, ?, ?)',
+                             (job_id, len(items), created_at))
+                conn.executemany(
+                    'INSERT INTO batch_items (job_id, idx, status, fields) VALUES (?, ?, ?, ?)',
+                    [(job_id, item['index'], item['status'], json.dumps(item)) for item in items]
+                )
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def update_batch_item(self, job_id, item, analysis=None):
+        """Store an item's current state (and its analysis once there is one)"""
+        with self.pool.connection() as conn:
+            conn.execute(
+                'UPDATE batch_items SET status = ?, fields = ?, analysis = COALESCE(?, analysis)'
+                ' WHERE job_id = ? AND idx = ?',
+                (item['status'], json.dumps(item), json.dumps(analysis) if analysis is not None else None,
+                 job_id, item['index'])
+            )
+
+    def finish_batch(self, job_id, finished_at):
+        with self.pool.connection() as conn:
+            conn.execute('UPDATE batch_jobs SET finished_at = ? WHERE id = ?', (finished_at, job_id))
+            expired = [row[0] for row in conn.execute(
+                'SELECT id FROM batch_jobs WHERE finished_at < ?', (finished_at - self.retention_seconds,)
+            ).fetchall()]
+            for expired_id in expired:
+                conn.execute('DELETE FROM batch_items WHERE job_id = ?', (expired_id,))
+                conn.execute('DELETE FROM batch_jobs WHERE id = ?', (expired_id,))
+
+    def get_batch(self, job_id, include_analysis=False):
+        """Batch job state in the shape of BatchJob.to_dict(), or None"""
+        with self.pool.connection() as conn:
+            job = conn.execute('SELECT total, created_at, finished_at FROM batch_jobs WHERE id = ?',
+                               (job_id,)).fetchone()
+            if job is None:
+                return None
+            rows = conn.execute(
+                f'SELECT fields, {"analysis" if include_analysis else "NULL"} FROM batch_items'
+                ' WHERE job_id = ? ORDER BY idx', (job_id,)
+            ).fetchall()
+        counts = {}
+        items = []
+        for fields, analysis in rows:
+            item = json.loads(fields)
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+            if analysis is not None:
+                item['analysis'] = json.loads(analysis)
+            items.append(item)
+        return {
+            'job_id': job_id,
+            'status': 'completed' if job[2] is not None else 'running',
+            'total': job[0],
+            'counts': counts,
+            'created_at': job[1],
+            'finished_at': job[2],
+            'items': items
+        }
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status').fetchall())
+            oldest = conn.execute(
+                'SELECT MIN(created_at) FROM analysis_jobs WHERE status = ?', (QUEUED,)
+            ).fetchone()[0]
+        return {
+            'queued': counts.get(QUEUED, 0),
+            'running': counts.get(RUNNING, 0),
+            'done': counts.get(DONE, 0),
+            'error': counts.get(ERROR, 0),
+            'oldest_queued_seconds': round(time.time() - oldest, 3) if oldest else 0.0
+        }
+
+
+def create_job_queue():
+    """Build the job queue from environment variables"""
+    path = os.getenv('JOB_QUEUE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db')
+    return JobQueue(
+        path,
+        max_depth=int(os.getenv('JOB_QUEUE_MAX_DEPTH', 10000)),
+        lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', 300)),
+        max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 3)),
+        retention_seconds=float(os.getenv('JOB_RETENTION_SECONDS', 86400))
+    )
@@ -1,6 +1,18 @@
+"""
+List the Gemini models available to GEMINI_API_KEY and show the routing order
+the backend would use (GEMINI_MODELS / GEMINI_MODEL, see model_router.py)
+"""
+
 import os
+
+from dotenv import load_dotenv
+
 import google.generativeai as genai
 
+from model_router import discover_models, parse_model_specs
+
+load_dotenv()
+
 # Make sure your .env is loaded or set GEMINI_API_KEY
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
@@ -10,7 +22,14 @@ if not GEMINI_API_KEY:
 
 genai.configure(api_key=GEMINI_API_KEY)
 
-# List all available models
-models = genai.list_models()
-for m in models:
-    print(m)
+# List all models that support generateContent
+available = discover_models()
+for name in available:
+    print(name)
+
+# Show the configured routing order and which entries are unavailable
+specs = parse_model_specs(os.getenv('GEMINI_MODELS', '') or os.getenv('GEMINI_MODEL', 'gemini-2.5-flash'))
+print("\nRouting order:")
+for name, timeout, input_cost, output_cost in specs:
+    status = 'ok' if name in available else 'NOT AVAILABLE'
+    print(f"  {name:<32} timeout={timeout:.0f}s cost=${input_cost}/${output_cost} per 1M tokens  {status}")
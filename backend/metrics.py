@@ -0,0 +1,198 @@
+"""
+Low-overhead in-process metrics rendered in the Prometheus text format
+Histograms use fixed buckets (one bisect and a few additions per observation);
+stage timings of the current request are also kept per thread for trace headers
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; spans in-process stages (sub-millisecond) up to slow Gemini calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labelnames, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_label_text(self.labelnames, key)} {_format_number(value)}"
+
+
+class Histogram:
+    """Fixed-bucket histogram, optionally split by labels"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                yield f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, key)} {_format_number(total)}"
+            yield f"{self.name}_count{_label_text(self.labelnames, key)} {cumulative}"
+
+
+class Gauge:
+    """Value read from a callback at scrape time (queue depth, cache size, ...)"""
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Metrics gauge {self.name} failed: {e}")
+            return
+        yield f"{self.name} {_format_number(value)}"
+
+
+class MetricsRegistry:
+    """Named metrics and the Prometheus text exposition of all of them"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn):
+        return self._register(Gauge(name, help_text, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Times named stages of request handling into a histogram labelled by stage
+    Between start() and finish() the current thread's stage timings are also collected,
+    so a request can echo them back (e.g. as a Server-Timing header)
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._local = threading.local()
+
+    def start(self):
+        self._local.timings = []
+
+    def finish(self):
+        """Return and clear the (stage, seconds) pairs collected on this thread"""
+        timings = getattr(self._local, 'timings', None)
+        self._local.timings = None
+        return timings or []
+
+    def timings(self):
+        """The (stage, seconds) pairs collected so far on this thread, without clearing them"""
+        return list(getattr(self._local, 'timings', None) or [])
+
+    def active_stages(self):
+        """
+        Live list of the stages this thread is currently inside, innermost last
+        Another thread may read it (e.g. a sampling profiler labelling stacks by stage)
+        """
+        active = getattr(self._local, 'active', None)
+        if active is None:
+            active = self._local.active = []
+        return active
+
+    @contextmanager
+    def stage(self, name):
+        active = self.active_stages()
+        active.append(name)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            active.pop()
+            self.histogram.observe(elapsed, stage=name)
+            timings = getattr(self._local, 'timings', None)
+            if timings is not None:
+                timings.append((name, elapsed))
+
+
+def server_timing_header(timings):
+    """Format (stage, seconds) pairs as a Server-Timing header value"""
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings)
@@ -0,0 +1,355 @@
+"""
+Tiered routing across Gemini models
+Requests go to the first healthy model (fast/cheap first). A request slower than that
+model's recent p95 latency is hedged with the next model (when the rate limiter has
+capacity for the extra call), and 429/5xx/timeout errors
+fail over to the next model (again only with rate-limit capacity) while the failing one
+cools down. With more than one model, failover is the retry: callers should not retry a
+router call on top of it (see retries_failures). Each decision is logged.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from rate_limit import is_retryable, retry_delay_from_error, sdk_status_code
+
+# Errors that move a request to the next model (rate limited, server errors, timeouts)
+FAILOVER_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class ModelTimeout(Exception):
+    """Raised when a model does not answer within its tier timeout"""
+    code = 504
+
+
+def should_fail_over(error):
+    if isinstance(error, ModelTimeout):
+        return True
+    return sdk_status_code(error) in FAILOVER_STATUS_CODES or is_retryable(error)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ModelTier:
+    """
+    One model in the routing order with its timeout, price and health
+    Costs are USD per million input/output tokens
+    """
+
+    def __init__(self, name, model, timeout=30.0, input_cost=0.0, output_cost=0.0, latency_window=200):
+        self.name = name
+        self.model = model
+        self.timeout = timeout
+        self.input_cost = input_cost
+        self.output_cost = output_cost
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.cost = 0.0
+
+    def healthy(self):
+        return time.monotonic() >= self.cooldown_until
+
+    def latency_quantile(self, fraction, min_samples):
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            return percentile(list(self._latencies), fraction)
+
+    def record_success(self, seconds, response):
+        usage = getattr(response, 'usage_metadata', None)
+        with self._lock:
+            self.calls += 1
+            self.consecutive_failures = 0
+            self._latencies.append(seconds)
+            if usage is not None:
+                self.cost += ((getattr(usage, 'prompt_token_count', 0) or 0) * self.input_cost +
+                              (getattr(usage, 'candidates_token_count', 0) or 0) * self.output_cost) / 1e6
+
+    def record_failure(self, error, cooldown_base, cooldown_max):
+        """Count a failure; failover errors also take the model out of rotation for a while"""
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            if not should_fail_over(error):
+                return 0.0
+            self.consecutive_failures += 1
+            cooldown = min(cooldown_max, cooldown_base * (2 ** (self.consecutive_failures - 1)))
+            suggested = retry_delay_from_error(error)
+            if suggested is not None:
+                cooldown = max(cooldown, suggested)
+            self.cooldown_until = time.monotonic() + cooldown
+            return cooldown
+
+    def stats(self, hedge_quantile):
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                'calls': self.calls,
+                'errors': self.errors,
+                'healthy': time.monotonic() >= self.cooldown_until,
+                'timeout_seconds': self.timeout,
+                'estimated_cost_usd': round(self.cost, 6)
+            }
+        for label, fraction in (('p50_seconds', 0.5), (f"p{int(hedge_quantile * 100)}_seconds", hedge_quantile)):
+            value = percentile(latencies, fraction)
+            stats[label] = round(value, 3) if value is not None else None
+        return stats
+
+
+class ModelRouter:
+    """
+    Routes generate_content() calls across model tiers
+    Has the same generate_content() signature as a GenerativeModel, so callers are unchanged
+    """
+
+    def __init__(self, tiers, hedging=True, hedge_quantile=0.95, hedge_min_samples=20, hedge_min_delay=1.0,
+                 cooldown_base=5.0, cooldown_max=120.0, max_threads=32):
+        if not tiers:
+            raise ValueError("ModelRouter needs at least one model")
+        self.tiers = list(tiers)
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='model-router')
+        self._lock = threading.Lock()
+        self.decisions = {}
+        self.on_decision = None
+        # reserve(prompt) -> bool takes rate-limit capacity for a hedge or failover call without waiting
+        self.reserve = None
+
+    @property
+    def retries_failures(self):
+        """Whether failed calls are already retried (on the next model) by the router itself"""
+        return len(self.tiers) > 1
+
+    def _reserve_failover(self, tier, alternate, prompt):
+        """Take rate-limit capacity for the failover call to `alternate`; False (and logged) when there is none"""
+        if self.reserve is None or self.reserve(prompt):
+            return True
+        self._decide('failover_skipped', alternate,
+                      f"no rate-limit capacity to fail over from {tier.name} to {alternate.name}")
+        return False
+
+    def _decide(self, decision, tier, message):
+        with self._lock:
+            self.decisions[decision] = self.decisions.get(decision, 0) + 1
+        print(f"Model router: {message}")
+        if self.on_decision is not None:
+            self.on_decision(decision, tier.name)
+
+    def _candidates(self):
+        healthy = [tier for tier in self.tiers if tier.healthy()]
+        # With every model cooling down, try them anyway rather than failing outright
+        return healthy or sorted(self.tiers, key=lambda tier: tier.cooldown_until)
+
+    def _hedge_delay(self, tier):
+        if not self.hedging:
+            return None
+        threshold = tier.latency_quantile(self.hedge_quantile, self.hedge_min_samples)
+        if threshold is None:
+            return None
+        return max(threshold, self.hedge_min_delay)
+
+    def _call(self, tier, prompt, kwargs):
+        options = dict(kwargs.pop('request_options', None) or {})
+        options.setdefault('timeout', tier.timeout)
+        started_at = time.perf_counter()
+        response = tier.model.generate_content(prompt, request_options=options, **kwargs)
+        return response, time.perf_counter() - started_at
+
+    def _fail(self, tier, error):
+        cooldown = tier.record_failure(error, self.cooldown_base, self.cooldown_max)
+        if cooldown:
+            self._decide('failover', tier, f"{tier.name} failed ({error}); cooling down {cooldown:.0f}s")
+
+    def _call_once(self, tier, prompt, kwargs):
+        try:
+            response, seconds = self._call(tier, prompt, dict(kwargs))
+        except Exception as e:
+            self._fail(tier, e)
+            raise
+        tier.record_success(seconds, response)
+        return response
+
+    def _result(self, future, tier):
+        try:
+            response, seconds = future.result(timeout=0)
+        except Exception as e:
+            self._fail(tier, e)
+            return None, e
+        tier.record_success(seconds, response)
+        return response, None
+
+    def _race(self, primary, alternate, prompt, kwargs, hedge_delay):
+        """Run `primary`, adding `alternate` if it is slower than `hedge_delay`; first success wins"""
+        futures = {self._executor.submit(self._call, primary, prompt, dict(kwargs)): primary}
+        deadline = time.monotonic() + primary.timeout
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done and self.reserve is not None and not self.reserve(prompt):
+            self._decide('hedge_skipped', alternate,
+                          f"{primary.name} slower than p{int(self.hedge_quantile * 100)} ({hedge_delay:.2f}s), "
+                          f"no rate-limit capacity to hedge with {alternate.name}")
+        elif not done:
+            self._decide('hedge', alternate,
+                          f"{primary.name} slower than p{int(self.hedge_quantile * 100)} ({hedge_delay:.2f}s), "
+                          f"hedging with {alternate.name}")
+            futures[self._executor.submit(self._call, alternate, prompt, dict(kwargs))] = alternate
+            deadline = max(deadline, time.monotonic() + alternate.timeout)
+        last_error = None
+        while futures:
+            done, _ = wait(futures, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                tier = futures.pop(future)
+                response, error = self._result(future, tier)
+                if error is None:
+                    # The losing call still finishes; keep its latency in the tier's stats
+                    for pending, pending_tier in futures.items():
+                        pending.add_done_callback(lambda future, tier=pending_tier: self._result(future, tier))
+                    if len(futures) or tier is alternate:
+                        self._decide('hedge_won' if tier is alternate else 'hedge_lost', tier,
+                                      f"{tier.name} answered first")
+                    return response, tier
+                last_error = error
+        for tier in futures.values():
+            last_error = ModelTimeout(f"{tier.name} did not answer within {tier.timeout:.0f}s")
+            self._fail(tier, last_error)
+        raise last_error
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if stream:
+            return self._generate_stream(prompt, kwargs)
+
+        candidates = self._candidates()
+        for index, tier in enumerate(candidates):
+            alternate = candidates[index + 1] if index + 1 < len(candidates) else None
+            hedge_delay = self._hedge_delay(tier) if alternate is not None else None
+            try:
+                if hedge_delay is not None:
+                    response, served_by = self._race(tier, alternate, prompt, kwargs, hedge_delay)
+                else:
+                    # The SDK enforces the tier timeout (request_options) on unhedged calls
+                    response, served_by = self._call_once(tier, prompt, kwargs), tier
+            except Exception as e:
+                if not should_fail_over(e) or alternate is None or not self._reserve_failover(tier, alternate, prompt):
+                    raise
+                self._decide('next_model', alternate, f"retrying on {alternate.name} after {tier.name} failed")
+                continue
+            if served_by is not candidates[0]:
+                self._decide('served_by_fallback', served_by, f"served by {served_by.name}")
+            return response
+
+    def _generate_stream(self, prompt, kwargs):
+        """Streams are not hedged, but fail over if the stream cannot be opened"""
+        candidates = self._candidates()
+        for index, tier in enumerate(candidates):
+            try:
+                response, _ = self._call(tier, prompt, dict(kwargs, stream=True))
+                return response
+            except Exception as e:
+                self._fail(tier, e)
+                if (not should_fail_over(e) or index + 1 == len(candidates)
+                        or not self._reserve_failover(tier, candidates[index + 1], prompt)):
+                    raise
+                self._decide('next_model', candidates[index + 1],
+                              f"opening stream on {candidates[index + 1].name} after {tier.name} failed")
+
+    def refresh(self, available_names):
+        """Drop tiers whose model is not in `available_names` (keeps at least one)"""
+        available = set(available_names)
+        kept = [tier for tier in self.tiers if tier.name in available]
+        dropped = [tier.name for tier in self.tiers if tier.name not in available]
+        if dropped and kept:
+            print(f"Model router: models not available, removed: {', '.join(dropped)}")
+            self.tiers = kept
+        elif dropped:
+            print(f"Model router: none of the configured models were listed; keeping {', '.join(dropped)}")
+
+    def stats(self):
+        with self._lock:
+            decisions = dict(self.decisions)
+        return {
+            'order': [tier.name for tier in self.tiers],
+            'hedging': self.hedging,
+            'decisions': decisions,
+            'models': {tier.name: tier.stats(self.hedge_quantile) for tier in self.tiers}
+        }
+
+
+def discover_models():
+    """Names of the models available to this API key that support generateContent"""
+    import google.generativeai as genai
+
+    names = []
+    for model in genai.list_models():
+        if 'generateContent' in getattr(model, 'supported_generation_methods', ()):
+            names.append(model.name.split('/', 1)[-1])
+    return names
+
+
+def parse_model_specs(spec, default_timeout=30.0):
+    """
+    Parse GEMINI_MODELS: comma-separated "name[:timeout[:input_cost:output_cost]]" entries,
+    cheapest/fastest first; costs are USD per million tokens
+    """
+    specs = []
+    for entry in spec.split(','):
+        parts = [part.strip() for part in entry.strip().split(':')]
+        if not parts[0]:
+            continue
+        timeout = float(parts[1]) if len(parts) > 1 and parts[1] else default_timeout
+        input_cost = float(parts[2]) if len(parts) > 2 and parts[2] else 0.0
+        output_cost = float(parts[3]) if len(parts) > 3 and parts[3] else 0.0
+        specs.append((parts[0], timeout, input_cost, output_cost))
+    return specs
+
+
+def create_model_router(default_model, model_factory, on_decision=None, reserve=None):
+    """
+    Build the router from environment variables, or None when Gemini is not configured
+    model_factory(name) returns a GenerativeModel (or None without an API key);
+    on_decision(decision, model_name) is called for every hedge/failover decision;
+    reserve(prompt) must take rate-limit capacity for a hedge or failover call (see ModelRouter.reserve)
+    """
+    specs = parse_model_specs(os.getenv('GEMINI_MODELS', '') or default_model,
+                              default_timeout=float(os.getenv('GEMINI_TIMEOUT', 30)))
+    tiers = []
+    for name, timeout, input_cost, output_cost in specs:
+        model = model_factory(name)
+        if model is None:
+            return None
+        tiers.append(ModelTier(name, model, timeout, input_cost, output_cost))
+
+    router = ModelRouter(
+        tiers,
+        hedging=os.getenv('GEMINI_HEDGING', '1') == '1',
+        hedge_quantile=float(os.getenv('GEMINI_HEDGE_QUANTILE', 0.95)),
+        hedge_min_samples=int(os.getenv('GEMINI_HEDGE_MIN_SAMPLES', 20)),
+        hedge_min_delay=float(os.getenv('GEMINI_HEDGE_MIN_DELAY', 1.0)),
+        cooldown_base=float(os.getenv('GEMINI_COOLDOWN_BASE', 5.0))
+    )
+    router.on_decision = on_decision
+    router.reserve = reserve
+    if os.getenv('GEMINI_MODEL_DISCOVERY', '0') == '1':
+        try:
+            router.refresh(discover_models())
+        except Exception as e:
+            print(f"Warning: Gemini model discovery failed: {e}")
+    print(f"Model router order: {', '.join(tier.name for tier in router.tiers)}")
+    return router
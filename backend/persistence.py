@@ -0,0 +1,315 @@
+"""
+Write-behind persistence for analysis documents
+Requests enqueue documents and return immediately; a background worker groups
+them into batch commits, retries with backoff, and spills to an append-only
+journal when the backend is unavailable. The journal is replayed on restart.
+"""
+
+import glob
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of (doc_id, document) writes drained by a background thread
+    commit_fn([(doc_id, document), ...]) must write the whole group or raise; before raising
+    it removes the entries it did commit from the list, so only the rest is retried or journaled
+    """
+
+    def __init__(self, commit_fn, journal_path, max_depth=10000, batch_size=200,
+                 flush_interval=0.5, max_retries=5, backoff_base=0.5, backoff_max=30.0):
+        self.commit_fn = commit_fn
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._in_flight = 0
+        # The group being committed; commit_fn removes entries from it as they are written
+        self._in_flight_entries = []
+        # Replay files of this process -> writes from them not yet committed or journaled again
+        self._replays = {}
+        self._replay_seq = itertools.count()
+        self.committed = 0
+        self.failed_batches = 0
+        self.journaled = 0
+        self.replayed = 0
+        self.last_commit_at = None
+
+    def ensure_started(self):
+        """Start the worker in this process (threads do not survive fork) and replay the journal"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+        self.replay_journal()
+
+    def enqueue(self, doc_id, document):
+        """Queue a document write; spills straight to the journal if the queue is full"""
+        self.ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), doc_id, document, None))
+        except queue.Full:
+            print(f"Write queue full, journaling document {doc_id}")
+            self._journal([(doc_id, document)])
+
+    def pending(self, doc_id):
+        """Return a queued (not yet committed) document by ID, or None"""
+        with self._queue.mutex:
+            for _, queued_id, document, _ in self._queue.queue:
+                if queued_id == doc_id:
+                    return document
+        return None
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            group = [first]
+            # Gather whatever else is already waiting, up to one batch
+            while len(group) < self.batch_size:
+                try:
+                    group.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            entries = [(doc_id, document) for _, doc_id, document, _ in group]
+            with self._lock:
+                self._in_flight = len(group)
+                self._in_flight_entries = entries
+            try:
+                self._commit_with_retries(entries)
+                self._settle_replays(source for _, _, _, source in group)
+            finally:
+                with self._lock:
+                    self._in_flight = 0
+                    self._in_flight_entries = []
+                for _ in group:
+                    self._queue.task_done()
+
+    def _commit_with_retries(self, entries):
+        for attempt in range(self.max_retries + 1):
+            remaining = len(entries)
+            try:
+                self.commit_fn(entries)
+            except Exception as e:
+                with self._lock:
+                    # commit_fn dropped whatever it committed before failing
+                    self.committed += remaining - len(entries)
+                    self.failed_batches += 1
+                if not entries:
+                    return
+                if attempt == self.max_retries:
+                    print(f"Firestore write failed after {attempt + 1} attempts, journaling {len(entries)} documents: {e}")
+                    self._journal(entries)
+                    return
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                time.sleep(random.uniform(delay / 2, delay))
+                continue
+            with self._lock:
+                self.committed += remaining
+                self.last_commit_at = time.time()
+            # The backend is reachable again; push out anything journaled earlier
+            if os.path.exists(self.journal_path):
+                self.replay_journal()
+            return
+
+    def _journal(self, entries):
+        with self._journal_lock:
+            with open(self.journal_path, 'a', encoding='utf-8') as journal:
+                for doc_id, document in entries:
+                    journal.write(json.dumps({'doc_id': doc_id, 'document': document}, separators=(',', ':')) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+        with self._lock:
+            self.journaled += len(entries)
+
+    def replay_journal(self):
+        """
+        Re-queue journaled writes, and those of replay files left behind by a process that died
+        The journal is renamed to a replay file first so only one process replays it. A replay
+        file is deleted only once every write in it has been committed or journaled again, so a
+        replay cut short by a crash is picked up by the next process to start
+        """
+        with self._replay_lock:
+            paths = self._claim_orphaned_replays()
+            replay_path = self._next_replay_path()
+            with self._journal_lock:
+                try:
+                    os.replace(self.journal_path, replay_path)
+                    paths.append(replay_path)
+                except FileNotFoundError:
+                    pass
+            count = sum(self._replay_file(path) for path in paths)
+        with self._lock:
+            self.replayed += count
+        if count:
+            print(f"Replayed {count} journaled writes")
+
+    def _next_replay_path(self):
+        return f"{self.journal_path}.replay.{os.getpid()}.{next(self._replay_seq)}"
+
+    def _claim_orphaned_replays(self):
+        """Take over replay files whose process is gone (renamed, so only one process claims each)"""
+        claimed = []
+        for path in sorted(glob.glob(glob.escape(self.journal_path) + '.replay.*')):
+            with self._lock:
+                if path in self._replays:
+                    continue
+            pid = path[len(self.journal_path) + len('.replay.'):].split('.')[0]
+            # Our own PID on a file we do not track is a previous process that had the same PID
+            if pid.isdigit() and int(pid) != os.getpid() and _process_alive(int(pid)):
+                continue
+            target = self._next_replay_path()
+            try:
+                os.replace(path, target)
+            except FileNotFoundError:
+                continue
+            print(f"Recovering writes from {os.path.basename(path)}, left by a process that did not finish replaying it")
+            claimed.append(target)
+        return claimed
+
+    def _replay_file(self, replay_path):
+        records = []
+        with open(replay_path, encoding='utf-8') as journal:
+            for line in journal:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"Skipping corrupt journal line: {line[:80]}")
+        if not records:
+            os.remove(replay_path)
+            return 0
+        with self._lock:
+            self._replays[replay_path] = len(records)
+        count = 0
+        for record in records:
+            try:
+                self._queue.put((time.time(), record['doc_id'], record['document'], replay_path), timeout=5)
+            except queue.Full:
+                self._journal([(record['doc_id'], record['document'])])
+                self._settle_replays([replay_path])
+                continue
+            count += 1
+        return count
+
+    def _settle_replays(self, sources):
+        """Count writes from replay files as committed or re-journaled; delete files with none left"""
+        done = []
+        with self._lock:
+            for source in sources:
+                if source is None or source not in self._replays:
+                    continue
+                self._replays[source] -= 1
+                if self._replays[source] <= 0:
+                    del self._replays[source]
+                    done.append(source)
+        for path in done:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def flush(self, timeout=10.0):
+        """Wait (up to `timeout` seconds) until everything queued has been committed or journaled"""
+        deadline = time.time() + timeout
+        # unfinished_tasks covers writes taken off the queue until the worker marks them done
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=10.0):
+        """
+        Flush before the process exits; whatever is still queued or being committed after
+        `timeout` seconds is journaled, so it is replayed on the next start instead of lost
+        """
+        if self.flush(timeout):
+            return True
+        pending = []
+        sources = []
+        while True:
+            try:
+                _, doc_id, document, source = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.append((doc_id, document))
+            sources.append(source)
+            self._queue.task_done()
+        with self._lock:
+            # Still being retried by the worker; journaling it too is harmless (writes are idempotent)
+            in_flight = list(self._in_flight_entries)
+        if pending or in_flight:
+            print(f"Write queue not drained in {timeout:g}s, journaling {len(pending) + len(in_flight)} documents")
+            self._journal(pending + in_flight)
+            self._settle_replays(sources)
+        return False
+
+    def stats(self):
+        """Queue depth and lag for monitoring"""
+        with self._queue.mutex:
+            depth = len(self._queue.queue)
+            oldest = self._queue.queue[0][0] if depth else None
+        with self._lock:
+            replaying = sum(self._replays.values())
+        with self._lock:
+            return {
+                'depth': depth,
+                'in_flight': self._in_flight,
+                'lag_seconds': round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                'committed': self.committed,
+                'failed_batches': self.failed_batches,
+                'journaled': self.journaled,
+                'replayed': self.replayed,
+                'replay_pending': replaying,
+                'journal_bytes': os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0,
+                'last_commit_at': self.last_commit_at
+            }
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        return True
+    return True
+
+
+def create_write_queue(commit_fn):
+    """Build the write-behind queue from environment variables"""
+    default_journal = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'write_journal.jsonl')
+    return WriteBehindQueue(
+        commit_fn,
+        journal_path=os.getenv('WRITE_JOURNAL_PATH', default_journal),
+        max_depth=int(os.getenv('WRITE_QUEUE_MAX_DEPTH', 10000)),
+        batch_size=int(os.getenv('WRITE_BATCH_SIZE', 200)),
+        flush_interval=float(os.getenv('WRITE_FLUSH_INTERVAL', 0.5)),
+        max_retries=int(os.getenv('WRITE_MAX_RETRIES', 5))
+    )
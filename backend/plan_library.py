@@ -0,0 +1,453 @@
+"""
+Local library of recommendation and 30-day-plan fragments for degraded operation
+Fragments are indexed by weakness category (one per score factor: dsa_practice_frequency,
+mock_interview_score, internships, ...). They are mined from stored analyses: a
+recommendation, risk, weak area or plan week is filed under the student's weak factor
+whose keywords it mentions, and strengths under a strong factor. Fragments that mention the
+student's name, college, location or own numbers are skipped. Built-in fragments cover
+factors with nothing mined.
+
+When Gemini is unavailable or out of quota (DEGRADED_MODE=fallback), or always
+(DEGRADED_MODE=always), /analyze assembles a complete analysis from the library and the
+locally computed score in well under a millisecond, with no Gemini call.
+
+    python plan_library.py build                          # mine the configured store
+    python plan_library.py build --from analyses.ndjson.gz   # mine an export written by export_io.py
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from analysis_schema import PLAN_WEEKS, validate_analysis
+from incremental import FACTOR_KEYWORDS
+from scoring import FACTORS, profile_features
+
+MODES = ('off', 'fallback', 'always')
+
+LIBRARY_VERSION = 1
+
+# Sections of an analysis fragments are mined for; plan weeks are kept as {focus, tasks}
+LIST_SECTIONS = ('recommendations', 'weak_areas', 'risk_factors', 'strengths')
+
+# Normalized factor values below WEAK_THRESHOLD are weaknesses, below RISK_THRESHOLD risks;
+# at or above STRONG_THRESHOLD they are strengths
+WEAK_THRESHOLD = 0.5
+RISK_THRESHOLD = 0.25
+STRONG_THRESHOLD = 0.75
+
+# Fragments kept per factor and section by a build
+FRAGMENTS_KEPT = 5
+
+# Entries per list section of an assembled analysis
+MAX_LIST_ENTRIES = 5
+
+# Seconds between checks for a rebuilt library file
+RELOAD_CHECK_SECONDS = 60.0
+
+FACTOR_LABELS = {
+    'cgpa': 'CGPA',
+    'attendance': 'attendance',
+    'qualification': 'qualification',
+    'dsa_practice_frequency': 'DSA practice',
+    'internships': 'internship experience',
+    'mock_interview_score': 'mock interview performance',
+    'resume_score': 'resume quality',
+    'hackathons': 'hackathon participation',
+    'technologies': 'technology stack',
+    'certifications': 'certifications',
+    'projects': 'projects',
+}
+
+IDENTITY_FIELDS = ('name', 'college', 'location')
+NUMERIC_FIELDS = ('cgpa', 'attendance', 'mock_interview_score', 'resume_score')
+
+# Used for factors the mined library has nothing for
+DEFAULT_FRAGMENTS = {
+    'cgpa': {
+        'recommendations': ['Protect your CGPA this semester: review each subject weekly and clear backlogs first'],
+        'weak_areas': ['Academic performance (CGPA) is below most recruiters\' cut-offs'],
+        'risk_factors': ['A low CGPA can filter you out of shortlists before any interview'],
+        'strengths': ['Strong academic record (CGPA) clears most recruiters\' cut-offs'],
+        'weeks': [{'focus': 'Academic recovery', 'tasks': [
+            'List the subjects pulling your CGPA down and plan their revision',
+            'Solve previous exam papers for two of those subjects',
+            'Meet a faculty member or senior for help on the weakest subject'
+        ]}]
+    },
+    'attendance': {
+        'recommendations': ['Keep attendance above your college\'s placement eligibility threshold'],
+        'weak_areas': ['Attendance is below the usual placement eligibility threshold'],
+        'risk_factors': ['Low attendance can make you ineligible for campus placement drives'],
+        'strengths': ['Consistent attendance keeps you eligible for every placement drive'],
+        'weeks': [{'focus': 'Attendance and routine', 'tasks': [
+            'Attend every lecture and lab this week',
+            'Check your attendance against the placement eligibility rule',
+            'Fix a daily study timetable around your classes'
+        ]}]
+    },
+    'qualification': {
+        'recommendations': ['Add industry certifications that complement your degree for core roles'],
+        'weak_areas': ['Qualification limits eligibility for some recruiters\' roles'],
+        'risk_factors': ['Some campus drives restrict eligibility by degree'],
+        'strengths': ['Your qualification meets the eligibility criteria of most recruiters'],
+        'weeks': [{'focus': 'Eligibility research', 'tasks': [
+            'List target companies that hire your degree profile',
+            'Note the skills those roles ask for beyond the degree',
+            'Pick one certification that closes the most common gap'
+        ]}]
+    },
+    'dsa_practice_frequency': {
+        'recommendations': ['Practice data structures and algorithms daily: two to three problems on arrays, strings and trees'],
+        'weak_areas': ['Irregular DSA practice (coding rounds need daily problem solving)'],
+        'risk_factors': ['Infrequent DSA practice is the most common reason for failing online coding rounds'],
+        'strengths': ['Regular DSA practice prepares you well for coding rounds'],
+        'weeks': [{'focus': 'Daily DSA practice', 'tasks': [
+            'Solve two easy and one medium problem every day on arrays and strings',
+            'Revise time and space complexity for each solution',
+            'Take one timed contest at the end of the week'
+        ]}]
+    },
+    'internships': {
+        'recommendations': ['Apply for a short internship or a virtual industry program to gain work experience'],
+        'weak_areas': ['Little or no internship experience'],
+        'risk_factors': ['No industry experience weakens your profile against candidates with internships'],
+        'strengths': ['Internship experience gives you real industry exposure to talk about'],
+        'weeks': [{'focus': 'Internship search', 'tasks': [
+            'Shortlist ten internship openings that match your skills',
+            'Tailor your resume for each application',
+            'Reach out to two seniors or alumni for referrals'
+        ]}]
+    },
+    'mock_interview_score': {
+        'recommendations': ['Take a mock interview every week and work on the feedback'],
+        'weak_areas': ['Mock interview performance needs improvement'],
+        'risk_factors': ['Weak interview performance can cost offers even after clearing coding rounds'],
+        'strengths': ['Good mock interview performance shows strong communication'],
+        'weeks': [{'focus': 'Interview practice', 'tasks': [
+            'Do two mock interviews with peers or an online platform',
+            'Prepare answers to common HR questions using the STAR method',
+            'Record yourself explaining a project and review it'
+        ]}]
+    },
+    'resume_score': {
+        'recommendations': ['Rewrite your resume around quantified project and internship outcomes'],
+        'weak_areas': ['Resume does not present your skills and results clearly'],
+        'risk_factors': ['A weak resume reduces shortlisting chances'],
+        'strengths': ['A well-structured resume helps you get shortlisted'],
+        'weeks': [{'focus': 'Resume and LinkedIn', 'tasks': [
+            'Rewrite each resume bullet as action, result and number',
+            'Keep the resume to one page with skills and projects first',
+            'Update your LinkedIn profile to match the resume'
+        ]}]
+    },
+    'hackathons': {
+        'recommendations': ['Take part in a hackathon or coding competition this month'],
+        'weak_areas': ['Limited hackathon or competition experience'],
+        'risk_factors': ['Few competitions means fewer chances to show problem solving under pressure'],
+        'strengths': ['Hackathon experience shows teamwork and building under deadlines'],
+        'weeks': [{'focus': 'Hackathon preparation', 'tasks': [
+            'Register for an upcoming hackathon or coding contest',
+            'Form a team and agree on a problem area',
+            'Build and present a small prototype'
+        ]}]
+    },
+    'technologies': {
+        'recommendations': ['Go deeper in one technology stack that matches your target roles'],
+        'weak_areas': ['Narrow technology stack for the target roles'],
+        'risk_factors': ['A narrow skill set limits the roles you can apply for'],
+        'strengths': ['A broad technology stack fits many roles'],
+        'weeks': [{'focus': 'Technology stack', 'tasks': [
+            'Pick one framework used by your target companies',
+            'Finish a hands-on tutorial in it',
+            'Use it in a small project and push it to GitHub'
+        ]}]
+    },
+    'certifications': {
+        'recommendations': ['Complete one recognised certification relevant to your target role'],
+        'weak_areas': ['Few relevant certifications'],
+        'risk_factors': ['Without certifications your skills are harder for recruiters to verify'],
+        'strengths': ['Relevant certifications back up your skills'],
+        'weeks': [{'focus': 'Certification', 'tasks': [
+            'Choose one certification course relevant to your target role',
+            'Complete its first modules this week',
+            'Schedule the assessment'
+        ]}]
+    },
+    'projects': {
+        'recommendations': ['Build one complete project end to end and publish it on GitHub'],
+        'weak_areas': ['Few substantial projects in the portfolio'],
+        'risk_factors': ['A thin project portfolio gives interviewers little to discuss'],
+        'strengths': ['Your projects give interviewers concrete work to discuss'],
+        'weeks': [{'focus': 'Portfolio project', 'tasks': [
+            'Scope a small project that solves a real problem',
+            'Build the core feature and push it to GitHub',
+            'Write a README with screenshots and your role'
+        ]}]
+    },
+}
+
+_NORMALIZE_SPACE = re.compile(r'\s+')
+
+
+def _clean(text):
+    return _NORMALIZE_SPACE.sub(' ', str(text)).strip()
+
+
+def factor_values(student_data):
+    return dict(zip(FACTORS, profile_features(student_data)))
+
+
+def matching_factor(text, factors):
+    """The first of `factors` whose keywords appear in `text`, else None"""
+    lowered = text.lower()
+    for factor in factors:
+        if any(keyword in lowered for keyword in FACTOR_KEYWORDS.get(factor, ())):
+            return factor
+    return None
+
+
+def mentions_profile(text, student_data):
+    """Whether `text` names the student (name, college, location) or quotes one of their own numbers"""
+    lowered = text.lower()
+    for field in IDENTITY_FIELDS:
+        value = _clean(student_data.get(field) or '').lower()
+        if len(value) > 2 and value in lowered:
+            return True
+    for field in NUMERIC_FIELDS:
+        value = _clean(student_data.get(field) or '')
+        if value and re.search(rf'(?<![\d.]){re.escape(value)}(?![\d]|\.\d)', text):
+            return True
+    return False
+
+
+def mine_fragments(documents):
+    """
+    Count reusable fragments of stored analysis documents per factor and section
+    Returns {factor: {section: Counter}}, with plan weeks under 'weeks' as JSON strings
+    """
+    counts = {factor: {section: Counter() for section in LIST_SECTIONS + ('weeks',)} for factor in FACTORS}
+    for document in documents:
+        analysis = document.get('analysis')
+        profile = document.get('student_profile') or {}
+        # Degraded analyses came from this library; reused ones repeat an analysis already counted
+        if not isinstance(analysis, dict) or document.get('degraded') or document.get('reuse'):
+            continue
+        values = factor_values(profile)
+        weak = sorted((factor for factor in FACTORS if values[factor] < WEAK_THRESHOLD), key=values.get)
+        strong = [factor for factor in FACTORS if values[factor] >= STRONG_THRESHOLD]
+
+        for section in LIST_SECTIONS:
+            entries = analysis.get(section)
+            if not isinstance(entries, list):
+                continue
+            for entry in entries:
+                text = _clean(entry)
+                factor = matching_factor(text, strong if section == 'strengths' else weak)
+                if factor and text and not mentions_profile(text, profile):
+                    counts[factor][section][text] += 1
+
+        plan = analysis.get('30_day_plan')
+        if not isinstance(plan, dict):
+            continue
+        for week in PLAN_WEEKS:
+            week_value = plan.get(week)
+            if not isinstance(week_value, dict) or not isinstance(week_value.get('tasks'), list):
+                continue
+            fragment = {'focus': _clean(week_value.get('focus', '')),
+                        'tasks': [_clean(task) for task in week_value['tasks'] if _clean(task)]}
+            text = ' '.join([fragment['focus']] + fragment['tasks'])
+            factor = matching_factor(text, weak)
+            if factor and fragment['tasks'] and not mentions_profile(text, profile):
+                counts[factor]['weeks'][json.dumps(fragment, sort_keys=True)] += 1
+    return counts
+
+
+def build_library(documents):
+    """Library document (the JSON written by `python plan_library.py build`) from stored analyses"""
+    documents = iter(documents)
+    mined = 0
+
+    def counted():
+        nonlocal mined
+        for document in documents:
+            mined += 1
+            yield document
+
+    counts = mine_fragments(counted())
+    fragments = {}
+    for factor, sections in counts.items():
+        kept = {}
+        for section, counter in sections.items():
+            top = [text for text, _ in counter.most_common(FRAGMENTS_KEPT)]
+            if top:
+                kept[section] = [json.loads(text) for text in top] if section == 'weeks' else top
+        if kept:
+            fragments[factor] = kept
+    return {'version': LIBRARY_VERSION, 'built_at': time.time(), 'documents': mined, 'fragments': fragments}
+
+
+class PlanLibrary:
+    """
+    Fragment lookup table: factor -> section -> fragments, most frequent first
+    Loaded from `path` on first use (built-in fragments fill the gaps) and reloaded when the file changes
+    """
+
+    def __init__(self, path, mode='off'):
+        if mode not in MODES:
+            raise Exception(f"Unknown degraded mode '{mode}' (expected one of: {', '.join(MODES)})")
+        self.path = path
+        self.mode = mode
+        self._fragments = None
+        self._info = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.served = 0
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def _table(self):
+        now = time.monotonic()
+        if self._fragments is not None and now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return self._fragments
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if self._fragments is None or mtime != self._mtime:
+                self._load(mtime)
+            return self._fragments
+
+    def _load(self, mtime):
+        library = {}
+        if mtime is not None:
+            try:
+                with open(self.path) as library_file:
+                    library = json.load(library_file)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not read plan library {self.path}: {e}")
+        mined = library.get('fragments') or {}
+        table = {}
+        for factor in FACTORS:
+            defaults = DEFAULT_FRAGMENTS[factor]
+            table[factor] = {section: (mined.get(factor) or {}).get(section) or defaults[section]
+                             for section in LIST_SECTIONS + ('weeks',)}
+        self._fragments = table
+        self._mtime = mtime
+        self._info = {'built_at': library.get('built_at'), 'documents': library.get('documents', 0),
+                      'mined_factors': sorted(mined)}
+
+    def build_analysis(self, student_data, local_score):
+        """
+        Complete analysis (all narrative fields and a four-week plan) from the library and the local score
+        The weeks work on the factors that lose the most points, biggest gap first
+        """
+        table = self._table()
+        breakdown = local_score['score_breakdown']
+        value = {factor: breakdown[factor]['value'] for factor in FACTORS}
+        gaps = sorted(FACTORS, key=lambda factor: -breakdown[factor]['weight'] * (1 - value[factor]))
+        weak = [factor for factor in gaps if value[factor] < WEAK_THRESHOLD]
+        risky = [factor for factor in weak if value[factor] < RISK_THRESHOLD]
+        strong = sorted((factor for factor in FACTORS if value[factor] >= STRONG_THRESHOLD),
+                        key=lambda factor: -breakdown[factor]['points'])
+        improvable = [factor for factor in gaps if value[factor] < 1.0] or gaps
+
+        plan = {}
+        for week, factor in zip(PLAN_WEEKS, (weak + [factor for factor in gaps if factor not in weak])):
+            fragment = table[factor]['weeks'][0]
+            plan[week] = {'focus': fragment['focus'], 'tasks': list(fragment['tasks'])}
+
+        name = _clean(student_data.get('name') or '') or 'The student'
+        summary = (f"{name} has a {local_score['readiness_level'].lower()} placement readiness score of "
+                   f"{local_score['readiness_score']}/100.")
+        if strong:
+            summary += f" Strongest areas: {', '.join(FACTOR_LABELS[factor] for factor in strong[:3])}."
+        if improvable:
+            summary += f" Biggest gaps: {', '.join(FACTOR_LABELS[factor] for factor in improvable[:3])}."
+        summary += " This plan was assembled from common recommendations while the AI analysis is unavailable."
+
+        analysis, missing = validate_analysis({
+            'summary': summary,
+            'strengths': [table[factor]['strengths'][0] for factor in strong[:MAX_LIST_ENTRIES]],
+            'weak_areas': [table[factor]['weak_areas'][0] for factor in weak[:MAX_LIST_ENTRIES]],
+            'risk_factors': [table[factor]['risk_factors'][0] for factor in risky[:MAX_LIST_ENTRIES]],
+            'recommendations': [table[factor]['recommendations'][0] for factor in improvable[:MAX_LIST_ENTRIES]],
+            '30_day_plan': plan
+        })
+        if missing:
+            raise Exception(f"Plan library produced an incomplete analysis: {', '.join(missing)}")
+        analysis.update(local_score)
+        self.served += 1
+        return analysis
+
+    def stats(self):
+        if self.enabled:
+            self._table()
+        return {
+            'mode': self.mode,
+            'served': self.served,
+            **self._info
+        }
+
+
+def create_plan_library():
+    """
+    Build the plan library from environment variables
+    DEGRADED_MODE: off (default), fallback (when Gemini is unavailable or out of quota) or always
+    """
+    mode = os.getenv('DEGRADED_MODE', 'off').lower()
+    if mode not in MODES:
+        print(f"Warning: Unknown DEGRADED_MODE '{mode}', degraded mode disabled")
+        mode = 'off'
+    path = os.getenv('PLAN_LIBRARY_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          'plan_library.json')
+    return PlanLibrary(path, mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('build',))
+    parser.add_argument('--from', dest='source', help='export_io.py export to mine (default: read the configured store)')
+    parser.add_argument('--output', help='library file (default: PLAN_LIBRARY_PATH or backend/plan_library.json)')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    started_at = time.perf_counter()
+    if args.source:
+        from export_io import read_export_documents
+
+        documents = (document for _, document in read_export_documents(args.source))
+    else:
+        from clients import create_firestore_client
+        from storage import create_store
+
+        store = create_store(create_firestore_client)
+        if store is None:
+            raise SystemExit("Storage not configured")
+        fields = ['student_profile', 'analysis', 'degraded', 'reuse']
+        documents = (document for _, document in store.iter_documents(fields=fields))
+    library = build_library(documents)
+
+    output = args.output or create_plan_library().path
+    temporary_path = f"{output}.tmp"
+    with open(temporary_path, 'w') as library_file:
+        json.dump(library, library_file, indent=1)
+    os.replace(temporary_path, output)
+    fragment_count = sum(len(entries) for sections in library['fragments'].values() for entries in sections.values())
+    print(f"Mined {fragment_count} fragments for {len(library['fragments'])} factors from {library['documents']} "
+          f"analyses in {time.perf_counter() - started_at:.2f}s; wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+"""
+On-demand request profiling
+A profiled request runs under cProfile (deterministic, one request at a time per process)
+or a sampling profiler (a native background thread reading the request's stack every
+PROFILE_SAMPLE_INTERVAL_MS, cheap enough for live traffic). Sampled stacks are rooted at the
+request stage they were taken in (`[stage gemini_call]`, `[stage firestore_query]`,
+`[stage prompt]`, ...), so time spent waiting on Gemini and the store is separated from
+our own work in the flame graph. Captures are written to PROFILE_DIR:
+  <id>.speedscope.json / <id>.collapsed   sampled stacks (https://www.speedscope.app, flamegraph.pl)
+  <id>.prof                                cProfile stats (pstats, snakeviz)
+  <id>.meta.json                           request, stage timings and the wait/own-time split
+Requests are picked by an admin `X-Profile` header or at the sampled rate held in
+PROFILE_DIR/settings.json, which every worker re-reads without a restart.
+cProfile hooks the OS thread, not a greenlet: under gevent workers every request running on
+the worker would be mixed into the capture, so cprofile requests are sampled instead there
+(the capture's `mode` says which profiler ran).
+"""
+
+import importlib
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+MODES = ('sampling', 'cprofile')
+FORMATS = ('speedscope', 'collapsed')
+
+SETTINGS_FILE = 'settings.json'
+META_SUFFIX = '.meta.json'
+
+# Stages spent waiting on Gemini or the storage backend (`<backend>_query` / `<backend>_commit`)
+WAIT_STAGES = ('gemini_call', 'gemini_reask')
+WAIT_STAGE_SUFFIXES = ('_query', '_commit')
+
+# Settings files are re-read at most this often
+SETTINGS_CHECK_SECONDS = 1.0
+
+_SLUG_INVALID = re.compile(r'[^a-zA-Z0-9]+')
+
+
+def is_wait_stage(stage):
+    return stage in WAIT_STAGES or stage.endswith(WAIT_STAGE_SUFFIXES)
+
+
+def _native(module, name):
+    """`module.name` as it was before gevent monkey-patching (gevent workers), else the current one"""
+    try:
+        from gevent import monkey
+
+        if monkey.is_module_patched(module):
+            return monkey.get_original(module, name)
+    except ImportError:
+        pass
+    return getattr(importlib.import_module(module), name)
+
+
+def _current_greenlet():
+    """The running greenlet when gevent has patched threading (each request runs in its own), else None"""
+    try:
+        from gevent import monkey
+
+        if not monkey.is_module_patched('threading'):
+            return None
+        import greenlet
+    except ImportError:
+        return None
+    return greenlet.getcurrent()
+
+
+class SamplingSession:
+    """Stacks sampled from one request: (frames root first, seconds) in the order they were taken"""
+
+    mode = 'sampling'
+
+    def __init__(self, thread_id, glet, stages):
+        self.thread_id = thread_id
+        self.glet = glet
+        self.stages = stages
+        self.samples = []
+
+    def frame(self, thread_frames):
+        # A suspended greenlet keeps its stack in gr_frame; a running one is the thread's current frame
+        if self.glet is not None and self.glet.gr_frame is not None:
+            return self.glet.gr_frame
+        return thread_frames.get(self.thread_id)
+
+
+class StackSampler:
+    """
+    One native background thread sampling every active SamplingSession of this process
+    Started on first use; it blocks on a native lock (without touching any request) when nothing is profiled
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._sessions = {}
+        self._labels = {}
+        self._started = False
+        self._start_lock = threading.Lock()
+        # Held while idle; start() releases it to wake the sampler thread
+        self._wake = _native('_thread', 'allocate_lock')()
+        self._wake.acquire()
+
+    def start(self, stages):
+        """Begin sampling the calling request; `stages` is its live stage list"""
+        self._ensure_thread()
+        session = SamplingSession(_native('_thread', 'get_ident')(), _current_greenlet(), stages)
+        self._sessions[id(session)] = session
+        try:
+            self._wake.release()
+        except RuntimeError:
+            # Already awake
+            pass
+        return session
+
+    def stop(self, session):
+        self._sessions.pop(id(session), None)
+        return session.samples
+
+    @property
+    def active(self):
+        return len(self._sessions)
+
+    def _ensure_thread(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                _native('_thread', 'start_new_thread')(self._run, ())
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+            self._labels[code] = label
+        return label
+
+    def _run(self):
+        sleep = _native('time', 'sleep')
+        own_id = _native('_thread', 'get_ident')()
+        last = time.perf_counter()
+        while True:
+            if not self._sessions:
+                self._wake.acquire(timeout=1.0)
+                last = time.perf_counter()
+                continue
+            sleep(self.interval)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            sessions = list(self._sessions.values())
+            thread_frames = sys._current_frames()
+            for session in sessions:
+                if session.thread_id == own_id:
+                    continue
+                frame = session.frame(thread_frames)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stages = session.stages
+                stack.append(f"[stage {stages[-1] if stages else 'none'}]")
+                stack.reverse()
+                session.samples.append((tuple(stack), elapsed))
+
+
+class CProfileSession:
+    mode = 'cprofile'
+
+    def __init__(self, profile):
+        self.profile = profile
+
+
+def collapsed_stacks(samples, interval):
+    """Brendan Gregg's collapsed format: `root;child;leaf count` lines, count in sampling intervals"""
+    weights = {}
+    for stack, seconds in samples:
+        weights[stack] = weights.get(stack, 0.0) + seconds
+    return ''.join(f"{';'.join(stack)} {max(1, round(seconds / interval))}\n"
+                   for stack, seconds in sorted(weights.items()))
+
+
+def speedscope_document(samples, name):
+    """Samples as a speedscope sampled profile (weights in milliseconds)"""
+    frames = []
+    frame_index = {}
+    stacks = []
+    weights = []
+    for stack, seconds in samples:
+        indexes = []
+        for label in stack:
+            if label not in frame_index:
+                frame_index[label] = len(frames)
+                frames.append({'name': label})
+            indexes.append(frame_index[label])
+        stacks.append(indexes)
+        weights.append(round(seconds * 1000, 3))
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'backend profiling.py',
+        'activeProfileIndex': 0,
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': round(sum(weights), 3),
+            'samples': stacks,
+            'weights': weights
+        }]
+    }
+
+
+class ProfileSettings:
+    """
+    Sampled-profiling settings shared by every worker through a JSON file
+    Falls back to the environment defaults when the file is missing or its `until` has passed
+    """
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = defaults
+        self._settings = dict(defaults)
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at >= SETTINGS_CHECK_SECONDS:
+            self._checked_at = now
+            self._reload()
+        settings = self._settings
+        if settings.get('until') and time.time() > settings['until']:
+            return dict(self.defaults)
+        return settings
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self._settings, self._mtime = dict(self.defaults), None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path) as settings_file:
+                settings = json.load(settings_file)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read profiling settings {self.path}: {e}")
+            return
+        self._settings = {**self.defaults, **settings}
+        self._mtime = mtime
+
+    def update(self, settings):
+        """Write new settings for all workers (atomically)"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as settings_file:
+            json.dump(settings, settings_file)
+        os.replace(temporary_path, self.path)
+        self._checked_at = 0.0
+
+
+class Profiler:
+    """Picks requests to profile, runs the chosen profiler and writes its captures to `directory`"""
+
+    def __init__(self, directory, mode='sampling', sample_rate=0.0, output_format='speedscope',
+                 sample_interval=0.005, max_captures=200):
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.max_captures = max_captures
+        self.settings = ProfileSettings(os.path.join(directory, SETTINGS_FILE), {
+            'mode': mode, 'sample_rate': sample_rate, 'format': output_format, 'until': None
+        })
+        self.sampler = StackSampler(sample_interval)
+        self._cprofile_active = False
+        self._cprofile_lock = threading.Lock()
+        self._cprofile_fallback_logged = False
+        self._counter = itertools.count(1)
+        self.captures_written = 0
+
+    def choose_mode(self, requested=None):
+        """
+        Profiler mode for the current request, or None
+        `requested` is an (already authorized) header value: a mode, or '1' for the configured one
+        """
+        settings = self.settings.get()
+        if requested:
+            return requested if requested in MODES else settings['mode']
+        if settings['sample_rate'] and random.random() < settings['sample_rate']:
+            return settings['mode']
+        return None
+
+    def begin(self, mode, stages):
+        """
+        Start profiling the calling request; returns a session or None (cProfile is one request at a time)
+        Under gevent cProfile would also record the other greenlets, so the sampler is used instead
+        """
+        if mode == 'cprofile' and _current_greenlet() is not None:
+            if not self._cprofile_fallback_logged:
+                self._cprofile_fallback_logged = True
+                print("Warning: cProfile cannot isolate a request under gevent; using the sampling profiler")
+            mode = 'sampling'
+        if mode == 'sampling':
+            return self.sampler.start(stages)
+        with self._cprofile_lock:
+            if self._cprofile_active:
+                return None
+            self._cprofile_active = True
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler (or debugger) already owns the interpreter's profiling hook
+            self._cprofile_active = False
+            print(f"Warning: Could not start cProfile: {e}")
+            return None
+        return CProfileSession(profile)
+
+    def new_capture_id(self, endpoint):
+        slug = _SLUG_INVALID.sub('_', endpoint).strip('_')[:40] or 'request'
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._counter)}-{slug}"
+
+    def end(self, session):
+        """Stop a session; returns what write_capture() needs"""
+        if session.mode == 'sampling':
+            return self.sampler.stop(session)
+        session.profile.disable()
+        self._cprofile_active = False
+        return session.profile
+
+    def write_capture(self, capture_id, session, result, request_meta, stage_timings):
+        """Write the capture files and their metadata; returns the metadata"""
+        os.makedirs(self.directory, exist_ok=True)
+        stages = {}
+        for name, seconds in stage_timings:
+            stages[name] = round(stages.get(name, 0.0) + seconds, 6)
+        wait_seconds = sum(seconds for name, seconds in stages.items() if is_wait_stage(name))
+        duration = request_meta.get('duration_seconds', 0.0)
+        meta = {
+            'id': capture_id,
+            'mode': session.mode,
+            'pid': os.getpid(),
+            'captured_at': time.time(),
+            **request_meta,
+            'stages': stages,
+            'wait_seconds': round(wait_seconds, 6),
+            'own_seconds': round(max(duration - wait_seconds, 0.0), 6)
+        }
+
+        if session.mode == 'sampling':
+            by_stage = {}
+            for stack, seconds in result:
+                by_stage[stack[0]] = round(by_stage.get(stack[0], 0.0) + seconds, 6)
+            meta['samples'] = len(result)
+            meta['sampled_seconds_by_stage'] = by_stage
+            output_format = self.settings.get()['format']
+            if output_format == 'collapsed':
+                filename = f"{capture_id}.collapsed"
+                with open(os.path.join(self.directory, filename), 'w') as capture_file:
+                    capture_file.write(collapsed_stacks(result, self.sample_interval))
+            else:
+                filename = f"{capture_id}.speedscope.json"
+                with open(os.path.join(self.directory, filename), 'w') as capture_file:
+                    json.dump(speedscope_document(result, capture_id), capture_file)
+        else:
+            import pstats
+
+            filename = f"{capture_id}.prof"
+            result.dump_stats(os.path.join(self.directory, filename))
+            stats = pstats.Stats(result)
+            top = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:15]
+            meta['top_functions'] = [
+                {'function': f"{func} ({os.path.basename(path)}:{line})", 'calls': calls,
+                 'own_seconds': round(own, 6), 'cumulative_seconds': round(cumulative, 6)}
+                for (path, line, func), (_, calls, own, cumulative, _) in top
+            ]
+        meta['file'] = filename
+
+        with open(os.path.join(self.directory, capture_id + META_SUFFIX), 'w') as meta_file:
+            json.dump(meta, meta_file)
+        self.captures_written += 1
+        self.prune()
+        return meta
+
+    def prune(self):
+        """Delete the oldest captures beyond max_captures"""
+        metas = self._meta_files()
+        for meta_name in metas[self.max_captures:]:
+            capture_id = meta_name[:-len(META_SUFFIX)]
+            for name in os.listdir(self.directory):
+                if name.startswith(capture_id + '.'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+    def _meta_files(self):
+        """Metadata file names, newest first"""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(META_SUFFIX)]
+        except OSError:
+            return []
+        return sorted(names, key=lambda name: os.path.getmtime(os.path.join(self.directory, name)), reverse=True)
+
+    def list_captures(self, limit=100):
+        captures = []
+        for name in self._meta_files()[:limit]:
+            try:
+                with open(os.path.join(self.directory, name)) as meta_file:
+                    captures.append(json.load(meta_file))
+            except (OSError, ValueError):
+                continue
+        return captures
+
+    def stats(self):
+        settings = self.settings.get()
+        return {
+            'mode': settings['mode'],
+            'sample_rate': settings['sample_rate'],
+            'format': settings['format'],
+            'until': settings.get('until'),
+            'active_sampling_sessions': self.sampler.active,
+            'captures_written': self.captures_written
+        }
+
+
+def create_profiler():
+    """
+    Build the profiler from environment variables
+    PROFILE_SAMPLE_RATE is the default fraction of requests profiled (0: only on request)
+    """
+    mode = os.getenv('PROFILE_MODE', 'sampling').lower()
+    if mode not in MODES:
+        print(f"Warning: Unknown PROFILE_MODE '{mode}', using sampling")
+        mode = 'sampling'
+    output_format = os.getenv('PROFILE_FORMAT', 'speedscope').lower()
+    if output_format not in FORMATS:
+        print(f"Warning: Unknown PROFILE_FORMAT '{output_format}', using speedscope")
+        output_format = 'speedscope'
+    directory = os.getenv('PROFILE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+    return Profiler(
+        directory,
+        mode=mode,
+        sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+        output_format=output_format,
+        sample_interval=float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5)) / 1000,
+        max_captures=int(os.getenv('PROFILE_MAX_CAPTURES', 200))
+    )
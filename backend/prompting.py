@@ -0,0 +1,132 @@
+"""
+Compact per-profile prompt rendering and Gemini token usage reporting
+The static instructions live in the model's system_instruction; only the
+profile-specific block below is sent with each request
+"""
+
+import threading
+
+# Values that carry no information and are left out of the prompt
+_EMPTY_VALUES = ('', 'n/a', 'na', 'none', 'nil', '-')
+
+# (label, field, suffix) for each profile line, in prompt order. Compiled once at import.
+PROFILE_PROMPT_FIELDS = (
+    ('Name', 'name', ''),
+    ('Location', 'location', ''),
+    ('College', 'college', ''),
+    ('College Tier', 'college_tier', ''),
+    ('Qualification', 'qualification', ''),
+    ('Department', 'department', ''),
+    ('CGPA', 'cgpa', '/10'),
+    ('Attendance', 'attendance', '%'),
+    ('Hackathons', 'hackathons', ''),
+    ('Languages/Technologies', 'technologies', ''),
+    ('Certifications', 'certifications', ''),
+    ('Projects', 'projects', ''),
+    ('DSA Practice', 'dsa_practice_frequency', ''),
+    ('Internships', 'internships', ''),
+    ('Mock Interview', 'mock_interview_score', '/10'),
+    ('Resume Completeness', 'resume_score', '/100'),
+)
+_LINE_TEMPLATES = tuple((f"{label}: {{}}{suffix}", field) for label, field, suffix in PROFILE_PROMPT_FIELDS)
+
+PROMPT_FOOTER = "Readiness score (computed, use as-is): {score}/100 ({level})\nRespond with the JSON object only."
+
+
+def _is_empty(value):
+    if value is None:
+        return True
+    if isinstance(value, (list, tuple, dict)):
+        return not value
+    if isinstance(value, str):
+        return value.strip().lower() in _EMPTY_VALUES
+    return False
+
+
+def _format_value(field, value):
+    if field == 'internships':
+        return '; '.join(
+            f"{internship.get('company', 'N/A')} ({internship.get('duration', 'N/A')})"
+            for internship in value if isinstance(internship, dict)
+        )
+    if isinstance(value, str):
+        # Collapse the newlines/whitespace of multi-line form inputs
+        return ' '.join(value.split())
+    return value
+
+
+def render_profile_prompt(student_data, local_score):
+    """
+    Render the per-request prompt: one line per non-empty profile field plus the local score
+    """
+    lines = ["Student profile:"]
+    for template, field in _LINE_TEMPLATES:
+        value = student_data.get(field)
+        if not _is_empty(value):
+            lines.append(template.format(_format_value(field, value)))
+    if not student_data.get('internships'):
+        lines.append("Internships: none")
+    lines.append(PROMPT_FOOTER.format(score=local_score['readiness_score'], level=local_score['readiness_level']))
+    return '\n'.join(lines)
+
+
+def usage_from_response(response):
+    """Extract token counts from a Gemini response's usage_metadata (None if unavailable)"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_token_count', 0) or 0,
+        'cached_tokens': getattr(usage, 'cached_content_token_count', 0) or 0,
+        'output_tokens': getattr(usage, 'candidates_token_count', 0) or 0,
+        'total_tokens': getattr(usage, 'total_token_count', 0) or 0
+    }
+
+
+class TokenUsageStats:
+    """
+    Aggregate token usage and latency of Gemini calls
+    The latest report is also kept per thread so the request handler can return it
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.first_token_seconds = 0.0
+
+    def record(self, usage, first_token_seconds, total_seconds):
+        report = dict(usage or {})
+        report['time_to_first_token_ms'] = round(first_token_seconds * 1000, 1)
+        report['latency_ms'] = round(total_seconds * 1000, 1)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += report.get('prompt_tokens', 0)
+            self.cached_tokens += report.get('cached_tokens', 0)
+            self.output_tokens += report.get('output_tokens', 0)
+            self.first_token_seconds += first_token_seconds
+        self._local.report = report
+        print(f"Gemini usage: prompt={report.get('prompt_tokens', '?')} cached={report.get('cached_tokens', '?')} "
+              f"output={report.get('output_tokens', '?')} ttft={report['time_to_first_token_ms']}ms "
+              f"latency={report['latency_ms']}ms")
+        return report
+
+    def pop_thread_report(self):
+        """Return and clear the report recorded by the current thread, if any"""
+        report = getattr(self._local, 'report', None)
+        self._local.report = None
+        return report
+
+    def stats(self):
+        with self._lock:
+            requests = self.requests or 1
+            return {
+                'requests': self.requests,
+                'avg_prompt_tokens': round(self.prompt_tokens / requests, 1),
+                'avg_cached_tokens': round(self.cached_tokens / requests, 1),
+                'avg_output_tokens': round(self.output_tokens / requests, 1),
+                'avg_time_to_first_token_ms': round(self.first_token_seconds * 1000 / requests, 1)
+            }
@@ -0,0 +1,259 @@
+"""
+Client-side flow control for Gemini calls
+Token buckets sized to the configured RPM/TPM, coalescing of identical in-flight
+requests, and jittered exponential backoff that honors Gemini's retry delay
+"""
+
+import copy
+import os
+import random
+import re
+import threading
+import time
+
+# Status codes worth retrying (rate limited or transient server errors)
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_RETRY_DELAY_PATTERNS = (
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE),
+    re.compile(r'retry in\s*([\d.]+)\s*s', re.IGNORECASE),
+    re.compile(r'"retryDelay":\s*"([\d.]+)s"', re.IGNORECASE),
+)
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request cannot get a rate-limit slot before its deadline"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`
+    acquire() blocks until enough tokens are available or the deadline passes
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def acquire(self, amount=1, deadline=None):
+        """Take `amount` tokens; returns False if the deadline (monotonic time) passes first"""
+        # A request larger than the whole bucket can never be satisfied; let it through at full drain
+        amount = min(amount, self.capacity)
+        with self._condition:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return True
+                wait = (amount - self._tokens) / self.rate_per_second if self.rate_per_second else 1.0
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or remaining < wait:
+                        return False
+                    wait = min(wait, remaining)
+                self._condition.wait(wait)
+
+    def refund(self, amount):
+        """Return tokens reserved for work that turned out cheaper than estimated"""
+        if amount <= 0:
+            return
+        with self._condition:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+            self._condition.notify_all()
+
+    @property
+    def available(self):
+        with self._condition:
+            self._refill()
+            return self._tokens
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function,
+    the others wait for and share its result (or exception)
+    Every caller, the leader included, gets its own deep copy, so none can mutate another's result
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return copy.deepcopy(call['result'])
+
+        try:
+            call['result'] = fn()
+            return copy.deepcopy(call['result'])
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+
+
+def sdk_status_code(error):
+    """Best-effort HTTP status of an SDK exception (google.api_core exceptions expose .code)"""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    code_value = getattr(code, 'value', None)
+    if isinstance(code_value, int):
+        return code_value
+    match = re.search(r'\b(429|500|502|503|504)\b', str(error))
+    return int(match.group(1)) if match else None
+
+
+def is_retryable(error):
+    message = str(error).lower()
+    # Daily quota exhaustion will not clear within a request's lifetime
+    if 'perday' in message or 'per day' in message:
+        return False
+    return sdk_status_code(error) in RETRYABLE_STATUS_CODES or 'rate limit' in message
+
+
+def retry_delay_from_error(error):
+    """Extract the retry delay (seconds) Gemini suggests in a 429 response, if any"""
+    retry_delay = getattr(error, 'retry_delay', None)
+    if retry_delay is not None:
+        seconds = getattr(retry_delay, 'total_seconds', None)
+        return seconds() if callable(seconds) else float(getattr(retry_delay, 'seconds', 0) or 0)
+    message = str(error)
+    for pattern in _RETRY_DELAY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used to reserve TPM capacity"""
+    return max(1, len(text) // 4)
+
+
+class GeminiRateLimiter:
+    """
+    Guards Gemini calls with RPM and TPM buckets, queueing callers up to a deadline,
+    and retries transient failures with jittered exponential backoff
+    """
+
+    def __init__(self, requests_per_minute=60, tokens_per_minute=250000, queue_timeout=30.0,
+                 max_retries=3, backoff_base=1.0, backoff_max=30.0, expected_output_tokens=1500,
+                 static_prompt_tokens=0):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.expected_output_tokens = expected_output_tokens
+        self.static_prompt_tokens = static_prompt_tokens
+        self.flights = SingleFlight()
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.timeouts = 0
+        self.retries = 0
+
+    def acquire(self, prompt, deadline):
+        """Reserve one request and the prompt's estimated tokens, waiting until `deadline`"""
+        tokens = estimate_tokens(prompt) + self.static_prompt_tokens + self.expected_output_tokens
+        if self.request_bucket.available < 1 or self.token_bucket.available < tokens:
+            with self._lock:
+                self.waits += 1
+        if not self.request_bucket.acquire(1, deadline):
+            self._timed_out()
+        if not self.token_bucket.acquire(tokens, deadline):
+            self.request_bucket.refund(1)
+            self._timed_out()
+
+    def try_acquire(self, prompt):
+        """Reserve capacity for one extra call of `prompt` only if it is available now; returns whether it was"""
+        tokens = estimate_tokens(prompt) + self.static_prompt_tokens + self.expected_output_tokens
+        now = time.monotonic()
+        if not self.request_bucket.acquire(1, now):
+            return False
+        if not self.token_bucket.acquire(tokens, now):
+            self.request_bucket.refund(1)
+            return False
+        return True
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+        raise RateLimitTimeout("Gemini request queue deadline exceeded")
+
+    def call(self, fn, prompt, max_retries=None):
+        """
+        Run fn() under the rate limits, retrying retryable errors (up to max_retries, default self.max_retries)
+        Each attempt re-acquires capacity; gives up when the next wait would pass the deadline
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self.acquire(prompt, deadline)
+            try:
+                return fn()
+            except Exception as e:
+                attempt += 1
+                if attempt > max_retries or not is_retryable(e):
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                delay = random.uniform(delay / 2, delay)
+                suggested = retry_delay_from_error(e)
+                if suggested is not None:
+                    delay = max(delay, suggested)
+                if time.monotonic() + delay > deadline:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                print(f"Gemini call failed ({e}); retry {attempt}/{max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests_available': round(self.request_bucket.available, 2),
+                'tokens_available': int(self.token_bucket.available),
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'retries': self.retries,
+                'coalesced': self.flights.coalesced
+            }
+
+
+def create_rate_limiter():
+    """Build the Gemini rate limiter from environment variables"""
+    return GeminiRateLimiter(
+        requests_per_minute=float(os.getenv('GEMINI_RPM', 60)),
+        tokens_per_minute=float(os.getenv('GEMINI_TPM', 250000)),
+        queue_timeout=float(os.getenv('GEMINI_QUEUE_TIMEOUT', 30)),
+        max_retries=int(os.getenv('GEMINI_MAX_RETRIES', 3)),
+        backoff_base=float(os.getenv('GEMINI_BACKOFF_BASE', 1.0)),
+        backoff_max=float(os.getenv('GEMINI_BACKOFF_MAX', 30.0))
+    )
@@ -0,0 +1,256 @@
+"""
+Response cache for the /analyze endpoint
+Keys analyses on a canonical hash of the validated student profile so that
+resubmissions of the same (or trivially different) form skip the Gemini call
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Free-text fields entered as comma/newline separated lists in the frontend
+LIST_TEXT_FIELDS = ('hackathons', 'technologies', 'certifications', 'projects')
+
+# Numeric fields that may arrive as int, float or numeric string
+NUMERIC_FIELDS = ('cgpa', 'attendance', 'mock_interview_score', 'resume_score')
+
+_LIST_SEPARATORS = re.compile(r'[,;\n]+')
+
+
+def _normalize_text(value):
+    """Collapse runs of whitespace and trim"""
+    return ' '.join(str(value).split())
+
+
+def _normalize_list_text(value):
+    """Normalize a comma/newline separated list into a sorted, lowercase, de-duplicated list"""
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = _LIST_SEPARATORS.split(str(value or ''))
+    normalized = {_normalize_text(item).lower() for item in items}
+    normalized.discard('')
+    return sorted(normalized)
+
+
+def _normalize_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _normalize_text(value)
+
+
+def _normalize_internships(internships):
+    """Put internships in a canonical order so list ordering does not change the key"""
+    normalized = []
+    for internship in internships or []:
+        if not isinstance(internship, dict):
+            continue
+        normalized.append([
+            _normalize_text(internship.get('company', '')).lower(),
+            _normalize_text(internship.get('duration', '')).lower(),
+        ])
+    normalized.sort()
+    return normalized
+
+
+def canonical_profile(student_data, fields):
+    """
+    Build the canonical form of a student profile restricted to `fields`
+    Keys are emitted in sorted order by profile_cache_key()
+    """
+    canonical = {}
+    for field in fields:
+        value = student_data.get(field)
+        if field in LIST_TEXT_FIELDS:
+            canonical[field] = _normalize_list_text(value)
+        elif field in NUMERIC_FIELDS:
+            canonical[field] = _normalize_number(value)
+        elif field == 'internships':
+            canonical[field] = _normalize_internships(value)
+        else:
+            canonical[field] = _normalize_text(value if value is not None else '')
+    return canonical
+
+
+def profile_cache_key(student_data, fields):
+    """Return a stable SHA-256 hex digest for the canonical profile"""
+    canonical = canonical_profile(student_data, fields)
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process backend; an OrderedDict kept in least-recently-used order"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, stored_at, value):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+
+    def touch(self, key):
+        self._entries.move_to_end(key)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def pop_oldest(self):
+        if self._entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk backend so cached analyses survive worker restarts and are shared between workers"""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS analysis_cache ('
+            ' key TEXT PRIMARY KEY,'
+            ' stored_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL,'
+            ' value TEXT NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache (accessed_at)'
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        row = self._conn.execute(
+            'SELECT stored_at, value FROM analysis_cache WHERE key = ?', (key,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key, stored_at, value):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO analysis_cache (key, stored_at, accessed_at, value) VALUES (?, ?, ?, ?)',
+            (key, stored_at, time.time(), value)
+        )
+        self._conn.commit()
+
+    def touch(self, key):
+        self._conn.execute('UPDATE analysis_cache SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        self._conn.commit()
+
+    def delete(self, key):
+        self._conn.execute('DELETE FROM analysis_cache WHERE key = ?', (key,))
+        self._conn.commit()
+
+    def pop_oldest(self):
+        self._conn.execute(
+            'DELETE FROM analysis_cache WHERE key = '
+            '(SELECT key FROM analysis_cache ORDER BY accessed_at ASC LIMIT 1)'
+        )
+        self._conn.commit()
+
+    def clear(self):
+        self._conn.execute('DELETE FROM analysis_cache')
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()[0]
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of analysis results
+    Values are stored JSON-encoded so callers never share mutable state with the cache
+    """
+
+    def __init__(self, backend=None, max_entries=1024, ttl_seconds=86400):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached analysis for `key`, or None on a miss"""
+        with self._lock:
+            entry = self.backend.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                self.backend.delete(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.backend.touch(key)
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, analysis_result):
+        """Store an analysis, evicting least-recently-used entries beyond max_entries"""
+        value = json.dumps(analysis_result, separators=(',', ':'))
+        with self._lock:
+            self.backend.set(key, time.time(), value)
+            while len(self.backend) > self.max_entries:
+                self.backend.pop_oldest()
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.backend.clear()
+
+    def stats(self):
+        """Counters reported through /health"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.backend.name,
+                'size': len(self.backend),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def create_response_cache():
+    """
+    Build the analysis cache from environment variables
+    ANALYSIS_CACHE_PATH selects the SQLite backend; otherwise entries live in process memory
+    """
+    max_entries = int(os.getenv('ANALYSIS_CACHE_SIZE', 1024))
+    ttl_seconds = int(os.getenv('ANALYSIS_CACHE_TTL', 24 * 60 * 60))
+    cache_path = os.getenv('ANALYSIS_CACHE_PATH', '')
+
+    backend = None
+    if cache_path:
+        try:
+            backend = SQLiteCacheBackend(cache_path)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not open analysis cache at {cache_path}, using memory: {e}")
+
+    return ResponseCache(backend=backend, max_entries=max_entries, ttl_seconds=ttl_seconds)
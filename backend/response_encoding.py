@@ -0,0 +1,184 @@
+"""
+Response encoding: JSON serializer, negotiated compression and compact history payloads
+- OrjsonProvider plugs orjson into Flask's JSON provider (same output rules as the
+  default provider: sorted keys, HTTP dates, compact outside debug mode)
+- ResponseCompressor compresses buffered responses with br (needs the 'brotli' package)
+  or gzip, whichever the client's Accept-Encoding prefers
+- compact_history() stores each distinct student_profile and 30-day plan of a history
+  page once, for ?compact=1
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+JSON_ENCODERS = ('auto', 'orjson', 'stdlib')
+
+# Only buffered bodies of these types are compressed (streams are left alone)
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/csv', 'application/x-ndjson')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson
+    Values orjson cannot encode natively (datetimes, UUIDs, Markup, ...) go through Flask's default hook,
+    and anything it rejects outright (e.g. integers beyond 64 bits) falls back to the json module
+    """
+
+    def __init__(self, app):
+        import orjson
+
+        super().__init__(app)
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            self._options |= orjson.OPT_SORT_KEYS
+
+    def _encode(self, obj, indent=False):
+        options = self._options | (self._orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return self._orjson.dumps(obj, default=self.default, option=options)
+        except TypeError:
+            # orjson.JSONEncodeError is a TypeError
+            return None
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        encoded = self._encode(obj)
+        return encoded.decode('utf-8') if encoded is not None else super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return self._orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        encoded = self._encode(obj, indent)
+        if encoded is None:
+            return super().response(obj)
+        return self._app.response_class(encoded + b'\n', mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    """
+    Use orjson for app.json when available (JSON_ENCODER: auto, orjson or stdlib); returns the encoder name
+    """
+    encoder = os.getenv('JSON_ENCODER', 'auto').lower()
+    if encoder not in JSON_ENCODERS:
+        print(f"Warning: Unknown JSON_ENCODER '{encoder}', using the standard json module")
+        encoder = 'stdlib'
+    if encoder == 'stdlib':
+        return 'stdlib'
+    try:
+        app.json = OrjsonProvider(app)
+    except ImportError:
+        if encoder == 'orjson':
+            print("Warning: JSON_ENCODER=orjson but the 'orjson' package is not installed; using the json module")
+        return 'stdlib'
+    return 'orjson'
+
+
+class ResponseCompressor:
+    """Compresses buffered responses in the best encoding the client accepts"""
+
+    def __init__(self, enabled=True, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        self._brotli = brotli
+        # Preferred first when the client weighs them equally
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def compress(self, response, accept_encodings):
+        """
+        Compress `response` in place; returns the chosen encoding or None
+        `accept_encodings` is the request's parsed Accept-Encoding header (request.accept_encodings)
+        """
+        if (not self.enabled or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return None
+        encoding = accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return None
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return None
+
+        if encoding == 'br':
+            compressed = self._brotli.compress(body, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        # The compressed bytes differ from the ones the ETag was computed on
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return encoding
+
+
+def create_response_compressor():
+    """
+    Build the response compressor from environment variables
+    RESPONSE_COMPRESSION=0 turns compression off (e.g. behind a proxy that compresses)
+    """
+    return ResponseCompressor(
+        enabled=os.getenv('RESPONSE_COMPRESSION', '1') != '0',
+        min_size=int(os.getenv('COMPRESSION_MIN_SIZE', 1024)),
+        gzip_level=int(os.getenv('GZIP_LEVEL', 6)),
+        brotli_quality=int(os.getenv('BROTLI_QUALITY', 5))
+    )
+
+
+def content_ref(value):
+    """Short hash of a JSON value, used as its key in a compact payload (stable within a process)"""
+    try:
+        import orjson
+
+        encoded = orjson.dumps(value, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    except (ImportError, TypeError):
+        encoded = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def compact_history(entries):
+    """
+    History entries with repeated parts stored once
+    Returns (entries, profiles, plans): each distinct student_profile and 30_day_plan is kept in
+    `profiles` / `plans` under a content hash, and entries carry `profile_ref` and an analysis
+    `plan_ref` instead. The input entries (possibly shared with the history cache) are not modified
+    """
+    profiles = {}
+    plans = {}
+    compacted = []
+    for entry in entries:
+        entry = dict(entry)
+        profile = entry.pop('student_profile', None)
+        if profile:
+            ref = content_ref(profile)
+            profiles.setdefault(ref, profile)
+            entry['profile_ref'] = ref
+        analysis = entry.get('analysis')
+        if isinstance(analysis, dict) and analysis.get('30_day_plan'):
+            analysis = dict(analysis)
+            plan = analysis.pop('30_day_plan')
+            ref = content_ref(plan)
+            plans.setdefault(ref, plan)
+            analysis['plan_ref'] = ref
+            entry['analysis'] = analysis
+        compacted.append(entry)
+    return compacted, profiles, plans
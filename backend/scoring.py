@@ -0,0 +1,161 @@
+"""
+Deterministic Placement Readiness scoring
+Implements the weighted methodology described in SYSTEM_PROMPT so the score can be
+computed locally (and in bulk with NumPy) instead of being delegated to Gemini
+"""
+
+import re
+
+# (factor, weight %) in the order used for feature vectors.
+# The published weights add up to 108%, so contributions are normalized by TOTAL_WEIGHT.
+FACTOR_WEIGHTS = (
+    ('cgpa', 12),
+    ('attendance', 8),
+    ('qualification', 5),
+    ('dsa_practice_frequency', 15),
+    ('internships', 12),
+    ('mock_interview_score', 12),
+    ('resume_score', 10),
+    ('hackathons', 8),
+    ('technologies', 8),
+    ('certifications', 10),
+    ('projects', 8),
+)
+FACTORS = tuple(factor for factor, _ in FACTOR_WEIGHTS)
+TOTAL_WEIGHT = sum(weight for _, weight in FACTOR_WEIGHTS)
+
+DSA_FREQUENCY_VALUES = {'Daily': 1.0, 'Weekly': 0.6, 'Monthly': 0.25}
+
+QUALIFICATION_VALUES = {
+    'M.Tech': 1.0, 'M.E': 1.0, 'MCA': 1.0, 'M.Sc': 0.95,
+    'B.Tech': 0.9, 'B.E': 0.9, 'BCA': 0.8, 'B.Sc': 0.75,
+    'Diploma': 0.6,
+}
+DEFAULT_QUALIFICATION_VALUE = 0.5
+
+INTERNSHIP_MONTHS = {'1 month': 1, '3 months': 3, '6 months': 6, '1 year': 12}
+
+# Counts at which a list-style factor is considered complete
+INTERNSHIP_TARGET_MONTHS = 6
+HACKATHON_TARGET = 3
+TECHNOLOGY_TARGET = 5
+CERTIFICATION_TARGET = 3
+PROJECT_TARGET = 3
+
+# Upper bounds (inclusive) of the Low and Medium bands
+LOW_MAX = 50
+MEDIUM_MAX = 75
+
+_LIST_SEPARATORS = re.compile(r'[,;\n]+')
+_EMPTY_ENTRIES = {'', 'none', 'n/a', 'na', 'nil', '-', '0'}
+
+
+def count_entries(value):
+    """
+    Count entries in a comma/newline separated free-text field
+    A bare number (e.g. hackathons: "3") is taken as the count itself
+    """
+    if isinstance(value, (int, float)):
+        return max(int(value), 0)
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        text = str(value or '').strip()
+        if text.isdigit():
+            return int(text)
+        items = _LIST_SEPARATORS.split(text)
+    return sum(1 for item in items if str(item).strip().lower() not in _EMPTY_ENTRIES)
+
+
+def _ratio(value, maximum):
+    try:
+        return min(max(float(value) / maximum, 0.0), 1.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def internship_months(internships):
+    """Total internship duration in months"""
+    total = 0
+    for internship in internships or []:
+        if isinstance(internship, dict):
+            total += INTERNSHIP_MONTHS.get(internship.get('duration'), 0)
+    return total
+
+
+def profile_features(student_data):
+    """
+    Normalize a student profile into per-factor values in [0, 1], ordered as FACTORS
+    """
+    return [
+        _ratio(student_data.get('cgpa', 0), 10),
+        _ratio(student_data.get('attendance', 0), 100),
+        QUALIFICATION_VALUES.get(student_data.get('qualification'), DEFAULT_QUALIFICATION_VALUE),
+        DSA_FREQUENCY_VALUES.get(student_data.get('dsa_practice_frequency'), 0.0),
+        _ratio(internship_months(student_data.get('internships')), INTERNSHIP_TARGET_MONTHS),
+        _ratio(student_data.get('mock_interview_score', 0), 10),
+        _ratio(student_data.get('resume_score', 0), 100),
+        _ratio(count_entries(student_data.get('hackathons')), HACKATHON_TARGET),
+        _ratio(count_entries(student_data.get('technologies')), TECHNOLOGY_TARGET),
+        _ratio(count_entries(student_data.get('certifications')), CERTIFICATION_TARGET),
+        _ratio(count_entries(student_data.get('projects')), PROJECT_TARGET),
+    ]
+
+
+def readiness_level(score):
+    """Map a 0-100 score to the Low/Medium/High band"""
+    if score <= LOW_MAX:
+        return 'Low'
+    if score <= MEDIUM_MAX:
+        return 'Medium'
+    return 'High'
+
+
+def score_profile(student_data):
+    """
+    Score a single profile
+    Returns readiness_score, readiness_level and each factor's contribution in points
+    """
+    features = profile_features(student_data)
+    breakdown = {}
+    total = 0.0
+    for (factor, weight), value in zip(FACTOR_WEIGHTS, features):
+        points = 100.0 * weight * value / TOTAL_WEIGHT
+        total += points
+        breakdown[factor] = {
+            'weight': weight,
+            'value': round(value, 4),
+            'points': round(points, 2)
+        }
+    score = int(round(total))
+    return {
+        'readiness_score': score,
+        'readiness_level': readiness_level(score),
+        'score_breakdown': breakdown
+    }
+
+
+def features_matrix(profiles):
+    """Stack profile_features() for many profiles into an (n, len(FACTORS)) float array"""
+    import numpy as np
+
+    return np.array([profile_features(profile) for profile in profiles], dtype=np.float64).reshape(-1, len(FACTORS))
+
+
+def score_matrix(features):
+    """
+    Score an (n, len(FACTORS)) array of normalized factor values in one call
+    Returns (scores, levels) as NumPy arrays
+    """
+    import numpy as np
+
+    features = np.asarray(features, dtype=np.float64)
+    weights = np.array([weight for _, weight in FACTOR_WEIGHTS], dtype=np.float64)
+    scores = np.rint(features @ weights * (100.0 / TOTAL_WEIGHT)).astype(np.int64)
+    levels = np.where(scores <= LOW_MAX, 'Low', np.where(scores <= MEDIUM_MAX, 'Medium', 'High'))
+    return scores, levels
+
+
+def score_profiles(profiles):
+    """Score a list of profile dicts in bulk"""
+    return score_matrix(features_matrix(profiles))
@@ -0,0 +1,302 @@
+"""
+Near-duplicate reuse of past analyses
+Students in a cohort often submit almost identical profiles (same tier and DSA frequency,
+CGPA a few tenths apart, overlapping tech stacks) that the exact-hash analysis cache
+misses. Each analysed profile is embedded as a float32 vector: the normalized score
+factors plus hashed bag-of-words of technologies/certifications/projects. A new profile
+within SIMILARITY_MAX_DISTANCE of a past one (with the same tier, department, DSA
+frequency and readiness level) reuses that analysis:
+  fast      the stored analysis is returned directly (names swapped)
+  template  the stored analysis is kept and Gemini only rewrites the summary
+An analysis that still mentions the source student after the swap (including their
+internship companies and project titles) is not reused.
+"""
+
+import copy
+import os
+import re
+import threading
+import zlib
+
+from response_cache import canonical_profile
+from scoring import FACTORS, profile_features
+
+MODES = ('off', 'template', 'fast')
+
+# Hashed bag-of-words dimensions per free-text list field
+BOW_FIELDS = ('technologies', 'certifications', 'projects')
+BOW_DIMENSIONS = 32
+
+# Relative weight of each free-text field against the score factors (each in [0, 1])
+BOW_WEIGHT = 0.15
+
+VECTOR_DIMENSIONS = len(FACTORS) + len(BOW_FIELDS) * BOW_DIMENSIONS
+
+# Profiles are only compared within the same bucket
+BUCKET_FIELDS = ('college_tier', 'department', 'dsa_practice_frequency')
+
+# Identity fields swapped for the new student's values in a reused analysis
+IDENTITY_FIELDS = ('name', 'college', 'location')
+
+# Fields naming things only the source student has (internship companies, project titles);
+# they cannot be swapped, so a reused analysis must not mention them
+PRIVATE_FIELDS = ('internships', 'projects')
+
+# Profile fields kept with each indexed analysis for adapt_analysis()
+SOURCE_FIELDS = IDENTITY_FIELDS + PRIVATE_FIELDS
+
+# Words of institution, place, company and project names that do not identify anyone on their own
+GENERIC_IDENTITY_WORDS = frozenset((
+    'and', 'the', 'for', 'with', 'using', 'based', 'college', 'university', 'institute', 'institution',
+    'school', 'academy', 'technology', 'technologies', 'technological', 'engineering', 'science',
+    'sciences', 'management', 'national', 'state', 'city', 'new', 'north', 'south', 'east', 'west',
+    'campus', 'india', 'pvt', 'ltd', 'private', 'limited', 'inc', 'labs', 'solutions', 'services',
+    'software', 'systems', 'system', 'app', 'application', 'website', 'web', 'portal', 'project', 'tool',
+    'platform', 'dashboard', 'api', 'bot', 'clone', 'tracker', 'online', 'mobile', 'game', 'chat',
+    'analysis', 'prediction', 'detection', 'model', 'data', 'learning', 'machine'
+))
+
+_WORD = re.compile(r'\w+')
+_LIST_SEPARATORS = re.compile(r'[,;\n]+')
+
+
+def profile_vector(student_data):
+    """Feature vector of a profile (float32, VECTOR_DIMENSIONS long)"""
+    import numpy as np
+
+    vector = np.zeros(VECTOR_DIMENSIONS, dtype=np.float32)
+    vector[:len(FACTORS)] = profile_features(student_data)
+    entries = canonical_profile(student_data, BOW_FIELDS)
+    for position, field in enumerate(BOW_FIELDS):
+        start = len(FACTORS) + position * BOW_DIMENSIONS
+        block = vector[start:start + BOW_DIMENSIONS]
+        for entry in entries[field]:
+            block[zlib.crc32(entry.encode('utf-8')) % BOW_DIMENSIONS] += 1.0
+        norm = float(np.linalg.norm(block))
+        if norm:
+            block *= BOW_WEIGHT / norm
+    return vector
+
+
+def profile_bucket(student_data, readiness_level):
+    """Stable hash of the fields a reusable neighbour must match exactly"""
+    canonical = canonical_profile(student_data, BUCKET_FIELDS)
+    key = '\x1f'.join([canonical[field].lower() for field in BUCKET_FIELDS] + [readiness_level])
+    return zlib.crc32(key.encode('utf-8'))
+
+
+def _whole(text):
+    """Pattern matching `text` only as a whole word or phrase (not inside a longer word)"""
+    return re.compile(r'(?<!\w)' + re.escape(text) + r'(?!\w)')
+
+
+def _replace_identity(value, replacements):
+    if isinstance(value, str):
+        for pattern, new in replacements:
+            value = pattern.sub(lambda match: new, value)
+        return value
+    if isinstance(value, list):
+        return [_replace_identity(item, replacements) for item in value]
+    if isinstance(value, dict):
+        return {key: _replace_identity(item, replacements) for key, item in value.items()}
+    return value
+
+
+def _strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+
+
+def private_values(profile):
+    """Internship company names and project titles of a profile"""
+    values = []
+    internships = profile.get('internships') or []
+    if isinstance(internships, list):
+        for internship in internships:
+            company = internship.get('company') if isinstance(internship, dict) else internship
+            values.append(' '.join(str(company or '').split()))
+    projects = profile.get('projects') or ''
+    for project in (projects if isinstance(projects, list) else _LIST_SEPARATORS.split(str(projects))):
+        values.append(' '.join(str(project or '').split()))
+    return [value for value in values if len(value) > 1]
+
+
+def _identity_tokens(profile):
+    texts = [str(profile.get(field) or '') for field in IDENTITY_FIELDS] + private_values(profile)
+    return {token for text in texts for token in _WORD.findall(text)}
+
+
+def adapt_analysis(analysis, source_profile, student_data):
+    """
+    Copy of a neighbour's analysis with its name/college/location replaced by the new student's
+    Values are replaced as whole words only, the source's first name by the new first name.
+    Returns None when a word of the source identity is still mentioned afterwards (a nickname,
+    a surname on its own, another spelling of the college, an internship company or project
+    title), so the caller falls back to Gemini
+    """
+    replacements = []
+    for field in IDENTITY_FIELDS:
+        old = ' '.join(str(source_profile.get(field) or '').split())
+        new = ' '.join(str(student_data.get(field) or '').split())
+        if len(old) > 1 and old != new:
+            replacements.append((_whole(old), new))
+    old_first = str(source_profile.get('name') or '').split()[:1]
+    new_first = str(student_data.get('name') or '').split()[:1]
+    if old_first and new_first and old_first != new_first and len(old_first[0]) > 1:
+        replacements.append((_whole(old_first[0]), new_first[0]))
+    adapted = _replace_identity(copy.deepcopy(analysis), replacements)
+
+    new_tokens = _identity_tokens(student_data)
+    leaks = [token for token in _identity_tokens(source_profile) - new_tokens
+             if len(token) > 1 and token.lower() not in GENERIC_IDENTITY_WORDS]
+    # Whole company names and project titles are matched in any case
+    new_private = {value.lower() for value in private_values(student_data)}
+    phrases = [value for value in private_values(source_profile) if value.lower() not in new_private]
+    patterns = []
+    if leaks:
+        patterns.append(re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, leaks)) + r')(?!\w)'))
+    if phrases:
+        patterns.append(re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, phrases)) + r')(?!\w)', re.IGNORECASE))
+    for pattern in patterns:
+        if any(pattern.search(text) for text in _strings(adapted)):
+            return None
+    return adapted
+
+
+class SimilarityIndex:
+    """
+    Fixed-capacity ring of profile vectors with their analyses
+    nearest() is one vectorized distance computation over the rows of the matching bucket
+    """
+
+    def __init__(self, mode='off', max_distance=0.25, max_entries=5000):
+        if mode not in MODES:
+            raise Exception(f"Unknown similarity mode '{mode}' (expected one of: {', '.join(MODES)})")
+        self.mode = mode
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._vectors = None
+        self._buckets = None
+        self._entries = [None] * max_entries
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loaded_pid = None
+        self.lookups = 0
+        self.matches = 0
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def add(self, student_data, analysis):
+        """Index a freshly generated analysis of `student_data`"""
+        if not self.enabled:
+            return
+        import numpy as np
+
+        vector = profile_vector(student_data)
+        bucket = profile_bucket(student_data, analysis.get('readiness_level', ''))
+        identity = {field: student_data.get(field, '') for field in SOURCE_FIELDS}
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, VECTOR_DIMENSIONS), dtype=np.float32)
+                self._buckets = np.zeros(self.max_entries, dtype=np.int64)
+            # Overwrites the oldest entry once full
+            self._vectors[self._next] = vector
+            self._buckets[self._next] = bucket
+            self._entries[self._next] = (identity, analysis)
+            self._next = (self._next + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def nearest(self, student_data, readiness_level):
+        """(source_profile, analysis, distance) of the closest indexed profile within max_distance, or None"""
+        if not self.enabled:
+            return None
+        import numpy as np
+
+        vector = profile_vector(student_data)
+        bucket = profile_bucket(student_data, readiness_level)
+        with self._lock:
+            self.lookups += 1
+            if not self._size:
+                return None
+            rows = np.flatnonzero(self._buckets[:self._size] == bucket)
+            if not len(rows):
+                return None
+            distances = np.sqrt(((self._vectors[rows] - vector) ** 2).sum(axis=1))
+            best = int(np.argmin(distances))
+            distance = float(distances[best])
+            if distance > self.max_distance:
+                return None
+            self.matches += 1
+            identity, analysis = self._entries[rows[best]]
+        return identity, analysis, distance
+
+    def load(self, documents):
+        """
+        Index up to max_entries stored (doc_id, document) pairs, given newest first
+        Reused, delta and degraded analyses are skipped; the newest ends up as the most recent entry
+        """
+        selected = []
+        for _, document in documents:
+            if (document.get('reuse') or document.get('delta') or document.get('degraded')
+                    or not isinstance(document.get('analysis'), dict)):
+                continue
+            selected.append(document)
+            if len(selected) >= self.max_entries:
+                break
+        for document in reversed(selected):
+            self.add(document.get('student_profile') or {}, document['analysis'])
+        return len(selected)
+
+    def ensure_loaded(self, load_documents):
+        """Index stored analyses once per process, on a background thread"""
+        if not self.enabled or self._loaded_pid == os.getpid():
+            return
+        with self._lock:
+            if self._loaded_pid == os.getpid():
+                return
+            self._loaded_pid = os.getpid()
+        threading.Thread(target=self._load_in_background, args=(load_documents,), daemon=True,
+                         name='similarity-loader').start()
+
+    def _load_in_background(self, load_documents):
+        try:
+            count = self.load(load_documents())
+            print(f"Similarity index: loaded {count} stored analyses")
+        except Exception as e:
+            print(f"Warning: Could not load stored analyses into the similarity index: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'max_distance': self.max_distance,
+                'entries': self._size,
+                'lookups': self.lookups,
+                'matches': self.matches,
+                'match_rate': round(self.matches / self.lookups, 4) if self.lookups else 0.0
+            }
+
+
+def create_similarity_index():
+    """
+    Build the similarity index from environment variables
+    SIMILARITY_MODE: off (default), template or fast
+    """
+    mode = os.getenv('SIMILARITY_MODE', 'off').lower()
+    if mode not in MODES:
+        print(f"Warning: Unknown SIMILARITY_MODE '{mode}', near-duplicate reuse disabled")
+        mode = 'off'
+    return SimilarityIndex(
+        mode=mode,
+        max_distance=float(os.getenv('SIMILARITY_MAX_DISTANCE', 0.25)),
+        max_entries=int(os.getenv('SIMILARITY_INDEX_SIZE', 5000))
+    )
@@ -0,0 +1,434 @@
+"""
+Storage backends for analysis documents and cohort rollups
+FirestoreStore keeps documents in Firestore; SQLiteStore keeps them in a local SQLite
+database (WAL mode, indexed on (user_id, timestamp), timestamp and readiness_score) for on-prem and
+offline deployments and for running against real persistence without a network.
+STORAGE_BACKEND selects one; both expose the same methods:
+
+    commit(entries, rollups=None)      write (doc_id, document) pairs and rollup increments atomically
+    get(doc_id)                        one document, or None
+    user_history(user_id, page_size, cursor=None, fields=None)
+                                       (documents, has_more, ordered), newest first
+    iter_documents(page_size, user_id=None, fields=None)
+    iter_recent_documents(page_size, fields=None)
+                                       every document, newest first
+    load_rollups() / replace_rollups(documents)
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+from cohorts import ROLLUP_COLLECTION, Rollup
+
+ANALYSIS_COLLECTION = 'student_analyses'
+
+# Firestore accepts at most 500 writes per batch
+FIRESTORE_BATCH_LIMIT = 500
+
+# Top-level document fields stored as SQLite columns (summary history reads skip the JSON)
+SQLITE_COLUMNS = ('timestamp', 'readiness_score', 'readiness_level')
+
+
+class InvalidCursor(Exception):
+    """Raised by user_history() for a cursor that names no stored document"""
+
+
+def _encode(document):
+    return json.dumps(document, separators=(',', ':'), default=str)
+
+
+def _project(document, fields):
+    """Keep only `fields` (dotted paths allowed) of a document, like a Firestore select()"""
+    if not fields:
+        return document
+    projected = {}
+    for field in fields:
+        source, target = document, projected
+        parts = field.split('.')
+        for part in parts[:-1]:
+            if not isinstance(source, dict) or part not in source:
+                source = None
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        if isinstance(source, dict) and parts[-1] in source:
+            target[parts[-1]] = source[parts[-1]]
+    return projected
+
+
+class FirestoreStore:
+    """Documents in the `student_analyses` collection, rollups in `cohort_rollups`"""
+
+    name = 'firestore'
+
+    def __init__(self, db):
+        self.db = db
+
+    def commit(self, entries, rollups=None):
+        """One batched write; keep entries plus rollups within FIRESTORE_BATCH_LIMIT"""
+        collection = self.db.collection(ANALYSIS_COLLECTION)
+        batch = self.db.batch()
+        for doc_id, document in entries:
+            batch.set(collection.document(doc_id), document)
+        if rollups:
+            from google.cloud.firestore_v1 import Increment
+
+            rollup_collection = self.db.collection(ROLLUP_COLLECTION)
+            for key, delta in rollups.items():
+                batch.set(rollup_collection.document(key), delta.to_increments(Increment), merge=True)
+        batch.commit()
+
+    def get(self, doc_id):
+        doc = self.db.collection(ANALYSIS_COLLECTION).document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def existing(self, doc_ids):
+        """The subset of `doc_ids` already stored (one batched read, no fields transferred)"""
+        if not doc_ids:
+            return set()
+        collection = self.db.collection(ANALYSIS_COLLECTION)
+        docs = self.db.get_all([collection.document(doc_id) for doc_id in doc_ids], field_paths=[])
+        return {doc.id for doc in docs if doc.exists}
+
+    def user_history(self, user_id, page_size, cursor=None, fields=None):
+        """
+        One page of a user's documents, newest first, as (doc_id, document) pairs
+        Falls back to an unordered query when the composite index is missing
+        (ordered is then False and the caller sorts the page)
+        """
+        collection = self.db.collection(ANALYSIS_COLLECTION)
+        cursor_snapshot = None
+        if cursor:
+            cursor_snapshot = collection.document(cursor).get()
+            if not cursor_snapshot.exists:
+                raise InvalidCursor(cursor)
+
+        def build_query(ordered):
+            query = collection.where('user_id', '==', user_id)
+            if ordered:
+                query = query.order_by('timestamp', direction='DESCENDING')
+            if fields:
+                # Projection: only the requested fields cross the wire
+                query = query.select(fields)
+            if cursor_snapshot is not None:
+                query = query.start_after(cursor_snapshot)
+            # Fetch one extra document to know whether another page exists
+            return query.limit(page_size + 1)
+
+        ordered = True
+        try:
+            docs = list(build_query(ordered=True).stream())
+        except Exception as order_error:
+            print(f"Warning: Could not order by timestamp, fetching without order: {order_error}")
+            ordered = False
+            docs = list(build_query(ordered=False).stream())
+
+        return [(doc.id, doc.to_dict()) for doc in docs[:page_size]], len(docs) > page_size, ordered
+
+    def iter_documents(self, page_size=500, user_id=None, fields=None):
+        """Yield (doc_id, document) for every stored analysis, one page in memory at a time"""
+        query = self.db.collection(ANALYSIS_COLLECTION)
+        if user_id:
+            query = query.where('user_id', '==', user_id)
+        if fields:
+            query = query.select(fields)
+        query = query.order_by('__name__')
+        last = None
+        while True:
+            page_query = query.start_after(last) if last is not None else query
+            page = list(page_query.limit(page_size).stream())
+            for doc in page:
+                yield doc.id, doc.to_dict()
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    def iter_recent_documents(self, page_size=500, fields=None):
+        """Yield (doc_id, document) for stored analyses, newest first, one page in memory at a time"""
+        query = self.db.collection(ANALYSIS_COLLECTION)
+        if fields:
+            query = query.select(list(fields) + ['timestamp'])
+        query = query.order_by('timestamp', direction='DESCENDING')
+        last = None
+        while True:
+            page_query = query.start_after(last) if last is not None else query
+            page = list(page_query.limit(page_size).stream())
+            for doc in page:
+                yield doc.id, doc.to_dict()
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    def load_rollups(self):
+        return {doc.id: doc.to_dict() for doc in self.db.collection(ROLLUP_COLLECTION).stream()}
+
+    def replace_rollups(self, documents):
+        """Replace the stored rollups with `documents` (removing cohorts that no longer exist)"""
+        collection = self.db.collection(ROLLUP_COLLECTION)
+        stale = [doc.id for doc in collection.select([]).stream() if doc.id not in documents]
+        writes = list(documents.items()) + [(key, None) for key in stale]
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for key, document in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+                if document is None:
+                    batch.delete(collection.document(key))
+                else:
+                    batch.set(collection.document(key), document)
+            batch.commit()
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections shared by request and worker threads
+    A connection is used by one thread at a time; callers block (up to `timeout`
+    seconds) when all of them are checked out
+    """
+
+    def __init__(self, connect, size=8, timeout=30.0):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                opening = True
+            else:
+                opening = False
+        if opening:
+            try:
+                return self.connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Exception(f"No SQLite connection free after {self.timeout}s (pool size {self.size})")
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def stats(self):
+        return {'size': self.size, 'open': self._opened, 'idle': self._idle.qsize()}
+
+
+class SQLiteStore:
+    """
+    Documents and rollups in a local SQLite database
+    Documents are stored as JSON next to indexed columns for the fields history and
+    ranking queries filter and sort on
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, pool_size=8, timeout=30.0):
+        self.path = path
+        self._memory = path == ':memory:'
+        # A private shared-cache database so the pooled connection outlives any one caller;
+        # shared-cache locks are not retried, so in-memory stores use a single connection
+        self._uri = f"file:storage-{uuid.uuid4().hex}?mode=memory&cache=shared" if self._memory else path
+        self.pool = ConnectionPool(self._connect, size=1 if self._memory else pool_size, timeout=timeout)
+        with self.pool.connection() as conn:
+            self._create_schema(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self._uri, uri=self._memory, timeout=self.pool.timeout,
+                               check_same_thread=False, isolation_level=None)
+        if not self._memory:
+            conn.execute('PRAGMA journal_mode=WAL')
+            # WAL makes NORMAL durable against application crashes; only power loss can drop the last commits
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _create_schema(self, conn):
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {ANALYSIS_COLLECTION} ('
+            ' id TEXT PRIMARY KEY,'
+            ' user_id TEXT NOT NULL,'
+            ' timestamp TEXT NOT NULL,'
+            ' readiness_score INTEGER,'
+            ' readiness_level TEXT,'
+            ' document TEXT NOT NULL)'
+        )
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_{ANALYSIS_COLLECTION}_user_timestamp'
+            f' ON {ANALYSIS_COLLECTION} (user_id, timestamp)'
+        )
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_{ANALYSIS_COLLECTION}_score ON {ANALYSIS_COLLECTION} (readiness_score)'
+        )
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_{ANALYSIS_COLLECTION}_timestamp ON {ANALYSIS_COLLECTION} (timestamp, id)'
+        )
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {ROLLUP_COLLECTION} (id TEXT PRIMARY KEY, document TEXT NOT NULL)')
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction; BEGIN IMMEDIATE takes the write lock up front so rollup read-modify-writes are atomic"""
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def commit(self, entries, rollups=None):
+        rows = []
+        for doc_id, document in entries:
+            timestamp = document.get('timestamp', '')
+            rows.append((
+                doc_id,
+                document.get('user_id', ''),
+                timestamp.isoformat() if hasattr(timestamp, 'isoformat') else str(timestamp),
+                document.get('readiness_score'),
+                document.get('readiness_level'),
+                _encode(document)
+            ))
+        with self._transaction() as conn:
+            conn.executemany(
+                f'INSERT OR REPLACE INTO {ANALYSIS_COLLECTION}'
+                ' (id, user_id, timestamp, readiness_score, readiness_level, document) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            for key, delta in (rollups or {}).items():
+                row = conn.execute(f'SELECT document FROM {ROLLUP_COLLECTION} WHERE id = ?', (key,)).fetchone()
+                rollup = Rollup.from_document(json.loads(row[0])) if row else Rollup(delta.dimension, delta.value)
+                rollup.merge(delta)
+                conn.execute(f'INSERT OR REPLACE INTO {ROLLUP_COLLECTION} (id, document) VALUES (?, ?)',
+                             (key, _encode(rollup.to_document())))
+
+    def get(self, doc_id):
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT document FROM {ANALYSIS_COLLECTION} WHERE id = ?', (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def existing(self, doc_ids):
+        """The subset of `doc_ids` already stored"""
+        if not doc_ids:
+            return set()
+        doc_ids = list(doc_ids)
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f'SELECT id FROM {ANALYSIS_COLLECTION} WHERE id IN ({", ".join("?" * len(doc_ids))})', doc_ids
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def user_history(self, user_id, page_size, cursor=None, fields=None):
+        """
+        One page of a user's documents, newest first, as (doc_id, document) pairs
+        Served from the (user_id, timestamp) index; summary fields are read from columns
+        """
+        from_columns = bool(fields) and all(field in SQLITE_COLUMNS for field in fields)
+        where = 'user_id = ?'
+        params = [user_id]
+        with self.pool.connection() as conn:
+            if cursor:
+                row = conn.execute(f'SELECT timestamp FROM {ANALYSIS_COLLECTION} WHERE id = ?', (cursor,)).fetchone()
+                if row is None:
+                    raise InvalidCursor(cursor)
+                where += ' AND (timestamp < ? OR (timestamp = ? AND id < ?))'
+                params += [row[0], row[0], cursor]
+            rows = conn.execute(
+                f'SELECT id, timestamp, readiness_score, readiness_level, {"NULL" if from_columns else "document"}'
+                f' FROM {ANALYSIS_COLLECTION} WHERE {where} ORDER BY timestamp DESC, id DESC LIMIT ?',
+                params + [page_size + 1]
+            ).fetchall()
+
+        documents = []
+        for doc_id, timestamp, readiness_score, readiness_level, document in rows[:page_size]:
+            if from_columns:
+                columns = {'timestamp': timestamp, 'readiness_score': readiness_score, 'readiness_level': readiness_level}
+                documents.append((doc_id, {field: columns[field] for field in fields}))
+            else:
+                documents.append((doc_id, _project(json.loads(document), fields)))
+        return documents, len(rows) > page_size, True
+
+    def iter_documents(self, page_size=500, user_id=None, fields=None):
+        """Yield (doc_id, document) for every stored analysis, one page in memory at a time"""
+        last = ''
+        while True:
+            where = 'id > ?' + (' AND user_id = ?' if user_id else '')
+            params = [last] + ([user_id] if user_id else [])
+            with self.pool.connection() as conn:
+                page = conn.execute(
+                    f'SELECT id, document FROM {ANALYSIS_COLLECTION} WHERE {where} ORDER BY id LIMIT ?',
+                    params + [page_size]
+                ).fetchall()
+            for doc_id, document in page:
+                yield doc_id, _project(json.loads(document), fields)
+            if len(page) < page_size:
+                return
+            last = page[-1][0]
+
+    def iter_recent_documents(self, page_size=500, fields=None):
+        """Yield (doc_id, document) for stored analyses, newest first, one page in memory at a time"""
+        last = None
+        while True:
+            where = '(timestamp < ? OR (timestamp = ? AND id < ?))' if last else '1'
+            with self.pool.connection() as conn:
+                page = conn.execute(
+                    f'SELECT id, timestamp, document FROM {ANALYSIS_COLLECTION} WHERE {where}'
+                    ' ORDER BY timestamp DESC, id DESC LIMIT ?',
+                    (list(last) if last else []) + [page_size]
+                ).fetchall()
+            for doc_id, _, document in page:
+                yield doc_id, _project(json.loads(document), fields)
+            if len(page) < page_size:
+                return
+            last = (page[-1][1], page[-1][1], page[-1][0])
+
+    def load_rollups(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'SELECT id, document FROM {ROLLUP_COLLECTION}').fetchall()
+        return {key: json.loads(document) for key, document in rows}
+
+    def replace_rollups(self, documents):
+        with self._transaction() as conn:
+            conn.execute(f'DELETE FROM {ROLLUP_COLLECTION}')
+            conn.executemany(f'INSERT INTO {ROLLUP_COLLECTION} (id, document) VALUES (?, ?)',
+                             [(key, _encode(document)) for key, document in documents.items()])
+
+    def stats(self):
+        return {'backend': self.name, 'path': self.path, 'pool': self.pool.stats()}
+
+
+def create_store(get_firestore):
+    """
+    Storage backend selected by STORAGE_BACKEND ("firestore", the default, or "sqlite")
+    Returns None when Firestore is selected but not configured
+    """
+    backend = os.getenv('STORAGE_BACKEND', 'firestore').lower()
+    if backend == 'sqlite':
+        path = os.getenv('STORAGE_SQLITE_PATH') or os.path.join(os.path.dirname(__file__), 'analyses.db')
+        store = SQLiteStore(path, pool_size=int(os.getenv('STORAGE_SQLITE_POOL_SIZE', 8)))
+        print(f"Using SQLite storage at {path}")
+        return store
+    if backend != 'firestore':
+        raise Exception(f"Unknown STORAGE_BACKEND '{backend}' (expected firestore or sqlite)")
+    db = get_firestore()
+    return FirestoreStore(db) if db is not None else None
@@ -0,0 +1,130 @@
+"""
+Server-sent events support for /analyze/stream
+Incrementally parses Gemini's streamed JSON so each analysis section can be
+pushed to the client as soon as it is complete
+"""
+
+import json
+import re
+
+# Top-level fields whose value is streamed week-by-week instead of as one event
+PLAN_FIELD = '30_day_plan'
+
+# Top-level fields that are not forwarded; the locally computed score is sent instead
+SKIPPED_FIELDS = ('readiness_score', 'readiness_level', 'score_breakdown')
+
+_MEMBER_KEY = re.compile(r'\s*"((?:[^"\\]|\\.)*)"\s*:')
+
+
+def format_sse(event, data):
+    """Encode one server-sent event"""
+    payload = json.dumps(data, separators=(',', ':'))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class AnalysisSectionParser:
+    """
+    Incremental scanner over a streamed analysis JSON object
+    feed() returns (event, data) pairs for every top-level member (and every
+    30_day_plan week) completed by the new text
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        # One entry per open container: [bracket, member_start, member_key]
+        self._stack = []
+
+    def feed(self, text):
+        self._buffer += text
+        events = []
+        buffer = self._buffer
+
+        if not self._started:
+            # Skip any leading markdown fence or prose before the JSON object
+            start = buffer.find('{', self._pos)
+            if start == -1:
+                self._pos = len(buffer)
+                return events
+            self._started = True
+            self._pos = start
+
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if self._stack and self._stack[-1][0] == '{' and self._stack[-1][2] is None:
+                    self._stack[-1][2] = self._member_key(self._stack[-1][1], i)
+                self._stack.append([char, i + 1, None])
+            elif char in ',}]':
+                if self._stack and self._stack[-1][0] == '{':
+                    self._emit_member(self._stack[-1][1], i, events)
+                if char == ',':
+                    if self._stack:
+                        self._stack[-1][1] = i + 1
+                        self._stack[-1][2] = None
+                elif self._stack:
+                    self._stack.pop()
+            i += 1
+
+        self._pos = i
+        return events
+
+    def _member_key(self, start, end):
+        match = _MEMBER_KEY.match(self._buffer, start, end)
+        return json.loads(f'"{match.group(1)}"') if match else None
+
+    def _emit_member(self, start, end, events):
+        depth = len(self._stack)
+        if depth == 1:
+            parent_key = None
+        elif depth == 2:
+            parent_key = self._stack[0][2]
+            if parent_key != PLAN_FIELD:
+                return
+        else:
+            return
+
+        text = self._buffer[start:end].strip()
+        if not text:
+            return
+        try:
+            member = json.loads('{' + text + '}')
+        except ValueError:
+            return
+
+        for key, value in member.items():
+            if parent_key == PLAN_FIELD:
+                week = {'week': key}
+                if isinstance(value, dict):
+                    week.update(value)
+                events.append(('plan_week', week))
+            elif key not in SKIPPED_FIELDS and key != PLAN_FIELD:
+                events.append((key, value))
+
+
+def analysis_sections(analysis_result):
+    """Split a complete analysis into the same (event, data) pairs the parser emits"""
+    for key, value in analysis_result.items():
+        if key in SKIPPED_FIELDS:
+            continue
+        if key == PLAN_FIELD and isinstance(value, dict):
+            for week_key, week_value in value.items():
+                week = {'week': week_key}
+                if isinstance(week_value, dict):
+                    week.update(week_value)
+                yield 'plan_week', week
+        elif key != PLAN_FIELD:
+            yield key, value
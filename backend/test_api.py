@@ -25,13 +25,23 @@ def test_analyze():
     print("\nTesting /analyze endpoint...")
     
     sample_data = {
+        "name": "Test Student",
+        "location": "Pune",
+        "college": "Example Institute of Technology",
+        "college_tier": "Tier 2",
+        "qualification": "B.Tech",
+        "department": "Computer Science",
+        "cgpa": 7.8,
         "attendance": 85,
-        "cgpa_range": "7-8",
-        "dsa_practice": 5,
-        "projects": 3,
-        "internship": "Short",
-        "mock_interview": 75,
-        "resume_score": 80
+        "hackathons": "2",
+        "technologies": "Python, Java, React",
+        "certifications": "AWS Cloud Practitioner",
+        "projects": "Placement portal, Chat app",
+        "dsa_practice_frequency": "Weekly",
+        "internships": [{"company": "Acme", "duration": "3 months"}],
+        "mock_interview_score": 7,
+        "resume_score": 80,
+        "user_id": "test-user"
     }
     
     try:
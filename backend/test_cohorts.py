@@ -0,0 +1,57 @@
+"""
+Tests for the cohort rollups (run with: python -m pytest test_cohorts.py)
+"""
+
+from bench_fakes import FakeFirestore
+from cohorts import ROLLUP_COLLECTION, WEAK_AREA_CATEGORIES, Rollup, rebuild_rollups, rollup_deltas
+from storage import FirestoreStore
+
+
+def make_document(index, college_tier='Tier 1', weak_areas=None):
+    return {
+        'readiness_score': 40 + index % 50,
+        'readiness_level': 'Medium',
+        'student_profile': {'college_tier': college_tier, 'department': 'CSE', 'dsa_practice_frequency': 'Daily'},
+        'analysis': {'weak_areas': weak_areas if weak_areas is not None else [f"Weakness number {index}"]}
+    }
+
+
+def test_firestore_rollup_documents_stay_bounded():
+    db = FakeFirestore(latency=0)
+    store = FirestoreStore(db)
+    for start in range(0, 1000, 100):
+        entries = []
+        for index in range(start, start + 100):
+            # Every analysis words its weak areas differently
+            weak_areas = [f"Needs more mock interview practice ({index})", f"Unique gap {index}",
+                          f"Improve DSA topic {index}"]
+            entries.append((f"doc{index}", make_document(index, weak_areas=weak_areas)))
+        store.commit(entries, rollup_deltas(document for _, document in entries))
+
+    rollup = db.collection(ROLLUP_COLLECTION).document('college_tier__tier_1').get().to_dict()
+    assert rollup['count'] == 1000
+    assert set(rollup['weak_areas']) <= set(WEAK_AREA_CATEGORIES)
+    assert rollup['weak_areas'] == {'mock_interview_score': 1000, 'other': 1000, 'dsa_practice_frequency': 1000}
+
+
+def test_rebuild_merges_values_with_the_same_rollup_id():
+    documents = [make_document(0, 'Tier 1'), make_document(1, 'tier-1'), make_document(2, 'TIER 1'),
+                 make_document(3, 'Tier 2')]
+    rebuilt = rebuild_rollups(documents)
+    assert rebuilt['college_tier__tier_1'].count == 3
+    assert rebuilt['college_tier__tier_1'].value == 'Tier 1'
+    assert rebuilt['college_tier__tier_2'].count == 1
+    assert rebuilt['all__all'].count == 4
+
+
+def test_rebuild_matches_incremental_rollups():
+    documents = [make_document(index, tier, ['Low CGPA', 'No internships'])
+                 for index, tier in enumerate(['Tier 1', 'tier-1', 'Tier 2', 'tier 2', 'Tier 3'])]
+    incremental = {}
+    for document in documents:
+        for key, delta in rollup_deltas([document]).items():
+            incremental.setdefault(key, Rollup(delta.dimension, delta.value)).merge(delta)
+    rebuilt = rebuild_rollups(documents)
+    assert set(rebuilt) == set(incremental)
+    for key, rollup in rebuilt.items():
+        assert rollup.to_document() == incremental[key].to_document()
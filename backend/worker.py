@@ -0,0 +1,111 @@
+"""
+Worker pool for /analyze?async=1 jobs
+Runs separately from the web workers, so HTTP capacity does not depend on how many
+Gemini calls are in flight. Each process claims jobs from the shared queue (highest
+priority first) on `--threads` threads and runs the same analysis and save path as
+/analyze. Throughput is processes x threads concurrent analyses (still subject to
+GEMINI_RPM/GEMINI_TPM in each process).
+
+    python worker.py --processes 2 --threads 4
+
+gunicorn.conf.py starts the same pool next to the web workers when JOB_WORKER_PROCESSES is set.
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+
+def run_worker(threads=4, poll_interval=0.5):
+    """Claim and run jobs until SIGTERM/SIGINT (one worker process)"""
+    import app as backend
+
+    queue = backend.get_job_queue()
+    if queue is None:
+        raise SystemExit("Job queue could not be opened")
+    if backend.get_store():
+        backend.write_queue.ensure_started()
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+
+    def loop(thread_index):
+        worker_id = f"{worker_name}:{thread_index}"
+        while not stop.is_set():
+            try:
+                claimed = queue.claim(worker_id)
+            except Exception as e:
+                print(f"Job worker {worker_id}: could not claim a job: {e}")
+                claimed = None
+            if claimed is None:
+                stop.wait(poll_interval)
+                continue
+            job_id, payload, attempts = claimed
+            print(f"Job worker {worker_id}: running job {job_id} (attempt {attempts})")
+            backend.process_analysis_job(job_id, payload, worker_id)
+
+    workers = [threading.Thread(target=loop, args=(index,), name=f'job-worker-{index}', daemon=True)
+               for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    print(f"Job worker process {os.getpid()} started with {threads} threads")
+    while not stop.is_set():
+        stop.wait(1.0)
+    # Let running jobs finish, then write out their documents
+    for worker in workers:
+        worker.join()
+    backend.write_queue.shutdown()
+
+
+def start_worker_pool(processes, threads=4, poll_interval=0.5):
+    """
+    Start `processes` worker processes; returns them
+    Spawned rather than forked, so no SDK client or gRPC channel of the parent is inherited
+    """
+    context = multiprocessing.get_context('spawn')
+    pool = []
+    for index in range(processes):
+        process = context.Process(target=run_worker, args=(threads, poll_interval),
+                                  name=f'analysis-worker-{index}', daemon=True)
+        process.start()
+        pool.append(process)
+    return pool
+
+
+def stop_worker_pool(pool, timeout=60.0):
+    """SIGTERM the pool and wait for running jobs to finish"""
+    for process in pool:
+        if process.is_alive():
+            process.terminate()
+    for process in pool:
+        process.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=int(os.getenv('JOB_WORKER_PROCESSES', 0) or 2))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('JOB_WORKER_THREADS', 4)),
+                        help='concurrent jobs per process')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='seconds between polls of an idle queue')
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.threads, args.poll_interval)
+        return
+
+    pool = start_worker_pool(args.processes, args.threads, args.poll_interval)
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    while not stop.is_set() and any(process.is_alive() for process in pool):
+        stop.wait(1.0)
+    stop_worker_pool(pool)
+
+
+if __name__ == '__main__':
+    main()